@@ -0,0 +1,92 @@
+#! /usr/bin/env python3
+"""
+Memory benchmark of the syntax tree and the generated actions.
+
+A synthetic NML file is generated with a number of switches, each with a mixed
+arithmetic / conditional expression and three ranges. The memory in use after
+parsing, pre-processing and generating the actions is measured with tracemalloc.
+
+Usage: benchmark/memory.py [-n <num>] [--keep <file>]
+"""
+
+import optparse, os, sys, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from nml import generic, main
+from nml.actions import action1
+
+def generate(num_switches):
+    """
+    Generate the NML code of the benchmark.
+
+    @param num_switches: Number of switches to generate.
+    @type  num_switches: C{int}
+
+    @return: NML code.
+    @rtype:  C{str}
+    """
+    lines = []
+    # The switches form a binary tree, every switch except the first one is used by its parent.
+    # Each switch directly follows its children, so few action2 IDs are in use at the same time.
+    def add_switch(i):
+        children = [child for child in (2 * i + 1, 2 * i + 2) if child < num_switches]
+        for child in children:
+            add_switch(child)
+        results = ["switch_{:d};".format(child) if child < num_switches else "return {:d};".format(child % 255) for child in (2 * i + 1, 2 * i + 2)]
+        lines.append("switch(FEAT_TRAINS, SELF, switch_{:d}, (current_year - {:d}) * 3 + (position_in_consist > {:d} ? random_bits & 0xF : {:d})) {{".format(i, i % 50, i % 7, i % 13))
+        lines.append("    0..{:d}: {}".format(i % 20, results[0]))
+        lines.append("    {:d}..{:d}: {}".format(i % 20 + 1, i % 20 + 10, results[1]))
+        lines.append("    {:d}: return {:d};".format(i % 20 + 20, i % 255))
+        lines.append("    return {:d};".format((i + 1) % 255))
+        lines.append("}")
+    add_switch(0)
+    lines.append("item(FEAT_TRAINS, bench_train) {")
+    lines.append("    graphics { speed: switch_0; }")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+def measure(script):
+    """
+    Parse, pre-process and generate the actions of some NML code.
+
+    @param script: NML code.
+    @type  script: C{str}
+
+    @return: Memory in use with the generated actions, and the peak memory use, in bytes.
+    @rtype:  C{tuple} of (C{int}, C{int})
+    """
+    nml_parser = main.get_parser()
+    tracemalloc.start()
+    result = nml_parser.parse(script, "benchmark.nml")
+    result.validate([])
+    result.register_names()
+    result.pre_process()
+    actions = []
+    for action in result.get_action_list():
+        if isinstance(action, action1.SpritesetCollection):
+            actions.extend(action.get_action_list())
+        else:
+            actions.append(action)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, peak
+
+def run():
+    opt_parser = optparse.OptionParser(usage = "Usage: %prog [options]")
+    opt_parser.add_option("-n", "--switches", type = "int", dest = "switches", default = 4000, metavar = "<num>",
+                          help = "Number of switches to generate [default: %default]")
+    opt_parser.add_option("--keep", dest = "keep", metavar = "<file>", help = "Write the generated NML code to <file>")
+    opts, args = opt_parser.parse_args()
+
+    generic.set_verbosity(0)
+    script = generate(opts.switches)
+    if opts.keep is not None:
+        with open(opts.keep, 'w', encoding = 'utf-8') as f:
+            f.write(script)
+
+    current, peak = measure(script)
+    print("{:d} switches: {:d} KiB in use after generating the actions, {:d} KiB peak".format(opts.switches, current // 1024, peak // 1024))
+
+if __name__ == '__main__':
+    run()
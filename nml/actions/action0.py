@@ -13,6 +13,7 @@ You should have received a copy of the GNU General Public License along
 with NML; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
 
+import bisect
 from nml.actions.action0properties import BaseAction0Property, Action0Property, properties, two_byte_property
 from nml import generic, expression, nmlop, grfstrings
 from nml.actions import base_action, action4, action6, actionD, action7
@@ -24,13 +25,12 @@ class BlockAllocation(object):
     Blocks always start at address C{0}, but the first available freely usable
     address may be further.
 
-    The allocation information is kept in L{allocated}. It has the following cases
-    - An address does not exist in the dictionary.
-      The address is free for use.
-    - An address exists, with an integer number as size.
-      At this address a block has been allocated with that size.
-    - An address exists, with value C{None}.
-      The address is part of an allocated block, but not the start.
+    The allocation information is kept per block rather than per address, so
+    memory use and lookup time do not depend on the size of the blocks.
+    L{allocated} maps the first address of every allocated block to its size,
+    L{block_starts} holds the same addresses in sorted order, such that the block
+    covering an address can be found with a binary search. Marking a block as used
+    inserts into this list, which takes time linear in the number of blocks.
 
     @ivar first: First freely usable address.
     @type first: C{int}
@@ -44,8 +44,14 @@ class BlockAllocation(object):
     @ivar dynamic_allocation: True, if ids are allocated. False, if they refer to static entities.
     @type dynamic_allocation: C{bool}
 
-    @ivar allocated: Mapping of allocated blocks.
-    @type allocated: C{dict} of C{int} to allocation information.
+    @ivar allocated: Mapping of the first address of allocated blocks to their size.
+    @type allocated: C{dict} of C{int} to C{int}
+
+    @ivar block_starts: Sorted list of the first address of all allocated blocks.
+    @type block_starts: C{list} of C{int}
+
+    @ivar num_allocated: Total number of allocated addresses.
+    @type num_allocated: C{int}
 
     @ivar filled: Mapping of block size to smallest address that may contain free space.
                   Serves as a cache to speed up searches.
@@ -57,6 +63,8 @@ class BlockAllocation(object):
         self.name = name
         self.dynamic_allocation = dynamic_allocation
         self.allocated = {}
+        self.block_starts = []
+        self.num_allocated = 0
         self.filled = {}
 
     def get_num_allocated(self):
@@ -64,7 +72,7 @@ class BlockAllocation(object):
         Return number of allocated ids.
         """
         if self.dynamic_allocation:
-            return len(self.allocated)
+            return self.num_allocated
         else:
             return 0
 
@@ -116,7 +124,28 @@ class BlockAllocation(object):
         @return: Whether the space at the provided address is available.
         @rtype:  C{bool}
         """
-        return addr not in self.allocated
+        if addr in self.allocated: return False
+        return self.get_block_end(addr, 1) is None
+
+    def get_block_end(self, addr, length):
+        """
+        Find the allocated block with the highest address that overlaps a range of addresses.
+
+        @param addr: First address of the range.
+        @type  addr: C{int}
+
+        @param length: Number of addresses in the range.
+        @type  length: C{int}
+
+        @return: The last address of that block, or C{None} if all addresses in the range are free.
+        @rtype:  C{int} or C{None}
+        """
+        # Blocks do not overlap, so only the last block starting in or before the range can cover its end
+        idx = bisect.bisect_right(self.block_starts, addr + length - 1) - 1
+        if idx < 0: return None
+        start = self.block_starts[idx]
+        end = start + self.allocated[start] - 1
+        return end if end >= addr else None
 
     def get_last_used(self, addr, length):
         """
@@ -133,9 +162,9 @@ class BlockAllocation(object):
 
         @precond: Addresses of the range should be within the available address space.
         """
-        for idx in range(addr + length - 1, addr - 1, -1):
-            if idx in self.allocated: return idx
-        return None
+        end = self.get_block_end(addr, length)
+        if end is None: return None
+        return min(end, addr + length - 1)
 
     def mark_used(self, addr, length):
         """
@@ -150,9 +179,10 @@ class BlockAllocation(object):
         @precond: Addresses of the block should be within the freely available address space.
         @precond: No address in the block may have been allocated.
         """
+        # The insertion shifts the later block starts, so this is linear in the number of blocks
+        bisect.insort(self.block_starts, addr)
         self.allocated[addr] = length
-        for idx in range(addr + 1, addr + length):
-            self.allocated[idx] = None
+        self.num_allocated += length
 
     def find_unused(self, length):
         """
@@ -174,12 +204,13 @@ class BlockAllocation(object):
 
         last_idx = self.last - length + 1
         while idx < last_idx:
-            last_used = self.get_last_used(idx, length)
-            if last_used is None:
+            block_end = self.get_block_end(idx, length)
+            if block_end is None:
                 self.filled[length] = idx + length
                 return idx
 
-            idx = last_used + 1
+            # Skip the whole blocking block at once, no address in it is free
+            idx = block_end + 1
 
         return None
 
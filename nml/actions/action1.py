@@ -98,7 +98,7 @@ class SpritesetCollection(base_action.BaseAction):
         if feature != self.feature:
             return False
         for spriteset in spritesets:
-            if len(real_sprite.parse_sprite_data(spriteset)) != self.num_sprites_per_spriteset:
+            if real_sprite.get_sprite_count(spriteset) != self.num_sprites_per_spriteset:
                 return False
         num_new_sets = sum(1 for x in spritesets if x not in self.spritesets)
         return len(self.spritesets) + num_new_sets <= max_sprite_block_size
@@ -190,9 +190,9 @@ def add_to_action1(spritesets, feature, pos):
     if not spritesets:
         return []
 
-    setsize = len(real_sprite.parse_sprite_data(spritesets[0]))
+    setsize = real_sprite.get_sprite_count(spritesets[0])
     for spriteset in spritesets:
-        if setsize != len(real_sprite.parse_sprite_data(spriteset)):
+        if setsize != real_sprite.get_sprite_count(spriteset):
             raise generic.ScriptError("Using spritesets with different sizes in a single sprite group / layout is not possible", pos)
 
     global spriteset_stats
@@ -202,7 +202,7 @@ def add_to_action1(spritesets, feature, pos):
     global last_spriteset_collection
     actions = []
     if last_spriteset_collection is None or not last_spriteset_collection.can_add(spritesets, feature):
-        last_spriteset_collection = SpritesetCollection(feature, len(real_sprite.parse_sprite_data(spritesets[0])))
+        last_spriteset_collection = SpritesetCollection(feature, real_sprite.get_sprite_count(spritesets[0]))
         actions.append(last_spriteset_collection)
 
     last_spriteset_collection.add(spritesets)
@@ -13,13 +13,13 @@ You should have received a copy of the GNU General Public License along
 with NML; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
 
+import bisect
 from nml import generic
-from nml.actions import base_action
+from nml.actions import base_action, action6
 from nml.ast import base_statement, general
 import nml
 
 total_action2_ids = 0x100
-free_action2_ids = list(range(0, total_action2_ids))
 
 """
 Statistics about spritegroups.
@@ -69,8 +69,12 @@ class Action2(base_action.BaseAction):
     @type references: C{list} of L{Action2Reference}
 
     @ivar tmp_locations: List of address in the temporary storage that are free
-                         to be used in this varaction2.
-    @type tmp_locations: C{list} of C{int}
+                         to be used in this varaction2, set by L{allocate_tmp_storage}.
+    @type tmp_locations: C{list} of C{int}, or C{None} if not computed yet.
+
+    @ivar used_tmp_locations: Addresses in the temporary storage allocated by this action2,
+                              while L{allocate_tmp_storage} is running.
+    @type used_tmp_locations: C{set} of C{int}, or C{None} if not computed yet.
     """
     def __init__(self, feature, name, pos):
         self.feature = feature
@@ -83,26 +87,13 @@ class Action2(base_action.BaseAction):
         #0x80 - 0xFE: used by NML
         #0xFF: Used for some house variables
         #0x100 - 0x10F: Special meaning (used for some CB results)
-        self.tmp_locations = list(range(0x80, 0x80 + total_tmp_locations))
+        self.tmp_locations = None
+        self.used_tmp_locations = None
 
     def prepare_output(self, sprite_num):
-        free_references(self)
-
-        global spritegroup_stats
-
-        try:
-            if self.num_refs == 0:
-                self.id = free_action2_ids[0]
-            else:
-                self.id = free_action2_ids.pop()
-                num_used = total_action2_ids - len(free_action2_ids)
-                if num_used > spritegroup_stats[0]:
-                    spritegroup_stats = (num_used, self.pos)
-        except IndexError:
-            raise generic.ScriptError("Unable to allocate ID for [random]switch, sprite set/layout/group or produce-block. Try reducing the number of such blocks.", self.pos)
+        assert self.id is not None, "Action2 '{}' has no ID, allocate_ids must be called before prepare_output.".format(self.name)
 
     def write_sprite_start(self, file, size):
-        assert self.num_refs == 0, "Action2 reference counting has {:d} dangling references.".format(self.num_refs)
         file.comment("Name: " + self.name)
         file.start_sprite(size + 3)
         file.print_bytex(2)
@@ -118,32 +109,88 @@ class Action2(base_action.BaseAction):
     def skip_needed(self):
         return False
 
-    def remove_tmp_location(self, location, force_recursive):
+    def resolve_tmp_storage(self):
         """
-        Recursively remove a location from the list of available temporary
-        storage locations. It is not only removed from the the list of the
-        current Action2Var but also from all Action2Var it calls. If an
-        Action2Var is referenced as a procedure call, the location is always
-        removed recursively, otherwise only if force_recursive is True.
+        Allocate all temporary storage registers needed by this action2,
+        using L{allocate_tmp_location} and L{free_tmp_location}. Called by L{allocate_tmp_storage}.
+        """
+        pass
 
-        @param location: Number of the storage register to remove.
-        @type location: C{int}
+    def allocate_tmp_location(self):
+        """
+        Allocate the lowest temporary storage register that is free to be used
+        in this action2.
 
-        @param force_recursive: Force removing this location recursively,
-                                also for 'chained' action2s.
-        @type force_recursive: C{bool}
+        @return: Number of the allocated storage register.
+        @rtype: C{int}
         """
-        global a2register_stats
+        if not self.tmp_locations:
+            raise generic.ScriptError("There are not enough registers available " +
+                    "to perform all required computations in switch blocks. " +
+                    "Please reduce the complexity of your code.", self.pos)
+        location = self.tmp_locations.pop(0)
+        self.used_tmp_locations.add(location)
+        return location
+
+    def free_tmp_location(self, location):
+        """
+        Make a storage register allocated by L{allocate_tmp_location} available again,
+        once the value stored in it is no longer needed by the rest of this action2.
 
-        if location in self.tmp_locations:
-            self.tmp_locations.remove(location)
-            num_used = total_tmp_locations - len(self.tmp_locations)
-            if num_used > a2register_stats[0]:
-                a2register_stats = (num_used, self.pos)
+        @param location: Number of the storage register.
+        @type location: C{int}
+        """
+        assert location in self.used_tmp_locations and location not in self.tmp_locations
+        bisect.insort(self.tmp_locations, location)
 
-        for act2_ref in self.references:
-            if force_recursive or act2_ref.is_proc:
-                act2_ref.action2.remove_tmp_location(location, True)
+def allocate_tmp_storage(actions):
+    """
+    Allocate the temporary storage registers of all action2s.
+
+    A register stored by an action2 is live while the procedures it calls are
+    executed, so it must not be used by any action2 reachable through such a
+    procedure call. Registers of callers must also be preserved by the
+    action2s that their procedures chain to.
+    As action2s can only refer to earlier action2s, a single pass over the
+    actions in reverse order visits all referencing action2s before the
+    action2s they refer to. Each action2 receives the set of registers that
+    are live in any of its callers, picks the lowest free registers for its
+    own use and passes the live registers on to the action2s it refers to.
+    Within an action2, a register is free again after the last load of the
+    value stored in it, so only values that are live at the same time need
+    different registers.
+    This colours the interference graph greedily in one pass over the
+    reference graph, instead of walking all reachable action2s once per
+    allocated register.
+
+    @param actions: List of all actions.
+    @type actions: C{list} of L{BaseAction}
+    """
+    global a2register_stats
+
+    all_locations = range(0x80, 0x80 + total_tmp_locations)
+    live_locations = {}
+    for action in reversed(actions):
+        if not isinstance(action, Action2): continue
+        live = live_locations.pop(action, frozenset())
+        action.tmp_locations = [location for location in all_locations if location not in live]
+        action.used_tmp_locations = set()
+        action.resolve_tmp_storage()
+        # Procedures called by this action2 may be executed while any of its registers is live
+        used = live | action.used_tmp_locations
+        action.tmp_locations = None
+        action.used_tmp_locations = None
+
+        if len(used) > a2register_stats[0]:
+            a2register_stats = (len(used), action.pos)
+
+        for act2_ref in action.references:
+            target = act2_ref.action2
+            target_live = used if act2_ref.is_proc else live
+            if target in live_locations:
+                live_locations[target] = live_locations[target] | target_live
+            elif target_live:
+                live_locations[target] = target_live
 
 class Action2Reference:
     """
@@ -181,17 +228,157 @@ def add_ref(ref, source_action, reference_as_proc = False):
     source_action.references.append(Action2Reference(act2, reference_as_proc))
     act2.num_refs += 1
 
-def free_references(source_action):
+def colour_live_ranges(actions):
+    """
+    Assign an ID to each Action2 in a list of actions, without modifying them.
+    The live range of an Action2 starts at its definition and ends at the last
+    action (Action2 or Action3) that references it. The ID is released just
+    before that last user picks its own ID, so it can be reused immediately.
+    Colouring these intervals in order of definition, always picking the most
+    recently released ID, is optimal for a fixed order of the actions.
+    An unreferenced Action2 does not occupy an ID beyond its own definition.
+
+    @param actions: List of actions to allocate IDs for.
+    @type actions: C{list} of L{BaseAction}
+
+    @return: A tuple containing the mapping of Action2s to IDs and the
+             resulting statistics, see L{spritegroup_stats}. IDs that are
+             not smaller than L{total_action2_ids} indicate a shortage.
+    @rtype: C{tuple} of (C{dict} mapping L{Action2} to C{int}, C{tuple})
     """
-    Free all references to other action2s from a certain action 2/3
+    ids = {}
+    stats = (0, None)
+    free_ids = list(range(0, total_action2_ids))
+    next_id = total_action2_ids
+    refs_left = {}
+    num_used = 0
+    for action in actions:
+        for act2_ref in getattr(action, 'references', []):
+            act2 = act2_ref.action2
+            refs_left[act2] = refs_left.get(act2, act2.num_refs) - 1
+            if refs_left[act2] == 0:
+                free_ids.append(ids[act2])
+                num_used -= 1
+
+        if not isinstance(action, Action2): continue
+        if len(free_ids) == 0:
+            # Keep going with an out-of-range ID, the caller reports the shortage
+            free_ids.append(next_id)
+            next_id += 1
+        if action.num_refs == 0:
+            ids[action] = free_ids[0]
+        else:
+            ids[action] = free_ids.pop()
+            num_used += 1
+            if num_used > stats[0]:
+                stats = (num_used, action.pos)
+    # Every reference must be made by one of the actions
+    for act2 in ids:
+        num_refs = refs_left.get(act2, act2.num_refs)
+        assert num_refs == 0, "Action2 reference counting has {:d} dangling references.".format(num_refs)
+    return ids, stats
+
+def reorder_action2s(actions):
+    """
+    Reorder each run of adjacent Action2s, such that every Action2 is defined
+    just before its first user within that run. Roots (Action2s that are not
+    used within the run) keep their relative order, the Action2s they depend on
+    are emitted in post-order. Only Action2s are moved, and only within their
+    run, so skip lengths and labels are not affected. An Action2 that directly
+    follows an Action6 keeps its position, as the Action6 modifies it.
+
+    @param actions: List of actions to reorder.
+    @type actions: C{list} of L{BaseAction}
+
+    @return: The reordered list of actions.
+    @rtype: C{list} of L{BaseAction}
+    """
+    result = []
+    start = 0
+    while start < len(actions):
+        if not isinstance(actions[start], Action2):
+            result.append(actions[start])
+            start += 1
+            continue
+        end = start
+        while end < len(actions) and isinstance(actions[end], Action2):
+            end += 1
+        pinned = start > 0 and isinstance(actions[start - 1], action6.Action6)
+        result.extend(_reorder_run(actions[start:end], pinned))
+        start = end
+    return result
+
+def _reorder_run(run, pinned):
+    """
+    Reorder a single run of adjacent Action2s, see L{reorder_action2s}.
+
+    @param run: Action2s to reorder.
+    @type run: C{list} of L{Action2}
+
+    @param pinned: Whether the first Action2 of the run must stay in place.
+    @type pinned: C{bool}
+
+    @return: The reordered run.
+    @rtype: C{list} of L{Action2}
+    """
+    in_run = set(run)
+    used_in_run = set(act2_ref.action2 for act2 in run for act2_ref in act2.references if act2_ref.action2 in in_run)
+
+    result = []
+    done = set()
+    if pinned:
+        result.append(run[0])
+        done.add(run[0])
+    for root in run:
+        if root in done or root in used_in_run: continue
+        # Iterative post-order traversal, chains of switches can be very long
+        stack = [(root, iter(root.references))]
+        while stack:
+            act2, refs = stack[-1]
+            for act2_ref in refs:
+                target = act2_ref.action2
+                if target in in_run and target not in done:
+                    stack.append((target, iter(target.references)))
+                    break
+            else:
+                stack.pop()
+                done.add(act2)
+                result.append(act2)
+    assert len(result) == len(run)
+    return result
+
+def allocate_ids(actions, reorder):
+    """
+    Allocate IDs for all Action2s, see L{colour_live_ranges}.
+    To be called after all actions have been generated, before prepare_output.
+
+    @param actions: List of all actions.
+    @type actions: C{list} of L{BaseAction}
+
+    @param reorder: Try to reduce the number of concurrently used IDs by
+                    reordering adjacent Action2s, see L{reorder_action2s}.
+    @type reorder: C{bool}
 
-    @param source_action: Action that contains the reference
-    @type  source_action: L{Action2} or L{Action3}
+    @return: The list of actions, which may have been reordered.
+    @rtype: C{list} of L{BaseAction}
     """
-    for act2_ref in source_action.references:
-        act2 = act2_ref.action2
-        act2.num_refs -= 1
-        if act2.num_refs == 0: free_action2_ids.append(act2.id)
+    global spritegroup_stats
+
+    ids, stats = colour_live_ranges(actions)
+    if reorder:
+        reordered = reorder_action2s(actions)
+        reordered_ids, reordered_stats = colour_live_ranges(reordered)
+        if reordered_stats[0] < stats[0]:
+            generic.print_info("Reordering Action2s reduced concurrent spritegroups from {:d} to {:d}".format(stats[0], reordered_stats[0]))
+            actions, ids, stats = reordered, reordered_ids, reordered_stats
+
+    for action in actions:
+        if isinstance(action, Action2):
+            if ids[action] >= total_action2_ids:
+                raise generic.ScriptError("Unable to allocate ID for [random]switch, sprite set/layout/group or produce-block. Try reducing the number of such blocks.", action.pos)
+            action.id = ids[action]
+    spritegroup_stats = stats
+    return actions
 
 # Features using sprite groups directly: vehicles, canals, cargos, railtypes, airports
 features_sprite_group = [0x00, 0x01, 0x02, 0x03, 0x05, 0x0B, 0x0D, 0x10]
@@ -27,13 +27,7 @@ class Action2Layout(action2.Action2):
 
     def resolve_tmp_storage(self):
         for reg in self.param_registers:
-            if not self.tmp_locations:
-                raise generic.ScriptError("There are not enough registers available " +
-                        "to perform all required computations in switch blocks. " +
-                        "Please reduce the complexity of your code.", self.pos)
-            location = self.tmp_locations[0]
-            self.remove_tmp_location(location, False)
-            reg.set_register(location)
+            reg.set_register(self.allocate_tmp_location())
 
     def write(self, file):
         advanced = any(x.is_advanced_sprite() for x in self.sprite_list + [self.ground_sprite])
@@ -274,7 +268,7 @@ class Action2LayoutSprite(object):
             id_dicts = [(spriteset.labels, lambda val, pos: expression.ConstantNumeric(val, pos))]
             offset = action2var.reduce_varaction2_expr(sg_ref.param_list[0], self.feature, self.extra_dicts + id_dicts)
             if isinstance(offset, expression.ConstantNumeric):
-                generic.check_range(offset.value, 0, len(real_sprite.parse_sprite_data(spriteset)) - 1, "offset within spriteset", sg_ref.pos)
+                generic.check_range(offset.value, 0, real_sprite.get_sprite_count(spriteset) - 1, "offset within spriteset", sg_ref.pos)
         else:
             raise generic.ScriptError("Expected 0 or 1 parameter, got " + str(len(sg_ref.param_list)), sg_ref.pos)
 
@@ -44,15 +44,21 @@ class Action2Var(action2.Action2):
         self.ranges = []
 
     def resolve_tmp_storage(self):
-        for var in self.var_list:
-            if isinstance(var, VarAction2StoreTempVar):
-                if not self.tmp_locations:
-                    raise generic.ScriptError("There are not enough registers available " +
-                            "to perform all required computations in switch blocks. " +
-                            "Please reduce the complexity of your code.", self.pos)
-                location = self.tmp_locations[0]
-                self.remove_tmp_location(location, False)
-                var.set_register(location)
+        # Position of each variable, the last one if it is used more than once
+        positions = {id(var): i for i, var in enumerate(self.var_list)}
+        # Registers in use, with the position of the last load of their value
+        live = []
+        for i, var in enumerate(self.var_list):
+            if not isinstance(var, VarAction2StoreTempVar): continue
+            for last_load, register in [item for item in live if item[0] < i]:
+                live.remove((last_load, register))
+                self.free_tmp_location(register)
+            register = self.allocate_tmp_location()
+            var.set_register(register)
+            loads = [positions.get(id(load_var)) for load_var in var.load_vars]
+            # Keep values of which some load is not in the variable list for the rest of this action2
+            last_load = len(self.var_list) if None in loads else max(loads, default = i)
+            live.append((last_load, register))
 
     def prepare_output(self, sprite_num):
         action2.Action2.prepare_output(self, sprite_num)
@@ -103,9 +109,11 @@ class Action2Var(action2.Action2):
         file.comment(self.default_comment)
         file.end_sprite()
 
-class VarAction2Var(object):
+class BaseVarAction2Var(object):
     """
     Represents a variable for use in a (advanced) variational action2.
+    The attributes are declared in C{__slots__} by the subclasses, so variables
+    that are also expressions can derive from L{expression.Expression} as well.
 
     @ivar var_num: Number of the variable to use.
     @type var_num: C{int}
@@ -132,6 +140,8 @@ class VarAction2Var(object):
     @ivar comment: Textual description of this variable.
     @type comment: C{basestr}
     """
+    __slots__ = ()
+
     def __init__(self, var_num, shift, mask, parameter = None):
         self.var_num = var_num
         self.shift = shift
@@ -173,8 +183,18 @@ class VarAction2Var(object):
         assert not raise_error
         return False
 
+"""
+Attributes of a variable, see L{BaseVarAction2Var}.
+"""
+var_attributes = ('var_num', 'shift', 'mask', 'parameter', 'add', 'div', 'mod', 'comment')
+
+class VarAction2Var(BaseVarAction2Var):
+    __slots__ = var_attributes
+
 # Class for var 7E procedure calls
 class VarAction2ProcCallVar(VarAction2Var):
+    __slots__ = ('sg_ref',)
+
     def __init__(self, sg_ref):
         VarAction2Var.__init__(self, 0x7E, 0, 0)
         # Reference to the called action2
@@ -193,6 +213,8 @@ class VarAction2ProcCallVar(VarAction2Var):
 # General load and store class for temp parameters
 # Register is allocated at the store operation
 class VarAction2StoreTempVar(VarAction2Var):
+    __slots__ = ('load_vars',)
+
     def __init__(self):
         VarAction2Var.__init__(self, 0x1A, 0, 0)
         #mask holds the number, it's resolved in Action2Var.resolve_tmp_storage
@@ -211,16 +233,18 @@ def get_mask(size):
     elif size == 2: return 0xFFFF
     return 0xFFFFFFFF
 
-class VarAction2LoadTempVar(VarAction2Var, expression.Expression):
+class VarAction2LoadTempVar(BaseVarAction2Var, expression.Expression):
+    __slots__ = var_attributes
+
     def __init__(self, tmp_var):
-        VarAction2Var.__init__(self, 0x7D, 0, 0)
+        BaseVarAction2Var.__init__(self, 0x7D, 0, 0)
         expression.Expression.__init__(self, None)
         assert isinstance(tmp_var, VarAction2StoreTempVar)
         tmp_var.load_vars.append(self)
 
     def write(self, file, size):
         self.mask = get_mask(size)
-        VarAction2Var.write(self, file, size)
+        BaseVarAction2Var.write(self, file, size)
 
     def get_size(self):
         return 7
@@ -238,6 +262,8 @@ class VarAction2LoadTempVar(VarAction2Var, expression.Expression):
 # Temporary load and store classes used for spritelayout parameters
 # Register is allocated in a separate entity
 class VarAction2LayoutParam(object):
+    __slots__ = ('register', 'store_vars', 'load_vars')
+
     def __init__(self):
         self.register = None
         self.store_vars = []
@@ -250,9 +276,11 @@ class VarAction2LayoutParam(object):
         for load_var in self.load_vars:
             load_var.parameter = register
 
-class VarAction2LoadLayoutParam(VarAction2Var, expression.Expression):
+class VarAction2LoadLayoutParam(BaseVarAction2Var, expression.Expression):
+    __slots__ = var_attributes
+
     def __init__(self, param):
-        VarAction2Var.__init__(self, 0x7D, 0, 0)
+        BaseVarAction2Var.__init__(self, 0x7D, 0, 0)
         expression.Expression.__init__(self, None)
         assert isinstance(param, VarAction2LayoutParam)
         param.load_vars.append(self)
@@ -260,7 +288,7 @@ class VarAction2LoadLayoutParam(VarAction2Var, expression.Expression):
 
     def write(self, file, size):
         self.mask = get_mask(size)
-        VarAction2Var.write(self, file, size)
+        BaseVarAction2Var.write(self, file, size)
 
     def get_size(self):
         return 7
@@ -276,6 +304,8 @@ class VarAction2LoadLayoutParam(VarAction2Var, expression.Expression):
         return False
 
 class VarAction2StoreLayoutParam(VarAction2Var):
+    __slots__ = ()
+
     def __init__(self, param):
         VarAction2Var.__init__(self, 0x1A, 0, 0)
         assert isinstance(param, VarAction2LayoutParam)
@@ -286,6 +316,8 @@ class VarAction2StoreLayoutParam(VarAction2Var):
         return 6
 
 class VarAction2Range(object):
+    __slots__ = ('min', 'max', 'result', 'comment')
+
     def __init__(self, min, max, result, comment):
         self.min = min
         self.max = max
@@ -293,6 +325,8 @@ class VarAction2Range(object):
         self.comment = comment
 
 class Modification(object):
+    __slots__ = ('param', 'size', 'offset')
+
     def __init__(self, param, size, offset):
         self.param = param
         self.size = size
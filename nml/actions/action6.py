@@ -26,6 +26,8 @@ def print_stats():
         generic.print_info("Concurrent ActionD registers: {}/{} ({})".format(free_parameters.stats[0], free_parameters.total_amount, str(free_parameters.stats[1])))
 
 class Action6(base_action.BaseAction):
+    __slots__ = ('modifications',)
+
     def __init__(self):
         self.modifications = []
 
@@ -13,6 +13,7 @@ You should have received a copy of the GNU General Public License along
 with NML; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
 
+import bisect
 from nml import expression, nmlop, free_number_list, generic
 from nml.actions import base_action, action6, actionD, action10
 
@@ -26,6 +27,8 @@ def print_stats():
         generic.print_info("Concurrent Action10 labels: {}/{} ({})".format(free_labels.stats[0], free_labels.total_amount, str(free_labels.stats[1])))
 
 class SkipAction(base_action.BaseAction):
+    __slots__ = ('action_type', 'label', 'var', 'varsize', 'condtype', 'value')
+
     def __init__(self, action_type, var, varsize, condtype, value, label):
         self.action_type = action_type
         self.label = label
@@ -61,6 +64,8 @@ class SkipAction(base_action.BaseAction):
         return self.action_type == 9 or self.label == 0
 
 class UnconditionalSkipAction(SkipAction):
+    __slots__ = ()
+
     def __init__(self, action_type, label):
         SkipAction.__init__(self, action_type, 0x9A, 1, (0, r'\71'), 0, label)
 
@@ -244,6 +249,7 @@ def parse_conditional_block(cond_list):
                 param = param_skip_all
             else:
                 action_list.append(actionD.ActionD(expression.ConstantNumeric(block['param_dst']), expression.ConstantNumeric(block['param_dst']), nmlop.AND, expression.ConstantNumeric(param_skip_all)))
+                actionD.known_parameters.pop(block['param_dst'], None)
         action_list.extend(cond_skip_actions(block['action_list'], param, block['cond_type'], block['cond_value'], block['cond_value_size'], cond_list.pos))
 
     if recursive_cond_blocks == 1:
@@ -276,3 +282,262 @@ def parse_loop_block(loop):
     recursive_cond_blocks -= 1
     action6.free_parameters.restore()
     return action_list
+
+def get_label_indices(actions):
+    """
+    Find the action10s in an action list.
+
+    @param actions: List of actions.
+    @type  actions: C{list} of L{BaseAction}
+
+    @return: Indices of the action10s in L{actions}, sorted, for each label.
+    @rtype:  C{dict} of C{int} to C{list} of C{int}
+    """
+    label_indices = {}
+    for i, action in enumerate(actions):
+        if isinstance(action, action10.Action10):
+            label_indices.setdefault(action.label, []).append(i)
+    return label_indices
+
+def find_label(label_indices, label, index):
+    """
+    Find the action10 a skip action with a label jumps to. Labels are
+    searched forward first, then from the start of the file.
+
+    @param label_indices: Indices of the action10s, as returned by L{get_label_indices}.
+    @type  label_indices: C{dict} of C{int} to C{list} of C{int}
+
+    @param label: Label to search for.
+    @type  label: C{int}
+
+    @param index: Index of the skip action.
+    @type  index: C{int}
+
+    @return: Index of the action10, C{None} if there is no action10 with this label.
+    @rtype:  C{int} or C{None}
+    """
+    indices = label_indices.get(label, [])
+    pos = bisect.bisect_right(indices, index)
+    if pos < len(indices):
+        return indices[pos]
+    if indices:
+        return indices[0]
+    return None
+
+def get_skip_target(actions, index, label_indices):
+    """
+    Get the index of the action execution continues at when a skip action is taken.
+
+    @param actions: List of actions.
+    @type  actions: C{list} of L{BaseAction}
+
+    @param index: Index of the skip action in L{actions}.
+    @type  index: C{int}
+
+    @param label_indices: Indices of the action10s, as returned by L{get_label_indices}.
+    @type  label_indices: C{dict} of C{int} to C{list} of C{int}
+
+    @return: Index of the target action, C{len(actions)} when skipping to the end of the file.
+    @rtype:  C{int}
+    """
+    label = actions[index].label
+    if label == 0:
+        return len(actions)
+    if label < 0x10:
+        return min(index + 1 + label, len(actions))
+    target = find_label(label_indices, label, index)
+    return len(actions) if target is None else target
+
+def skip_targets_known(actions, modified):
+    """
+    Check that no action6 changes where skip actions jump to, or modifies an action6 or action10.
+
+    @param actions: List of actions.
+    @type  actions: C{list} of L{BaseAction}
+
+    @param modified: Modified byte offsets, as returned by L{actionD.get_modified_offsets}.
+    @type  modified: C{dict} of C{int} to C{set} of C{int}
+
+    @return: True iff the destinations of all skip actions are known at compile time.
+    @rtype:  C{bool}
+    """
+    for i, offsets in modified.items():
+        action = actions[i]
+        if isinstance(action, SkipAction):
+            # Only the variable and the value to compare with may be modified
+            if any(offset < 4 or offset >= 4 + action.varsize for offset in offsets if offset != 1):
+                return False
+        elif isinstance(action, (action6.Action6, action10.Action10)):
+            return False
+    return True
+
+def optimize_skips(actions):
+    """
+    Optimize the skip actions (action7/9) and labels (action10) in an action list.
+
+     - A skip that jumps to a skip with the same condition, of which the variable is not changed
+       by the skipped actions, also skips the actions skipped by the second skip. The second skip is removed.
+     - Other skips that jump to a skip with the same condition jump to the target of that skip directly.
+     - Jumps to a label are replaced by skipping a number of sprites where possible, and labels
+       that are no longer used are removed. Skips that do not skip anything anymore are removed.
+
+    Skips modified by an action6 are not threaded or merged. The actions computing the
+    condition of a skip are left alone, so skips on the same condition do not share them.
+
+    @param actions: List of actions to optimize. The actions are modified in place.
+    @type  actions: C{list} of L{BaseAction}
+
+    @return: The optimized list of actions.
+    @rtype:  C{list} of L{BaseAction}
+    """
+    modified = actionD.get_modified_offsets(actions)
+    if not skip_targets_known(actions, modified):
+        return actions
+
+    num_actions = len(actions)
+    label_indices = get_label_indices(actions)
+    labels_before = len(label_indices)
+
+    # Target and way of encoding the target of each skip action.
+    # The encoding is 'end' for skipping to the end of the file,
+    # None for skipping a number of sprites, or the index of the action10 to jump to.
+    skips = {}
+    fixed = set()
+    for i, action in enumerate(actions):
+        if not isinstance(action, SkipAction): continue
+        target = get_skip_target(actions, i, label_indices)
+        if action.label == 0:
+            skips[i] = (target, 'end')
+        elif action.label < 0x10:
+            skips[i] = (target, None)
+        elif target == num_actions:
+            # The label does not exist, leave this skip alone
+            skips[i] = (target, None)
+            fixed.add(i)
+        else:
+            skips[i] = (target, target)
+    removed = set()
+
+    def landing(target):
+        # Index of the first action that is executed after jumping to target
+        while target < num_actions and (target in removed or isinstance(actions[target], action10.Action10)):
+            target += 1
+        return target
+
+    def num_skipped(index, target):
+        return sum(1 for i in range(index + 1, target) if i not in removed)
+
+    def encode(index, target, via):
+        # Way to encode a jump from index to target, False if it is not possible
+        if via == 'end':
+            return via
+        if target > index and num_skipped(index, target) < 0x10:
+            return None
+        if via is not None and find_label(label_indices, actions[via].label, index) == via:
+            return via
+        return False
+
+    def same_condition(skip1, skip2):
+        return (skip1.var, skip1.varsize, skip1.condtype[0], skip1.value) == (skip2.var, skip2.varsize, skip2.condtype[0], skip2.value)
+
+    def can_optimize(index):
+        return index in skips and index not in removed and index not in fixed and index not in modified
+
+    # Merging: a skip directly followed (when taken) by a skip with the same condition
+    # can skip the actions of both, if the skipped actions don't change the variable
+    target_count = {}
+    for i, (target, via) in skips.items():
+        target_count[target] = target_count.get(target, 0) + 1
+    num_merged = 0
+    for i in sorted(skips):
+        if not can_optimize(i): continue
+        skip1 = actions[i]
+        if skip1.var >= 0x80 and skip1.var != 0x9A: continue
+        while True:
+            target, via = skips[i]
+            j = landing(target)
+            if target <= i or not can_optimize(j): break
+            skip2 = actions[j]
+            new_target, new_via = skips[j]
+            if new_target <= j or skip1.action_type != skip2.action_type or not same_condition(skip1, skip2): break
+            # Nothing else may jump into the actions skipped by the first skip, or to the second skip
+            if any(target_count.get(k, 0) > (1 if k == target else 0) for k in range(i + 1, j + 1)): break
+            # The variable must have the same value when evaluating the second skip
+            if any(isinstance(actions[k], actionD.ActionD) and (1 in modified.get(k, ()) or actions[k].target.value == skip1.var)
+                    for k in range(i + 1, j) if k not in removed): break
+            # All remaining actions must be skippable by this type of skip
+            skippable = True
+            for k in range(i + 1, new_target):
+                if k in removed or k == j: continue
+                action = actions[k]
+                if isinstance(action, action10.Action10) and target_count.get(k, 0) == (1 if k == target else 0): continue
+                if not (action.skip_action7() if skip1.action_type == 7 else action.skip_action9()):
+                    skippable = False
+                    break
+            if not skippable: break
+            encoding = encode(i, new_target, new_via)
+            if encoding is False: break
+            # The second skip is replaced by the first one as jump to the new target
+            removed.add(j)
+            target_count[target] -= 1
+            skips[i] = (new_target, encoding)
+            num_merged += 1
+
+    # Jump threading: when landing on a skip with the same condition, that skip
+    # is taken as well. The second skip must be evaluated whenever the first is.
+    num_threaded = 0
+    for i in sorted(skips):
+        if not can_optimize(i): continue
+        visited = {i}
+        while True:
+            target, via = skips[i]
+            j = landing(target)
+            if j in visited or not can_optimize(j): break
+            visited.add(j)
+            if not same_condition(actions[i], actions[j]): break
+            if actions[i].action_type == 9 and actions[j].action_type == 7: break
+            new_target, new_via = skips[j]
+            encoding = encode(i, new_target, new_via)
+            if encoding is False: break
+            skips[i] = (new_target, encoding)
+            num_threaded += 1
+
+    # Use as few labels as possible, and drop skips that skip nothing
+    num_skips_removed = num_merged
+    num_labels_removed = 0
+    changed = True
+    while changed:
+        changed = False
+        for i, (target, via) in skips.items():
+            if i in removed or i in fixed: continue
+            if isinstance(via, int) and target > i and num_skipped(i, target) < 0x10:
+                skips[i] = (target, None)
+                changed = True
+            if via is None and num_skipped(i, target) == 0:
+                removed.add(i)
+                if i in modified: removed.add(i - 1)
+                num_skips_removed += 1
+                changed = True
+        labels_used = set(via for i, (target, via) in skips.items() if i not in removed and isinstance(via, int))
+        for indices in label_indices.values():
+            for k in indices:
+                if k not in removed and k not in labels_used:
+                    removed.add(k)
+                    num_labels_removed += 1
+                    changed = True
+
+    for i, (target, via) in skips.items():
+        if i in removed or i in fixed: continue
+        if via == 'end':
+            actions[i].label = 0
+        elif via is None:
+            actions[i].label = num_skipped(i, target)
+        else:
+            actions[i].label = actions[via].label
+
+    actions = [action for i, action in enumerate(actions) if i not in removed]
+    labels_after = len(get_label_indices(actions))
+    if skips:
+        generic.print_info("Skip optimization: merged {} and threaded {} skips, saved {} sprites ({} skips, {} labels), labels used: {}/{}".format(
+                num_merged, num_threaded, len(removed), num_skips_removed, num_labels_removed, labels_after, labels_before))
+    return actions
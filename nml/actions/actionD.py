@@ -40,6 +40,8 @@ class ActionD(base_action.BaseAction):
                     if the parameter number is 0xFF. None if n/a.
     @type data: L{ConstantNumeric} or C{None}
     """
+    __slots__ = ('target', 'param1', 'op', 'param2', 'data')
+
     def __init__(self, target, param1, op, param2, data = None):
         self.target = target
         self.param1 = param1
@@ -105,11 +107,111 @@ class ParameterAssignment(base_statement.BaseStatement):
         self.value.debug_print(indentation + 2)
 
     def get_action_list(self):
-        return parse_actionD(self)
+        # Generating the actions may change the assignment, so determine the known value first
+        values = dict(known_parameters)
+        assign_known_parameter(self, values, nml.actions.action7.recursive_cond_blocks == 0)
+        action_list = parse_actionD(self)
+        known_parameters.clear()
+        known_parameters.update(values)
+        return action_list
 
     def __str__(self):
         return '{} = {};\n'.format(self.param, self.value)
 
+"""
+Values of the parameters that are known at compile time, while the actions of the
+statements are generated in order. Only assignments outside of conditional blocks
+and loops give a known value. Used to unroll loops, see L{nml.ast.loop}.
+"""
+known_parameters = {}
+
+"""
+Operators that L{evaluate_known} computes at compile time.
+"""
+known_operators = (nmlop.ADD, nmlop.SUB, nmlop.MUL, nmlop.DIV, nmlop.MOD, nmlop.AND, nmlop.OR, nmlop.XOR,
+                   nmlop.CMP_EQ, nmlop.CMP_NEQ, nmlop.CMP_LE, nmlop.CMP_GE, nmlop.CMP_LT, nmlop.CMP_GT,
+                   nmlop.MIN, nmlop.MAX, nmlop.SHIFT_LEFT, nmlop.SHIFT_RIGHT, nmlop.SHIFTU_RIGHT, nmlop.HASBIT, nmlop.NOTHASBIT)
+
+def evaluate_known(expr, values):
+    """
+    Compute the value of an expression from known parameter values.
+    All (intermediate) values must be in the range 0 .. 0x7FFFFFFF, where the
+    compile time result is the same as the result computed by OpenTTD.
+
+    @param expr: Expression to evaluate.
+    @type  expr: L{Expression}
+
+    @param values: Known parameter values, by parameter number.
+    @type  values: C{dict} of C{int} to C{int}
+
+    @return: Value of the expression, or C{None} if it is not known at compile time.
+    @rtype:  C{int} or C{None}
+    """
+    if isinstance(expr, expression.ConstantNumeric):
+        value = expr.value
+    elif isinstance(expr, expression.Parameter):
+        if not isinstance(expr.num, expression.ConstantNumeric): return None
+        value = values.get(expr.num.value)
+    elif isinstance(expr, expression.BinOp):
+        if expr.op not in known_operators: return None
+        value1 = evaluate_known(expr.expr1, values)
+        value2 = evaluate_known(expr.expr2, values)
+        if value1 is None or value2 is None: return None
+        if expr.op in (nmlop.DIV, nmlop.MOD) and value2 == 0: return None
+        if expr.op in (nmlop.SHIFT_LEFT, nmlop.SHIFT_RIGHT, nmlop.SHIFTU_RIGHT, nmlop.HASBIT, nmlop.NOTHASBIT) and value2 > 31: return None
+        value = int(expr.op.compiletime_func(value1, value2))
+    elif isinstance(expr, expression.Boolean):
+        value = evaluate_known(expr.expr, values)
+        if value is not None: value = int(value != 0)
+    elif isinstance(expr, expression.Not):
+        value = evaluate_known(expr.expr, values)
+        if value not in (0, 1): return None
+        value = 1 - value
+    elif isinstance(expr, expression.TernaryOp):
+        guard = evaluate_known(expr.guard, values)
+        if guard is None: return None
+        value = evaluate_known(expr.expr1 if guard != 0 else expr.expr2, values)
+    else:
+        return None
+    if value is None or not 0 <= value <= 0x7FFFFFFF: return None
+    return value
+
+def assign_known_parameter(assignment, values, unconditional):
+    """
+    Update the known parameter values for a parameter assignment.
+
+    @param assignment: Assignment to process.
+    @type  assignment: L{ParameterAssignment}
+
+    @param values: Known parameter values, by parameter number. Updated in place.
+    @type  values: C{dict} of C{int} to C{int}
+
+    @param unconditional: Whether the assignment is always executed, so its value is known afterwards.
+    @type  unconditional: C{bool}
+    """
+    param = assignment.param
+    if isinstance(param, expression.SpecialParameter):
+        # Special parameters are global variables, not parameters of the GRF
+        return
+    if isinstance(param, expression.Identifier):
+        num = global_constants.named_parameters[param.value]
+    elif isinstance(param.num, expression.ConstantNumeric):
+        num = param.num.value
+    else:
+        num = evaluate_known(param.num, values)
+        if num is None or num > 0xFF:
+            # Any parameter may be written
+            values.clear()
+            return
+    if num >= 0x80:
+        # Global variable, its value may not be read back as written
+        return
+    value = evaluate_known(assignment.value, values) if unconditional else None
+    if value is None:
+        values.pop(num, None)
+    else:
+        values[num] = value
+
 #prevent evaluating common sub-expressions multiple times
 def parse_subexpression(expr, action_list):
     if isinstance(expr, expression.ConstantNumeric) or \
@@ -429,3 +531,273 @@ def parse_actionD(assignment):
     action_list.append(ActionD(target, param1, op, param2, data))
     action6.free_parameters.restore()
     return action_list
+
+"""
+ActionD operators of which the result is computed at compile time by L{optimize_parameters}.
+Maps the actionD operator number to a tuple of a function computing the (32 bits) result,
+and whether the operator is commutative.
+"""
+foldable_operators = {
+    nmlop.ADD.actd_num: (lambda a, b: a + b, True),
+    nmlop.SUB.actd_num: (lambda a, b: a - b, False),
+    nmlop.MUL.actd_num: (lambda a, b: a * b, True),
+    nmlop.AND.actd_num: (lambda a, b: a & b, True),
+    nmlop.OR.actd_num: (lambda a, b: a | b, True),
+}
+
+def get_modified_offsets(actions):
+    """
+    Find the bytes of each action that are modified by a preceding action6.
+
+    @param actions: List of actions.
+    @type  actions: C{list} of L{BaseAction}
+
+    @return: Modified byte offsets, for each index of a modified action.
+    @rtype:  C{dict} of C{int} to C{set} of C{int}
+    """
+    modified = {}
+    for i, action in enumerate(actions[:-1]):
+        if isinstance(action, action6.Action6):
+            offsets = modified.setdefault(i + 1, set())
+            for param, num_bytes, offset in action.modifications:
+                offsets.update(range(offset, offset + num_bytes))
+    return modified
+
+def optimize_parameters(actions):
+    """
+    Optimize the actionD computations in an action list. Temporary parameters that
+    hold a value already available in another parameter are replaced by that
+    parameter, computations with constant operands are folded, and actionDs that
+    assign a value already present, or of which the result is never read, are removed.
+
+    Knowledge about parameter values is only kept in straight-line code; it is
+    dropped at every target of a skip action and at every action10.
+    Actions modified by an action6 are never changed or removed. A parameter read
+    with a number computed at load time may be any parameter, so it is treated as a
+    read of all parameters, including the temporary ones.
+
+    @param actions: List of actions to optimize. The actions are modified in place.
+    @type  actions: C{list} of L{BaseAction}
+
+    @return: The optimized list of actions.
+    @rtype:  C{list} of L{BaseAction}
+    """
+    SkipAction = nml.actions.action7.SkipAction
+    Action10 = nml.actions.action10.Action10
+    ActionB = nml.actions.actionB.ActionB
+
+    modified = get_modified_offsets(actions)
+    if not nml.actions.action7.skip_targets_known(actions, modified):
+        return actions
+
+    temps = action6.free_parameters.used_numbers - set(global_constants.named_parameters.values())
+    temp_mask = sum(1 << num for num in temps)
+    all_mask = (1 << 0x100) - 1
+
+    label_indices = nml.actions.action7.get_label_indices(actions)
+    targets = {}
+    for i, action in enumerate(actions):
+        if isinstance(action, SkipAction):
+            targets[i] = nml.actions.action7.get_skip_target(actions, i, label_indices)
+    landing_points = set(targets.values())
+
+    # Value numbering, parameters are mapped to the number of the value they hold
+    values = {}
+    holders = {}
+    constants = {}
+    known_values = {}
+    removed = set()
+    num_values = [0]
+    num_folded = 0
+
+    def new_value():
+        num_values[0] += 1
+        return num_values[0]
+
+    def get_value(key, const = None):
+        if key not in known_values:
+            known_values[key] = new_value()
+            if const is not None: constants[known_values[key]] = const
+        return known_values[key]
+
+    def read(param):
+        if param >= 0x80:
+            # Variables may change without actionD
+            return new_value()
+        if param not in values:
+            assign(param, new_value())
+        return values[param]
+
+    def assign(param, value):
+        forget(param)
+        values[param] = value
+        holders.setdefault(value, []).append(param)
+
+    def forget(param):
+        if param in values:
+            holders[values.pop(param)].remove(param)
+
+    def replacement(param):
+        # Read temporary parameters from the oldest parameter holding the same value
+        if param not in temps or param not in values: return param
+        return holders[values[param]][0]
+
+    for i, action in enumerate(actions):
+        if i in landing_points or isinstance(action, Action10):
+            values.clear()
+            holders.clear()
+        offsets = modified.get(i, set())
+
+        if isinstance(action, action6.Action6):
+            for j, (param, num_bytes, offset) in enumerate(action.modifications):
+                if num_bytes <= 4:
+                    action.modifications[j] = (replacement(param), num_bytes, offset)
+
+        elif isinstance(action, SkipAction):
+            if action.var < 0x80 and action.condtype[0] <= 5 and 1 not in offsets:
+                action.var = replacement(action.var)
+
+        elif isinstance(action, ActionD):
+            target = action.target.value
+            if 1 in offsets:
+                # Any parameter may be written
+                values.clear()
+                holders.clear()
+                continue
+            if action.param2.value == 0xFE or offsets:
+                # GRM, reading other grfs or patch variables, or an unknown computation
+                if target < 0x80: assign(target, new_value())
+                continue
+
+            slots = ['param1'] if action.op == nmlop.ASSIGN else ['param1', 'param2']
+            operands = []
+            for slot in slots:
+                param = getattr(action, slot).value
+                if param != 0xFF and param < 0x80:
+                    param = replacement(param)
+                    const = constants.get(values.get(param))
+                    if const is not None and (action.data is None or action.data.value & 0xFFFFFFFF == const):
+                        param = 0xFF
+                        action.data = expression.ConstantNumeric(const)
+                    setattr(action, slot, expression.ConstantNumeric(param))
+                if param == 0xFF:
+                    const = action.data.value & 0xFFFFFFFF
+                    operands.append(get_value(('const', const), const))
+                else:
+                    operands.append(read(param))
+
+            op = action.op.actd_num
+            if len(operands) == 1:
+                value = operands[0]
+            elif all(operand in constants for operand in operands) and op in foldable_operators:
+                const = foldable_operators[op][0](constants[operands[0]], constants[operands[1]]) & 0xFFFFFFFF
+                value = get_value(('const', const), const)
+            else:
+                if op in foldable_operators and foldable_operators[op][1]: operands.sort()
+                value = get_value((op,) + tuple(operands))
+
+            if target >= 0x80: continue
+            if values.get(target) == value:
+                removed.add(i)
+                continue
+            if value in constants:
+                const = constants[value]
+                if not (action.op == nmlop.ASSIGN and action.param1.value == 0xFF):
+                    # Assign the constant directly
+                    action.op = nmlop.ASSIGN
+                    action.param1 = expression.ConstantNumeric(0xFF)
+                    action.param2 = expression.ConstantNumeric(0)
+                    action.data = expression.ConstantNumeric(const)
+                    num_folded += 1
+            elif holders.get(value) and not (action.op == nmlop.ASSIGN and action.param1.value == holders[value][0]):
+                # Copy the value from the parameter already holding it
+                action.op = nmlop.ASSIGN
+                action.param1 = expression.ConstantNumeric(holders[value][0])
+                action.param2 = expression.ConstantNumeric(0)
+                action.data = None
+            assign(target, value)
+
+    # Liveness of parameters, as bit masks, to find actionDs of which the result is never read
+    successors = []
+    for i, action in enumerate(actions):
+        succ = []
+        if not isinstance(action, nml.actions.action7.UnconditionalSkipAction): succ.append(i + 1)
+        if i in targets: succ.append(targets[i])
+        successors.append(succ)
+
+    def get_uses_defs(i, action):
+        if i in removed:
+            return 0, 0
+        offsets = modified.get(i, set())
+        if isinstance(action, action6.Action6):
+            uses = 0
+            for param, num_bytes, offset in action.modifications:
+                for num in range(param, min(param + (num_bytes + 3) // 4, 0x100)):
+                    uses |= 1 << num
+            return uses, 0
+        if isinstance(action, SkipAction):
+            if 1 in offsets: return all_mask, 0
+            return (1 << action.var if action.var < 0x80 else 0), 0
+        if isinstance(action, ActionB):
+            return sum(1 << param.value for param in action.extra_params), 0
+        if isinstance(action, ActionD):
+            if action.param2.value == 0xFE:
+                uses = 0
+            elif offsets - {1}:
+                uses = all_mask
+            else:
+                params = [action.param1.value] if action.op == nmlop.ASSIGN else [action.param1.value, action.param2.value]
+                uses = sum(1 << param for param in set(params) if param != 0xFF)
+            defs = 1 << action.target.value if 1 not in offsets else 0
+            return uses, defs
+        return 0, 0
+
+    while True:
+        uses_defs = [get_uses_defs(i, action) for i, action in enumerate(actions)]
+        live_in = [0] * len(actions) + [all_mask & ~temp_mask]
+        changed = True
+        while changed:
+            changed = False
+            for i in range(len(actions) - 1, -1, -1):
+                live_out = 0
+                for succ in successors[i]:
+                    live_out |= live_in[succ]
+                uses, defs = uses_defs[i]
+                live = uses | (live_out & ~defs)
+                if live != live_in[i]:
+                    live_in[i] = live
+                    changed = True
+
+        dead = set()
+        for i, action in enumerate(actions):
+            if i in removed or i in modified or not isinstance(action, ActionD): continue
+            target = action.target.value
+            if target not in temps or action.param2.value == 0xFE: continue
+            live_out = 0
+            for succ in successors[i]:
+                live_out |= live_in[succ]
+            if not live_out & (1 << target):
+                dead.add(i)
+        if not dead: break
+        removed |= dead
+
+    num_actionD = sum(1 for action in actions if isinstance(action, ActionD))
+    num_removed = len(removed)
+
+    # Skips over a number of sprites that no longer skip anything are removed as well,
+    # a count of zero would skip to the end of the file
+    numeric_skips = [(i, target) for i, target in sorted(targets.items()) if 0 < actions[i].label < 0x10]
+    changed = True
+    while changed:
+        changed = False
+        for i, target in numeric_skips:
+            if i not in removed and all(j in removed for j in range(i + 1, target)):
+                removed.add(i)
+                if i in modified: removed.add(i - 1)
+                changed = True
+    for i, target in numeric_skips:
+        actions[i].label = sum(1 for j in range(i + 1, target) if j not in removed)
+
+    if num_actionD > 0:
+        generic.print_info("ActionD optimization: removed {}/{} actionDs, folded {}".format(num_removed, num_actionD, num_folded))
+    return [action for i, action in enumerate(actions) if i not in removed]
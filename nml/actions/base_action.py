@@ -14,6 +14,8 @@ with NML; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
 
 class BaseAction(object):
+    __slots__ = ()
+
     def prepare_output(self, sprite_num):
         """
         Called just before L{write}, this function can be used to do some
@@ -13,13 +13,10 @@ You should have received a copy of the GNU General Public License along
 with NML; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
 
+import copy
 from nml import generic, expression
 from nml.actions import base_action
 from nml.ast import assignment
-try:
-    from PIL import Image
-except ImportError:
-    import Image
 
 FLAG_NOCROP  = 0x0040
 FLAG_NOALPHA = 0x0100
@@ -110,14 +107,46 @@ palmap_w2d = [
 translate_w2d = bytearray(v for v in palmap_w2d)
 translate_d2w = bytearray(v for v in palmap_d2w)
 
+def _compute_d2w_sources():
+    """
+    Compute for each WIN palette index which DOS palette index of a recolour table ends up there.
+    Indices 0xD7..0xE2 have no WIN equivalent, later indices take precedence over earlier ones.
+
+    @return: For every WIN index, the DOS index, or C{None} if no index maps to it.
+    @rtype:  C{list} of C{int} or C{None}
+    """
+    sources = 256 * [None]
+    for idx in range(256):
+        if not 0xD7 <= idx <= 0xE2:
+            sources[palmap_d2w[idx]] = idx
+    return sources
+
+d2w_sources = _compute_d2w_sources()
+identity_d7_e2 = bytes(range(0xD7, 0xE3))
+
+"""
+Recolour tables converted to the WIN palette.
+The key is the recolour table in the DOS palette, the value is the table in the WIN palette.
+"""
+converted_tables = {}
+
 def convert_palette(pal):
-    ret = 256 * [0]
-    for idx, colour in enumerate(pal):
-        if 0xD7 <= idx <= 0xE2:
-            if idx != colour:
-                raise generic.ScriptError("Indices 0xD7..0xE2 are not allowed in recolour sprites when the output is in the WIN palette")
-            continue
-        ret[palmap_d2w[idx]] = palmap_d2w[colour]
+    """
+    Convert a recolour table from the DOS palette to the WIN palette.
+
+    @param pal: Recolour table in the DOS palette.
+    @type  pal: C{bytes} of length 256
+
+    @return: Recolour table in the WIN palette.
+    @rtype:  C{bytes} of length 256
+    """
+    ret = converted_tables.get(pal)
+    if ret is None:
+        if pal[0xD7:0xE3] != identity_d7_e2:
+            raise generic.ScriptError("Indices 0xD7..0xE2 are not allowed in recolour sprites when the output is in the WIN palette")
+        colours = pal.translate(translate_d2w)
+        ret = bytes(0 if idx is None else colours[idx] for idx in d2w_sources)
+        converted_tables[pal] = ret
     return ret
 
 class RealSprite(object):
@@ -164,6 +193,8 @@ class RealSprite(object):
     @ivar poslist: Position of creation of the sprite, if available.
     @type poslist: C{list} of L{Position}
     """
+    __slots__ = ('param_list', 'label', 'is_empty', 'file', 'xpos', 'ypos', 'mask_file', 'mask_pos', 'xsize', 'ysize',
+                 'xrel', 'yrel', 'flags', 'poslist', 'zoom_level', 'bit_depth')
 
     def __init__(self, param_list = None, label = None, poslist = None):
         self.param_list = param_list
@@ -198,17 +229,20 @@ class RealSprite(object):
         generic.check_range(self.xsize.value, 1, 0xFFFF,       "Real sprite paramater 'xsize'", self.xsize.pos)
         generic.check_range(self.ysize.value, 1, 0xFFFF,       "Real sprite paramater 'ysize'", self.ysize.pos)
 
-    def validate_size(self):
+    def validate_size(self, images):
         """
         Check if xpos/ypos/xsize/ysize are already set and if not, set them
         to 0,0,image_width,image_height.
+
+        @param images: Registry of the source images, used to get the image size.
+        @type  images: L{ImageRegistry}
         """
         if self.xpos is None:
-            im = Image.open(generic.find_file(self.file.value))
+            size = images.get_info(self.file.value).size
             self.xpos = expression.ConstantNumeric(0)
             self.ypos = expression.ConstantNumeric(0)
-            self.xsize = expression.ConstantNumeric(im.size[0])
-            self.ysize = expression.ConstantNumeric(im.size[1])
+            self.xsize = expression.ConstantNumeric(size[0])
+            self.ysize = expression.ConstantNumeric(size[1])
             self.check_sprite_size()
         if self.mask_pos is None:
             self.mask_pos = (self.xpos, self.ypos)
@@ -327,30 +361,61 @@ class RecolourSprite(object):
         ret += "}"
         return ret
 
+"""
+Recolour tables built so far, to share identical tables.
+The key is a tuple of the (from_min, from_max, to_min, to_max) values of all assignments,
+the value is the recolour table.
+"""
+recolour_tables = {}
+
+def build_recolour_table(mapping):
+    """
+    Build the recolour table of a recolour sprite.
+
+    @param mapping: Assignments of the recolour sprite, with constant ranges.
+    @type  mapping: C{list} of L{Assignment}
+
+    @return: Recolour table.
+    @rtype:  C{bytes} of length 256
+    """
+    key = tuple((assignment.name.min.value, assignment.name.max.value, assignment.value.min.value,
+                 None if assignment.value.max is None else assignment.value.max.value) for assignment in mapping)
+    table = recolour_tables.get(key)
+    if table is not None:
+        return table
+
+    table = bytearray(range(256))
+    for assignment, (from_min, from_max, to_min, to_max) in zip(mapping, key):
+        if to_max is not None and from_max - from_min != to_max - to_min:
+            raise generic.ScriptError("From and to ranges in a recolour block need to have the same size", assignment.pos)
+        if to_max is None:
+            colours = [to_min] * (from_max - from_min + 1)
+        else:
+            colours = list(range(to_min, to_max + 1))
+        # Colours outside the table are ignored
+        first = max(from_min, 0)
+        last = min(from_max, 255)
+        if first > last:
+            continue
+        colours = colours[first - from_min:last - from_min + 1]
+        try:
+            table[first:last + 1] = bytes(colour + 0x100 if -0x80 <= colour < 0 else colour for colour in colours)
+        except ValueError:
+            raise generic.ScriptError("Recolour sprite colours need to be in range 0..255", assignment.pos)
+
+    table = bytes(table)
+    recolour_tables[key] = table
+    return table
+
 class RecolourSpriteAction(SpriteAction):
     def __init__(self, sprite):
         SpriteAction.__init__(self)
         self.sprite = sprite
-        self.output_table = []
+        self.output_table = None
 
     def prepare_output(self, sprite_num):
         SpriteAction.prepare_output(self, sprite_num)
-        colour_mapping = {}
-        for assignment in self.sprite.mapping:
-            if assignment.value.max is not None and assignment.name.max.value - assignment.name.min.value != assignment.value.max.value - assignment.value.min.value:
-                raise generic.ScriptError("From and to ranges in a recolour block need to have the same size", assignment.pos)
-            for i in range(assignment.name.max.value - assignment.name.min.value + 1):
-                idx = assignment.name.min.value + i
-                val = assignment.value.min.value
-                if assignment.value.max is not None:
-                    val += i
-                colour_mapping[idx] = val
-        for i in range(256):
-            if i in colour_mapping:
-                colour = colour_mapping[i]
-            else:
-                colour = i
-            self.output_table.append(colour)
+        self.output_table = build_recolour_table(self.sprite.mapping)
 
     def write(self, file):
         file.start_sprite(257)
@@ -358,10 +423,9 @@ class RecolourSpriteAction(SpriteAction):
         if file.palette not in ("DEFAULT", "LEGACY"):
             raise generic.ScriptError("Recolour sprites are only supported when writing to the DEFAULT (DOS) or LEGACY (WIN) palette. If you don't have any real sprites use the commandline option -p to set a palette.")
         colour_table = self.output_table if file.palette == "DEFAULT" else convert_palette(self.output_table)
-        for idx, colour in enumerate(colour_table):
-            if idx % 16 == 0:
-                file.newline()
-            file.print_bytex(colour)
+        for idx in range(0, 256, 16):
+            file.newline()
+            file.print_data(colour_table[idx:idx + 16])
         if self.last: file.newline()
         file.end_sprite()
 
@@ -403,7 +467,29 @@ class TemplateUsage(object):
                 raise generic.ScriptError("Template parameters should be compile-time constants", param.pos)
             param_dict[template.param_list[i].value] = param.value
 
-        return parse_sprite_list(template.sprite_list, default_file, default_mask_file, poslist + [self.pos], param_dict)
+        # Expand every distinct instantiation of the template only once.
+        # The expansion is done relative to this usage, and copied for every usage.
+        key = (self.name.value, tuple(param_dict[param.value] for param in template.param_list),
+               None if default_file is None else default_file.value,
+               None if default_mask_file is None else default_mask_file.value)
+        if key not in template_expansions:
+            template_expansions[key] = (default_file, default_mask_file, parse_sprite_list(template.sprite_list, default_file, default_mask_file, [], param_dict))
+        cached_file, cached_mask_file, cached_sprites = template_expansions[key]
+
+        prefix = poslist + [self.pos]
+        real_sprite_list = []
+        for cached_sprite in cached_sprites:
+            sprite = copy.copy(cached_sprite)
+            if isinstance(sprite, RecolourSprite):
+                sprite.poslist = prefix + sprite.poslist
+            elif not sprite.is_empty:
+                sprite.poslist = prefix + sprite.poslist
+                if sprite.file is cached_file:
+                    sprite.file = default_file
+                if sprite.mask_file is cached_mask_file:
+                    sprite.mask_file = default_mask_file
+            real_sprite_list.append(sprite)
+        return real_sprite_list
 
     def __str__(self):
         return "{}({})".format(self.name, ", ".join(str(param) for param in self.param_list))
@@ -492,30 +578,43 @@ def parse_real_sprite(sprite, default_file, default_mask_file, poslist, id_dict)
 
 sprite_template_map = {}
 
+"""
+Expanded template instantiations.
+The key is a tuple of the template name, the template arguments and the values of the default files.
+The value is a tuple of the default files used for the expansion and the expanded sprites, without position prefix.
+"""
+template_expansions = {}
+
 def parse_sprite_list(sprite_list, default_file, default_mask_file, poslist, parameters = {}):
     real_sprite_list = []
     for sprite in sprite_list:
         real_sprite_list.extend(sprite.expand(default_file, default_mask_file, poslist, parameters))
     return real_sprite_list
 
-def parse_sprite_data(sprite_container):
+def expand_sprite_data(sprite_container):
     """
+    Expand and validate the sprite data of a sprite container.
+    The result is stored in the container, so the expansion is done only once.
+
     @param sprite_container: AST node that contains the sprite data
     @type sprite_container: L{SpriteContainer}
 
-    @return: List of real sprite actions
-    @rtype: C{list} of L{BaseAction}
+    @return: For every sprite number, the sprite and its alternative sprites.
+    @rtype: C{list} of C{list} of (L{RealSprite} or L{RecolourSprite})
     """
+    if sprite_container.expanded_sprite_data is not None:
+        return sprite_container.expanded_sprite_data
+
     all_sprite_data = sprite_container.get_all_sprite_data()
-    action_list = []
+    expanded = []
     first = True
 
     for sprite_data in all_sprite_data:
         sprite_list, default_file, default_mask_file, pos, zoom_level, bit_depth = sprite_data
         new_sprite_list = parse_sprite_list(sprite_list, default_file, default_mask_file, [pos])
-        if not first and len(new_sprite_list) != len(action_list):
+        if not first and len(new_sprite_list) != len(expanded):
             msg = "Expected {:d} alternative sprites for {} '{}', got {:d}."
-            msg = msg.format(len(action_list), sprite_container.block_type, sprite_container.block_name.value, len(new_sprite_list))
+            msg = msg.format(len(expanded), sprite_container.block_type, sprite_container.block_name.value, len(new_sprite_list))
             raise generic.ScriptError(msg, sprite_container.pos)
 
         for i, sprite in enumerate(new_sprite_list):
@@ -524,21 +623,49 @@ def parse_sprite_data(sprite_container):
             if bit_depth == 8 and isinstance(sprite, RealSprite) and (not sprite.is_empty) and sprite.mask_file is not None:
                 raise generic.ScriptError("Mask file may only be specified for 32bpp sprites.", sprite.mask_file.pos)
             if first:
-                if isinstance(sprite, RealSprite):
-                    action_list.append(RealSpriteAction())
-                else:
-                    assert isinstance(sprite, RecolourSprite)
-                    action_list.append(RecolourSpriteAction(sprite))
+                assert isinstance(sprite, (RealSprite, RecolourSprite))
+                expanded.append([sprite])
             else:
                 # Not the first sprite, so an alternative sprite
-                if isinstance(sprite, RecolourSprite) or isinstance(action_list[i], RecolourSpriteAction):
+                if isinstance(sprite, RecolourSprite) or isinstance(expanded[i][0], RecolourSprite):
                     raise generic.ScriptError("Alternative sprites may only be provided for and contain real sprites, not recolour sprites.", sprite_container.pos)
-                if action_list[i].sprite_list[0].is_empty and not sprite.is_empty:
+                if expanded[i][0].is_empty and not sprite.is_empty:
                     # if the first sprite is empty, all others are ignored
                     generic.print_warning("Alternative sprites for an empty real sprite are ignored.", sprite_container.pos)
-            if isinstance(sprite, RealSprite): action_list[i].add_sprite(sprite)
+                expanded[i].append(sprite)
         first = False
 
+    sprite_container.expanded_sprite_data = expanded
+    return expanded
+
+def get_sprite_count(sprite_container):
+    """
+    @param sprite_container: AST node that contains the sprite data
+    @type sprite_container: L{SpriteContainer}
+
+    @return: Number of sprites in the container, not counting alternative sprites.
+    @rtype: C{int}
+    """
+    return len(expand_sprite_data(sprite_container))
+
+def parse_sprite_data(sprite_container):
+    """
+    @param sprite_container: AST node that contains the sprite data
+    @type sprite_container: L{SpriteContainer}
+
+    @return: List of real sprite actions
+    @rtype: C{list} of L{BaseAction}
+    """
+    action_list = []
+    for sprites in expand_sprite_data(sprite_container):
+        if isinstance(sprites[0], RecolourSprite):
+            action_list.append(RecolourSpriteAction(sprites[0]))
+        else:
+            action = RealSpriteAction()
+            for sprite in sprites:
+                action.add_sprite(sprite)
+            action_list.append(action)
+
     if len(action_list) != 0: action_list[-1].last = True
     return action_list
 
@@ -13,10 +13,54 @@ You should have received a copy of the GNU General Public License along
 with NML; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
 
-from nml.actions import action7
-from nml.ast import base_statement
+import copy
+from nml.actions import action7, actionD
+from nml.ast import base_statement, conditional
 from nml import global_constants, generic
 
+"""
+Maximum number of iterations of a while-loop to unroll at compile time, 0 to never unroll loops.
+"""
+unroll_limit = 0
+
+"""
+Number of unrolled while-loops, and the total number of while-loops, for statistics.
+"""
+loop_stats = [0, 0]
+
+def is_unrollable(statements):
+    """
+    Check whether statements can be repeated by generating their actions multiple times.
+
+    @param statements: Statements to check.
+    @type  statements: C{list} of L{BaseStatement}
+
+    @return: True iff the statements are parameter assignments, or conditional blocks and loops containing only those.
+    @rtype:  C{bool}
+    """
+    for stmt in statements:
+        if isinstance(stmt, (conditional.ConditionalList, conditional.Conditional, Loop)):
+            if not is_unrollable(stmt.statements): return False
+        elif not isinstance(stmt, actionD.ParameterAssignment):
+            return False
+    return True
+
+def forget_assigned_parameters(statements, values):
+    """
+    Remove the parameters that may be assigned by statements from the known parameter values.
+
+    @param statements: Statements that may or may not be executed.
+    @type  statements: C{list} of L{BaseStatement}
+
+    @param values: Known parameter values, by parameter number. Updated in place.
+    @type  values: C{dict} of C{int} to C{int}
+    """
+    for stmt in statements:
+        if isinstance(stmt, actionD.ParameterAssignment):
+            actionD.assign_known_parameter(stmt, values, False)
+        else:
+            forget_assigned_parameters(stmt.statements, values)
+
 class Loop(base_statement.BaseStatementList):
     """
     AST node for a while-loop.
@@ -41,8 +85,40 @@ class Loop(base_statement.BaseStatementList):
         generic.print_dbg(indentation + 2, 'Block:')
         base_statement.BaseStatementList.debug_print(self, indentation + 4)
 
+    def get_iteration_count(self):
+        """
+        Compute the number of iterations of the loop at compile time, by executing its
+        parameter assignments with the parameter values known before the loop.
+
+        @return: Number of iterations, or C{None} if it is unknown or more than L{unroll_limit}.
+        @rtype:  C{int} or C{None}
+        """
+        if action7.recursive_cond_blocks > 0 or not is_unrollable(self.statements): return None
+        values = dict(actionD.known_parameters)
+        for count in range(unroll_limit + 1):
+            cond = actionD.evaluate_known(self.expr, values)
+            if cond is None: return None
+            if cond == 0: return count
+            for stmt in self.statements:
+                if isinstance(stmt, actionD.ParameterAssignment):
+                    actionD.assign_known_parameter(stmt, values, True)
+                else:
+                    forget_assigned_parameters(stmt.statements, values)
+        return None
+
     def get_action_list(self):
-        return action7.parse_loop_block(self)
+        loop_stats[1] += 1
+        count = self.get_iteration_count() if unroll_limit > 0 else None
+        if count is None:
+            return action7.parse_loop_block(self)
+
+        loop_stats[0] += 1
+        action_list = []
+        for i in range(count):
+            # Generating the actions may modify the statements, so use a fresh copy for every iteration
+            for stmt in copy.deepcopy(self.statements):
+                action_list.extend(stmt.get_action_list())
+        return action_list
 
     def __str__(self):
         ret = 'while({}) {{\n'.format(self.expr)
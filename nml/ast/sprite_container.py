@@ -29,6 +29,10 @@ class SpriteContainer(object):
 
     @ivar sprite_data: Mapping of (zoom level, bit-depth) to (sprite list, default file)
     @type sprite_data: C{dict} that maps (C{tuple} of (C{int}, C{int})) to (C{tuple} of (C{list} of (L{RealSprite}, L{RecolourSprite} or L{TemplateUsage}), L{StringLiteral} or C{None}, L{Position}))
+
+    @ivar expanded_sprite_data: Expanded sprites per sprite number, with all templates resolved, or C{None} if not computed yet.
+                                See L{real_sprite.expand_sprite_data}.
+    @type expanded_sprite_data: C{list} of C{list} of (L{RealSprite} or L{RecolourSprite}), or C{None}
     """
     sprite_blocks = {}
 
@@ -36,6 +40,7 @@ class SpriteContainer(object):
         self.block_type = block_type
         self.block_name = block_name
         self.sprite_data = {}
+        self.expanded_sprite_data = None
         if block_name is not None:
             if block_name.value in SpriteContainer.sprite_blocks:
                 raise generic.ScriptError("Block with name '{}' is already defined.".format(block_name.value), block_name.pos)
@@ -51,6 +56,7 @@ class SpriteContainer(object):
             msg = msg.format(self.block_type, self.block_name.value)
             generic.print_warning(msg, pos)
         self.sprite_data[key] = (sprite_list, default_file, default_mask_file, pos)
+        self.expanded_sprite_data = None
 
     def get_all_sprite_data(self):
         """
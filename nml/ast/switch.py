@@ -116,6 +116,8 @@ class SwitchBody(object):
         return ret
 
 class SwitchRange(object):
+    __slots__ = ('min', 'max', 'result', 'unit')
+
     def __init__(self, min, max, result, unit = None):
         self.min = min
         self.max = max
@@ -157,6 +159,8 @@ class SwitchValue(object):
     @ivar pos: Position information
     @type pos: L{Position}
     """
+    __slots__ = ('value', 'is_return', 'pos')
+
     def __init__(self, value, is_return, pos):
         self.value = value
         self.is_return = is_return
@@ -306,6 +310,8 @@ class RandomChoice(object):
     @ivar result: Result of this choice, either another action2 or a return value
     @type result: L{SwitchValue}
     """
+    __slots__ = ('probability', 'result')
+
     def __init__ (self, probability, result):
         self.probability = probability
         if result.value is None:
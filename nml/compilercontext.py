@@ -0,0 +1,182 @@
+__license__ = """
+NML is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+NML is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with NML; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
+
+import copy, threading
+from nml import generic, grfstrings, global_constants, spritecache
+from nml.actions import action0, action0properties, action1, action2, action2var, action3, action4, action6, action7, action11, actionD, actionF, real_sprite
+from nml.ast import alt_sprites, grf, item, loop, sprite_container, townnames
+
+"""
+State of a single compilation, kept in modules and classes.
+Each entry is a tuple of the owning module or class, and the names of its attributes.
+Settings of the process (verbosity, cache directory, ...) are not part of it.
+"""
+state_attributes = [
+    (generic, ('warning_count', '_paths')),
+    (generic.OnlyOnce, ('seen',)),
+    (grfstrings, ('commands', 'default_lang', 'langs', 'langs_by_id', 'translations_cache', 'DEFAULT_LANGNAME')),
+    (global_constants, ('constant_numbers', 'global_parameters', 'misc_grf_bits', 'patch_variables', 'named_parameters', 'cargo_numbers',
+                        'is_default_railtype_table', 'railtype_table', 'item_names', 'settings', 'config_flags', 'unified_maglev_var',
+                        'spritegroups', 'const_list')),
+    (spritecache, ('source_paths', 'source_stats', 'source_hashes')),
+    (action0, ('used_ids',)),
+    (action0properties, ('tilelayout_names',)),
+    (action1, ('spriteset_stats', 'last_spriteset_collection')),
+    (action2, ('spritegroup_stats', 'a2register_stats', 'spritegroup_list')),
+    (action2var, ('return_action_id', 'failed_cb_results')),
+    (action3, ('action2_id',)),
+    (action4, ('string_ranges', 'used_strings')),
+    (action6, ('free_parameters',)),
+    (action7, ('free_labels', 'recursive_cond_blocks')),
+    (action11, ('registered_sounds',)),
+    (actionD, ('known_parameters',)),
+    (actionF, ('free_numbers', 'first_free_id', 'named_numbers', 'numbered_numbers', 'town_names_blocks')),
+    (real_sprite, ('sprite_template_map', 'template_expansions', 'converted_tables', 'recolour_tables')),
+    (alt_sprites, ('any_32bpp_sprites',)),
+    (grf, ('palette_node', 'blitter_node', 'param_stats')),
+    (item, ('item_feature', 'item_id', 'item_size')),
+    (loop, ('unroll_limit', 'loop_stats')),
+    (sprite_container.SpriteContainer, ('sprite_blocks',)),
+    (townnames, ('townname_serial',)),
+]
+
+def get_state():
+    """
+    Get the current compilation state of the modules.
+
+    @return: Values of the state attributes, in the order of L{state_attributes}.
+    @rtype:  C{list}
+    """
+    return [[getattr(owner, name) for name in names] for owner, names in state_attributes]
+
+def set_state(state):
+    """
+    Install a compilation state in the modules.
+
+    @param state: Values of the state attributes, as returned by L{get_state}.
+    @type  state: C{list}
+    """
+    for (owner, names), values in zip(state_attributes, state):
+        for name, value in zip(names, values):
+            setattr(owner, name, value)
+
+"""
+State of the modules before anything was compiled, copied for every new context.
+This module must be imported before the first compilation starts.
+"""
+initial_state = copy.deepcopy(get_state())
+
+"""
+Currently active context, C{None} if none is active.
+"""
+active_context = None
+
+"""
+Identifier of the thread that activated L{active_context}, C{None} if no context is active.
+"""
+active_thread = None
+
+"""
+Lock to check and change the active context at once.
+"""
+_activation_lock = threading.Lock()
+
+class CompilerContext(object):
+    """
+    State of one compilation (parsed language files, allocated ids, registered
+    items, ...), so a single process can compile several GRFs after each other.
+
+    While a context is active, its state is installed in the modules that use it,
+    so the compiler itself is not affected. Only one context can be active at a
+    time, use separate processes to compile GRFs in parallel. The state lives in
+    module globals shared by all threads, so activating a second context, or
+    using the active context from another thread, raises a C{RuntimeError}.
+    Only a context created as nested can be activated on top of the active one,
+    in the same thread, and it must be deactivated first.
+
+    Every module or class attribute that a compilation changes must be listed in
+    L{state_attributes}, regression/check_context.py verifies this.
+
+    Use it as a context manager, the previously active state is restored at exit::
+
+        with CompilerContext():
+            grfstrings.read_lang_files(...)
+            main.nml(...)
+
+    @ivar state: State of the compilation when the context is not active, C{None} while active.
+    @type state: C{list}
+
+    @ivar previous: State that was installed before activating the context.
+    @type previous: C{list} or C{None}
+
+    @ivar previous_context: Context that was active before activating this one.
+    @type previous_context: L{CompilerContext} or C{None}
+
+    @ivar nested: Whether the context may be activated while another one is active.
+    @type nested: C{bool}
+    """
+    def __init__(self, nested = False):
+        # Copy all of the state at once, so references between the attributes are kept
+        self.state = copy.deepcopy(initial_state)
+        self.previous = None
+        self.previous_context = None
+        self.nested = nested
+
+    def activate(self):
+        """
+        Install the state of this context in the modules.
+        """
+        global active_context, active_thread
+        with _activation_lock:
+            if self.state is None:
+                raise RuntimeError("Compiler context is already active")
+            if active_context is not None:
+                if active_thread != threading.get_ident():
+                    raise RuntimeError("Another compiler context is active in another thread")
+                if not self.nested:
+                    raise RuntimeError("Another compiler context is already active")
+            self.previous = get_state()
+            self.previous_context = active_context
+            set_state(self.state)
+            self.state = None
+            active_context = self
+            active_thread = threading.get_ident()
+
+    def deactivate(self):
+        """
+        Store the current state in this context, and restore the previous state.
+        The context can be activated again to continue the compilation.
+        """
+        global active_context, active_thread
+        with _activation_lock:
+            if active_context is not self:
+                raise RuntimeError("Compiler context is not the active one")
+            if active_thread != threading.get_ident():
+                raise RuntimeError("Compiler context is active in another thread")
+            self.state = get_state()
+            set_state(self.previous)
+            active_context = self.previous_context
+            if active_context is None:
+                active_thread = None
+            self.previous = None
+            self.previous_context = None
+
+    def __enter__(self):
+        self.activate()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deactivate()
+        return False
@@ -0,0 +1,247 @@
+__license__ = """
+NML is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+NML is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with NML; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
+
+"""
+Dependency extraction from the syntax tree, for make rules without compiling the GRF.
+"""
+import glob, hashlib, json, os
+from nml import expression, generic, global_constants
+from nml.actions import real_sprite
+from nml.ast import alt_sprites, base_statement, sprite_container, spriteblock
+
+# Version of the format of the dependency cache files.
+DEP_CACHE_VERSION = 2
+
+"""
+Modules of the classes of the syntax tree, besides statements: expressions, and objects
+like properties and switch ranges that hold expressions.
+"""
+syntax_tree_modules = ('nml.ast.', 'nml.expression.')
+
+def iter_statements(statements):
+    """
+    Iterate over statements and the statements they contain, in order of appearance.
+
+    @param statements: Statements to iterate over.
+    @type  statements: C{list} of L{BaseStatement}
+
+    @return: Iterator over the statements.
+    @rtype:  C{iterator} of L{BaseStatement}
+    """
+    for stmt in statements:
+        yield stmt
+        if isinstance(stmt, base_statement.BaseStatementList):
+            yield from iter_statements(stmt.statements)
+
+def get_attributes(node):
+    """
+    Get the values of the attributes of an object, in order of definition.
+
+    @param node: Object to get the attributes of.
+    @type  node: C{object}
+
+    @return: Values of the attributes that are set.
+    @rtype:  C{list}
+    """
+    names = list(getattr(node, '__dict__', ()))
+    for cls in type(node).__mro__:
+        slots = getattr(cls, '__slots__', ())
+        names.extend([slots] if isinstance(slots, str) else slots)
+    return [getattr(node, name) for name in names if hasattr(node, name)]
+
+def iter_function_calls(stmt):
+    """
+    Iterate over the function calls in the expressions of a statement, in depth-first order.
+    Statements contained in or referred to by the statement are not searched, see L{iter_statements}.
+
+    @param stmt: Statement to search.
+    @type  stmt: L{BaseStatement}
+
+    @return: Iterator over the function calls.
+    @rtype:  C{iterator} of L{FunctionCall}
+    """
+    todo = list(reversed(get_attributes(stmt)))
+    seen = set()
+    while todo:
+        node = todo.pop()
+        if isinstance(node, (list, tuple)):
+            todo.extend(reversed(node))
+            continue
+        if isinstance(node, dict):
+            todo.extend(reversed([item for pair in node.items() for item in pair]))
+            continue
+        if isinstance(node, base_statement.BaseStatement) or not type(node).__module__.startswith(syntax_tree_modules): continue
+        if id(node) in seen: continue
+        seen.add(id(node))
+        if isinstance(node, expression.FunctionCall):
+            yield node
+        todo.extend(reversed(get_attributes(node)))
+
+def get_sprite_files(sprite_list, default_file, default_mask_file, pos):
+    """
+    Get the image files used by a list of sprites.
+
+    @param sprite_list: Sprites, recolour sprites and template usages of a sprite block.
+    @type  sprite_list: C{list} of (L{RealSprite}, L{RecolourSprite} or L{TemplateUsage})
+
+    @param default_file: Default image file of the sprite block.
+    @type  default_file: L{StringLiteral} or C{None}
+
+    @param default_mask_file: Default mask file of the sprite block.
+    @type  default_mask_file: L{StringLiteral} or C{None}
+
+    @param pos: Position of the sprite block.
+    @type  pos: L{Position}
+
+    @return: Names of the image and mask files.
+    @rtype:  C{list} of C{str}
+    """
+    files = []
+    for sprite in real_sprite.parse_sprite_list(sprite_list, default_file, default_mask_file, [pos]):
+        if isinstance(sprite, real_sprite.RealSprite) and not sprite.is_empty:
+            files.append(sprite.file.value)
+            if sprite.mask_file is not None:
+                files.append(sprite.mask_file.value)
+    return files
+
+def get_sound_file(call):
+    """
+    Get the sound file of a call to the sound() function, like the compiler does.
+
+    @param call: Function call.
+    @type  call: L{FunctionCall}
+
+    @return: Name of the sound file, or C{None} if it is only known when compiling.
+    @rtype:  C{str} or C{None}
+    """
+    if len(call.params) == 0:
+        return None
+    try:
+        sound_file = call.params[0].reduce(global_constants.const_list)
+    except generic.ScriptError:
+        return None
+    return sound_file.value if isinstance(sound_file, expression.StringLiteral) else None
+
+def get_ast_dependencies(root):
+    """
+    Get the image and sound files referred to by a syntax tree, without generating actions.
+    Sprite templates are registered on the way, like L{BaseStatement.pre_process} does.
+    Files of sprite blocks that are never used are included as well.
+
+    @param root: Root of the syntax tree.
+    @type  root: L{BaseStatement}
+
+    @return: Names of the files, in order of appearance and without duplicates,
+             or C{None} if they can only be determined by compiling the syntax tree.
+    @rtype:  C{list} of C{str}, or C{None}
+    """
+    files = []
+    for stmt in iter_statements([root]):
+        if isinstance(stmt, spriteblock.TemplateDeclaration):
+            stmt.pre_process()
+        elif isinstance(stmt, sprite_container.SpriteContainer):
+            for sprite_list, default_file, default_mask_file, pos, zoom_level, bit_depth in stmt.get_all_sprite_data():
+                files.extend(get_sprite_files(sprite_list, default_file, default_mask_file, pos))
+        elif isinstance(stmt, alt_sprites.AltSpritesBlock):
+            files.extend(get_sprite_files(stmt.sprite_list, stmt.image_file, stmt.mask_file, stmt.pos))
+        for call in iter_function_calls(stmt):
+            if call.name.value != 'sound': continue
+            sound_file = get_sound_file(call)
+            if sound_file is None:
+                generic.print_warning("The sound file can only be determined by compiling, --fast-deps is ignored", call.pos)
+                return None
+            files.append(sound_file)
+    return list(dict.fromkeys(files))
+
+def get_lang_files(lang_dir, default_lang_file):
+    """
+    Get the language files that are read for a compilation, see L{grfstrings.read_lang_files}.
+
+    @param lang_dir: Name of the directory containing the language files.
+    @type  lang_dir: C{str}
+
+    @param default_lang_file: Filename of the language file with the default translation.
+    @type  default_lang_file: C{str}
+
+    @return: Names of the language files, starting with the default language.
+    @rtype:  C{list} of C{str}
+    """
+    filename = lang_dir + os.sep + default_lang_file
+    if not os.path.exists(filename):
+        return []
+    others = [name for name in glob.glob(lang_dir + os.sep + "*.lng") if not name.endswith(default_lang_file)]
+    return [filename] + sorted(others)
+
+def get_cache_key(script, nml_version):
+    """
+    Compute the key of the cached dependencies of a source file.
+
+    @param script: Contents of the source file.
+    @type  script: C{str}
+
+    @param nml_version: Version of NML, the syntax tree may differ between versions.
+    @type  nml_version: C{str}
+
+    @return: The cache key.
+    @rtype:  C{str}
+    """
+    data = nml_version + '\0' + script
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+def read_cache(input_filename, key):
+    """
+    Read the cached dependencies of a source file.
+
+    @param input_filename: Name of the source file.
+    @type  input_filename: C{str}
+
+    @param key: Cache key of the source file, see L{get_cache_key}.
+    @type  key: C{str}
+
+    @return: The cached result of L{get_ast_dependencies}, or C{None} if there is no valid cache.
+    @rtype:  C{list} of C{str}, or C{None}
+    """
+    cache_filename = generic.get_cache_file([input_filename], ".depcache")
+    if not os.access(cache_filename, os.R_OK):
+        return None
+    try:
+        with open(cache_filename, 'r', encoding = 'utf-8') as f:
+            cache = json.load(f)
+        assert isinstance(cache, dict) and cache.get('version') == DEP_CACHE_VERSION
+        assert isinstance(cache['files'], list) and all(isinstance(name, str) for name in cache['files'])
+    except:
+        generic.print_warning(cache_filename + " contains invalid data, ignoring.")
+        return None
+    return cache['files'] if cache.get('key') == key else None
+
+def write_cache(input_filename, key, files):
+    """
+    Store the dependencies of a source file in the cache.
+
+    @param input_filename: Name of the source file.
+    @type  input_filename: C{str}
+
+    @param key: Cache key of the source file, see L{get_cache_key}.
+    @type  key: C{str}
+
+    @param files: Result of L{get_ast_dependencies}.
+    @type  files: C{list} of C{str}
+    """
+    cache_filename = generic.get_cache_file([input_filename], ".depcache")
+    # Write to a temporary file first, other nmlc processes may be reading the cache concurrently
+    tmp_filename = "{}.{:d}.tmp".format(cache_filename, os.getpid())
+    with open(tmp_filename, 'w', encoding = 'utf-8') as f:
+        json.dump({'version': DEP_CACHE_VERSION, 'key': key, 'files': files}, f)
+    os.replace(tmp_filename, cache_filename)
@@ -17,6 +17,8 @@ from nml import generic
 from .base_expression import Expression
 
 class Array(Expression):
+    __slots__ = ('values',)
+
     def __init__(self, values, pos):
         Expression.__init__(self, pos)
         self.values = values
@@ -28,10 +28,13 @@ class Type(object):
 class Expression(object):
     """
     Superclass for all expression classes.
+    Large projects consist of millions of expressions, so subclasses list their attributes in C{__slots__}.
 
     @ivar pos: Position of the data in the original file.
     @type pos: :L{Position}
     """
+    __slots__ = ('pos',)
+
     def __init__(self, pos):
         self.pos = pos
 
@@ -118,6 +121,8 @@ class Expression(object):
         return Type.INTEGER
 
 class ConstantNumeric(Expression):
+    __slots__ = ('value',)
+
     def __init__(self, value, pos = None):
         Expression.__init__(self, pos)
         self.value = generic.truncate_int32(value)
@@ -150,6 +155,8 @@ class ConstantNumeric(Expression):
         return self.value
 
 class ConstantFloat(Expression):
+    __slots__ = ('value',)
+
     def __init__(self, value, pos):
         Expression.__init__(self, pos)
         self.value = float(value)
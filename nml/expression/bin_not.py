@@ -19,6 +19,8 @@ from .binop import BinOp
 from .boolean import Boolean
 
 class BinNot(Expression):
+    __slots__ = ('expr',)
+
     def __init__(self, expr, pos = None):
         Expression.__init__(self, pos)
         self.expr = expr
@@ -45,6 +47,8 @@ class BinNot(Expression):
         return "~" + str(self.expr)
 
 class Not(Expression):
+    __slots__ = ('expr',)
+
     def __init__(self, expr, pos = None):
         Expression.__init__(self, pos)
         self.expr = expr
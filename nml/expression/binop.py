@@ -20,6 +20,8 @@ from .variable import Variable
 from .boolean import Boolean
 
 class BinOp(Expression):
+    __slots__ = ('op', 'expr1', 'expr2')
+
     def __init__(self, op, expr1, expr2, pos = None):
         Expression.__init__(self, pos)
         self.op = op
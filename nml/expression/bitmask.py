@@ -18,6 +18,8 @@ from .base_expression import Type, Expression, ConstantNumeric
 from .binop import BinOp
 
 class BitMask(Expression):
+    __slots__ = ('values',)
+
     def __init__(self, values, pos):
         Expression.__init__(self, pos)
         self.values = values
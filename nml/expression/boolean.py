@@ -23,6 +23,8 @@ class Boolean(Expression):
     @ivar expr: (Integer) expression to convert.
     @type expr: C{Expression}
     """
+    __slots__ = ('expr',)
+
     def __init__(self, expr, pos = None):
         Expression.__init__(self, pos)
         self.expr = expr
@@ -26,6 +26,8 @@ from . import identifier
 from functools import reduce
 
 class FunctionCall(Expression):
+    __slots__ = ('name', 'params')
+
     def __init__(self, name, params, pos):
         Expression.__init__(self, pos)
         self.name = name
@@ -90,6 +92,8 @@ class SpecialCheck(Expression):
     @ivar pos: Position information
     @type pos: L{Position}
     """
+    __slots__ = ('op', 'varnum', 'results', 'value', 'to_string', 'varsize', 'mask')
+
     def __init__(self, op, varnum, results, value, to_string, varsize = 4, mask = None, pos = None):
         Expression.__init__(self, pos)
         self.op = op
@@ -110,6 +114,8 @@ class SpecialCheck(Expression):
         return True
 
 class GRMOp(Expression):
+    __slots__ = ('op', 'feature', 'count', 'to_string')
+
     def __init__(self, op, feature, count, to_string, pos = None):
         Expression.__init__(self, pos)
         self.op = op
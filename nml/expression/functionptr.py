@@ -34,6 +34,8 @@ class FunctionPtr(Expression):
     @ivar extra_args List of arguments that should be passed to the function that is to be called.
     @type extra_args C{list}
     """
+    __slots__ = ('name', 'func', 'extra_args')
+
     def __init__(self, name, func, *extra_args):
         self.name = name
         self.func = func
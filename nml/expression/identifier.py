@@ -39,6 +39,8 @@ def default_id_func(x, pos):
 
 
 class Identifier(Expression):
+    __slots__ = ('value',)
+
     def __init__(self, value, pos = None):
         Expression.__init__(self, pos)
         self.value = value
@@ -18,6 +18,8 @@ from .base_expression import Type, Expression, ConstantNumeric
 from .string_literal import StringLiteral
 
 class Parameter(Expression):
+    __slots__ = ('num',)
+
     def __init__(self, num, pos = None, by_user = False):
         Expression.__init__(self, pos)
         self.num = num
@@ -56,6 +58,8 @@ class Parameter(Expression):
         return hash((self.num,))
 
 class OtherGRFParameter(Expression):
+    __slots__ = ('grfid', 'num')
+
     def __init__(self, grfid, num, pos = None):
         Expression.__init__(self, pos)
         self.grfid = grfid
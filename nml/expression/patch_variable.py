@@ -23,6 +23,8 @@ class PatchVariable(Expression):
     @ivar num: Variable number to read
     @type num: C{int}
     """
+    __slots__ = ('num',)
+
     def __init__(self, num, pos = None):
         Expression.__init__(self, pos)
         self.num = num
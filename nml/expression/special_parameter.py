@@ -48,6 +48,7 @@ class SpecialParameter(Expression):
     @ivar is_bool: Does read_func return a boolean value?
     @type is_bool: C{bool}
     """
+    __slots__ = ('name', 'info', 'write_func', 'read_func', 'is_bool')
 
     def __init__(self, name, info, write_func, read_func, is_bool, pos = None):
         Expression.__init__(self, pos)
@@ -34,6 +34,8 @@ class SpriteGroupRef(Expression):
                     To be used for action2s that have no direct equivalent in the AST
     @type act2: L{Action2}
     """
+    __slots__ = ('name', 'param_list', 'act2')
+
     def __init__(self, name, param_list, pos, act2 = None):
         self.name = name
         self.param_list = param_list
@@ -44,6 +44,8 @@ class StorageOp(Expression):
     @type grfid: L{Expression}
 
     """
+    __slots__ = ('name', 'info', 'register', 'value', 'grfid')
+
     def __init__(self, name, args, pos = None):
         Expression.__init__(self, pos)
         self.name = name
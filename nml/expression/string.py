@@ -19,6 +19,8 @@ from nml import generic
 from functools import reduce
 
 class String(Expression):
+    __slots__ = ('name', 'params')
+
     def __init__(self, params, pos):
         Expression.__init__(self, pos)
         if len(params) == 0:
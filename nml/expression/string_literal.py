@@ -23,6 +23,8 @@ class StringLiteral(Expression):
     @ivar value: Value of the string literal.
     @type value: C{str}
     """
+    __slots__ = ('value',)
+
     def __init__(self, value, pos):
         Expression.__init__(self, pos)
         self.value = value
@@ -17,6 +17,8 @@ from nml import generic
 from .base_expression import Type, Expression, ConstantNumeric
 
 class TernaryOp(Expression):
+    __slots__ = ('guard', 'expr1', 'expr2')
+
     def __init__(self, guard, expr1, expr2, pos):
         Expression.__init__(self, pos)
         self.guard = guard
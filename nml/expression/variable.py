@@ -17,6 +17,8 @@ from nml import generic
 from .base_expression import Type, Expression, ConstantNumeric
 
 class Variable(Expression):
+    __slots__ = ('num', 'shift', 'mask', 'param', 'add', 'div', 'mod', 'extra_params')
+
     def __init__(self, num, shift = None, mask = None, param = None, pos = None):
         Expression.__init__(self, pos)
         self.num = num
@@ -118,6 +118,8 @@ class Position(object):
     @ivar includes: List of file includes
     @type includes: C{list} of L{Position}
     """
+    __slots__ = ('filename', 'includes')
+
     def __init__(self, filename, includes):
         self.filename = filename
         self.includes = includes
@@ -129,6 +131,8 @@ class LinePosition(Position):
     @ivar line_start: Line number (starting with 1) where the position starts.
     @type line_start: C{int}
     """
+    __slots__ = ('line_start',)
+
     def __init__(self, filename, line_start, includes = []):
         Position.__init__(self, filename, includes)
         self.line_start = line_start
@@ -146,6 +150,8 @@ class PixelPosition(Position):
     @ivar ypos: Vertical position of the pixel.
     @type ypos: C{int}
     """
+    __slots__ = ('xpos', 'ypos')
+
     def __init__(self, filename, xpos, ypos):
         Position.__init__(self, filename, [])
         self.xpos = xpos
@@ -158,6 +164,8 @@ class ImageFilePosition(Position):
     """
     Generic (not position-dependant) error with an image file
     """
+    __slots__ = ()
+
     def __init__(self, filename, pos = None):
         poslist = []
         if pos is not None: poslist.append(pos)
@@ -170,6 +178,8 @@ class LanguageFilePosition(Position):
     """
     Generic (not position-dependant) error with a language file.
     """
+    __slots__ = ()
+
     def __init__(self, filename):
         Position.__init__(self, filename, [])
 
@@ -221,7 +231,8 @@ class OnlyOnceError(ScriptError):
 
 class OnlyOnce:
     """
-    Class to enforce that certain objects / constructs appear only once.
+    Class to enforce that certain objects / constructs appear only once,
+    and to issue certain warnings only once.
     """
     seen = {}
 
@@ -236,6 +247,26 @@ class OnlyOnce:
             raise OnlyOnceError(typestr, obj.pos)
         cls.seen[objtype] = None
 
+    @classmethod
+    def is_new_warning(cls, msg, pos):
+        """
+        Check whether a warning is issued for the first time, and remember it.
+
+        @param msg: Warning message.
+        @type  msg: C{str}
+
+        @param pos: Position of the warning, if provided.
+        @type  pos: C{None} or L{Position}
+
+        @return: Whether the same warning was not issued before.
+        @rtype:  C{bool}
+        """
+        key = (msg, str(pos))
+        if key in cls.seen:
+            return False
+        cls.seen[key] = None
+        return True
+
     @classmethod
     def clear(cls):
         cls.seen = {}
@@ -344,10 +375,68 @@ def print_info(msg):
     print(" nmlc info: " + msg)
     show_progress()
 
-def print_warning(msg, pos = None):
+# Number of warnings issued so far, including the ones that were not shown
+warning_count = 0
+
+"""
+Warnings issued while capturing warnings, see L{capture_warnings}.
+C{None} if warnings are printed directly.
+"""
+_captured_warnings = None
+
+def capture_warnings():
+    """
+    Collect warnings instead of printing them, until L{release_warnings} is called.
+    Worker processes use this to let the main process print their warnings.
+    """
+    global _captured_warnings
+    _captured_warnings = []
+
+def release_warnings():
+    """
+    Stop collecting warnings, see L{capture_warnings}.
+
+    @return: The collected warnings, in the order they were issued.
+    @rtype:  C{list} of C{tuple} (C{str}, L{Position} or C{None}, C{bool})
+    """
+    global _captured_warnings
+    warnings = _captured_warnings
+    _captured_warnings = None
+    return warnings
+
+def replay_warnings(warnings):
+    """
+    Output warnings collected by another process, see L{release_warnings}.
+    Warnings that are to be issued only once are checked against the warnings of this process.
+
+    @param warnings: The collected warnings.
+    @type  warnings: C{list} of C{tuple} (C{str}, L{Position} or C{None}, C{bool})
+    """
+    for msg, pos, once in warnings:
+        print_warning(msg, pos, once)
+
+def print_warning(msg, pos = None, once = False):
     """
     Output a warning message to the user.
+
+    @param msg: Warning message.
+    @type  msg: C{str}
+
+    @param pos: Position of the warning, if provided.
+    @type  pos: C{None} or L{Position}
+
+    @param once: Ignore the warning if it was issued before, see L{OnlyOnce.is_new_warning}.
+    @type  once: C{bool}
     """
+    global warning_count
+    if _captured_warnings is not None:
+        # Whether it was issued before is decided when replaying it
+        warning_count += 1
+        _captured_warnings.append((msg, pos, once))
+        return
+    if once and not OnlyOnce.is_new_warning(msg, pos):
+        return
+    warning_count += 1
     if verbosity_level < VERBOSITY_WARNING:
         return
     if pos:
@@ -442,7 +531,8 @@ def find_file(filepath):
                 real_path = os.path.join(path, matches[0])
                 msg = "Path \"{}\" at the file system does not match path \"{}\" given in the input (case mismatch in the last component)"
                 msg = msg.format(real_path, given_path)
-                print_warning(msg)
+                # The same path may be resolved many times, also by every worker process
+                print_warning(msg, once = True)
         elif os.access(path, os.X_OK):
             # Path is only accessible, cannot inspect the file system.
             matches = [comp]
@@ -457,8 +547,23 @@ def find_file(filepath):
 
 cache_root_dir = ".nmlcache"
 
-def set_cache_root_dir(dir):
+def set_cache_root_dir(dir, namespace = None):
+    """
+    Set the directory to store cache files in.
+
+    @param dir: Name of the cache directory.
+    @type  dir: C{str}
+
+    @param namespace: Relative path of a subdirectory for the cache files of a single project,
+                      when several projects share the cache directory. C{None} to use the cache directory itself.
+    @type  namespace: C{str} or C{None}
+    """
+    global cache_root_dir
     cache_root_dir = os.path.abspath(dir)
+    if namespace is not None:
+        # Make sure that the namespace does not leave the cache dir
+        namespace = os.path.splitdrive(os.path.normpath(namespace))[1].replace(os.path.pardir, "__").lstrip(os.sep)
+        cache_root_dir = os.path.join(cache_root_dir, namespace)
     os.makedirs(cache_root_dir, exist_ok=True)
 
 def get_cache_file(sources, extension):
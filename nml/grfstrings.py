@@ -13,7 +13,7 @@ You should have received a copy of the GNU General Public License along
 with NML; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
 
-import os, codecs, glob, re
+import os, codecs, glob, re, hashlib, json, multiprocessing, concurrent.futures
 from nml import generic
 
 def utf8_get_size(char):
@@ -118,10 +118,8 @@ def get_translation(string, lang_id = DEFAULT_LANGUAGE):
     @return: Translation of the given string in the given language.
     @rtype:  C{str}
     """
-    for lang_pair in langs:
-        langid, lang = lang_pair
-        if langid != lang_id: continue
-        if string.name.value not in lang.strings: break
+    lang = langs_by_id.get(lang_id)
+    if lang is not None and string.name.value in lang.strings:
         return lang.get_string(string, lang_id)
     return default_lang.get_string(string, lang_id)
 
@@ -135,6 +133,12 @@ def get_translations(string):
     @return: List of languages that translate the given string.
     @rtype:  C{list} of C{int}
     """
+    # Key on the rendered string, equal strings created by different nodes share an entry
+    key = str(string)
+    translations = translations_cache.get(key)
+    if translations is not None:
+        return translations[:]
+
     translations = []
     for lang_pair in langs:
         langid, lang = lang_pair
@@ -149,7 +153,8 @@ def get_translations(string):
         param_translations = get_translations(param)
         translations.extend([langid for langid in param_translations if not langid in translations])
 
-    return translations
+    translations_cache[key] = translations
+    return translations[:]
 
 def com_parse_comma(val, lang_id):
     val = val.reduce_constant()
@@ -786,6 +791,13 @@ class Language(object):
 
     @ivar strings: Language strings of the file.
     @type strings: C{dict} of
+
+    @ivar parsed_strings: Cache of strings created by L{get_string}, the string
+                          commands of a string are only evaluated once for each
+                          combination of parameters and target language.
+    @type parsed_strings: C{dict} mapping (C{str}, C{int}) to C{str}, the first
+                          item of the key being the string name and parameters
+                          as rendered by L{expression.String.__str__}
     """
     def __init__(self, default):
         self.default = default
@@ -796,6 +808,7 @@ class Language(object):
         self.cases = None
         self.case_map = {}
         self.strings = {}
+        self.parsed_strings = {}
 
     def get_num_plurals(self):
         if self.plural is None: return 0
@@ -930,6 +943,26 @@ class Language(object):
                 if the string is missing from the target language.
         @type lang_id: C{int}
 
+        @return: The created string
+        @rtype: C{str}
+        """
+        key = (str(string), lang_id)
+        parsed_string = self.parsed_strings.get(key)
+        if parsed_string is None:
+            parsed_string = self.parse_string(string, lang_id)
+            self.parsed_strings[key] = parsed_string
+        return parsed_string
+
+    def parse_string(self, string, lang_id):
+        """
+        Create the actual string for a string by name/params, see L{get_string}.
+
+        @param string: String object
+        @type string: L{expression.String}
+
+        @param lang_id: Language ID we are actually looking for.
+        @type lang_id: C{int}
+
         @return: The created string
         @rtype: C{str}
         """
@@ -1186,6 +1219,17 @@ class Language(object):
 default_lang = Language(True)
 default_lang.langid = DEFAULT_LANGUAGE
 langs = []
+langs_by_id = {}
+
+# Mapping of rendered strings (name and parameters) to the list of languages that translate them, see get_translations
+translations_cache = {}
+
+# Version of the language cache files. Increase when the layout of Language,
+# NewGRFString or StringCommand changes, to invalidate existing caches.
+LANG_CACHE_VERSION = 3
+
+# Minimal number of language files to parse, before using a pool of worker processes
+MIN_PARALLEL_LANG_FILES = 4
 
 def parse_file(filename, default):
     """
@@ -1196,7 +1240,21 @@ def parse_file(filename, default):
 
     @param default: True iff this is the default language.
     @type  default: C{bool}
+
+    @return: A tuple containing the fallback language (only when parsing the
+             default language, else C{None}), the parsed language (C{None} if
+             the file is not usable) and the number of warnings that were issued.
+    @rtype:  C{tuple} of (L{Language} or C{None}, L{Language} or C{None}, C{int})
     """
+    global default_lang
+
+    warning_count = generic.warning_count
+    fallback_lang = None
+    if default:
+        # Strings of the default language are checked against the fallback language while parsing
+        fallback_lang = Language(True)
+        fallback_lang.langid = DEFAULT_LANGUAGE
+        default_lang = fallback_lang
     lang = Language(False)
     try:
         with codecs.open(generic.find_file(filename), "r", "utf-8") as f:
@@ -1205,27 +1263,218 @@ def parse_file(filename, default):
                 line = line.rstrip('\n\r').lstrip('\uFEFF')
                 # The default language is processed twice here. Once as fallback langauge
                 # and once as normal language.
-                if default: default_lang.handle_string(line, pos)
+                if default: fallback_lang.handle_string(line, pos)
                 lang.handle_string(line, pos)
     except UnicodeDecodeError:
         pos = generic.LanguageFilePosition(filename)
         if default:
             raise generic.ScriptError("The default language file contains non-utf8 characters.", pos)
         generic.print_warning("Language file contains non-utf8 characters. Ignoring (part of) the contents.", pos)
+        lang = None
     except generic.ScriptError as err:
         if default: raise
         generic.print_warning(err.value, err.pos)
+        lang = None
     else:
         if lang.langid is None:
             generic.print_warning("Language file does not contain a ##grflangid pragma", generic.LanguageFilePosition(filename))
-        else:
-            for lng in langs:
-                if lng[0] == lang.langid:
-                    msg = "Language file has the same ##grflangid (with number {:d}) as another language file".format(lang.langid)
-                    raise generic.ScriptError(msg, generic.LanguageFilePosition(filename))
-            langs.append((lang.langid, lang))
+            lang = None
+    return fallback_lang, lang, generic.warning_count - warning_count
+
+def get_lang_cache_key(filename, default_key):
+    """
+    Compute the key of the cached parse result of a language file.
+    It covers the contents of the file itself, the default language (which
+    non-default languages are checked against) and the string commands.
+
+    @param filename: The filename of the language file.
+    @type  filename: C{str}
+
+    @param default_key: Cache key of the default language file, C{None} when computing it for the default language.
+    @type  default_key: C{str} or C{None}
+
+    @return: The cache key.
+    @rtype:  C{str}
+    """
+    digest = hashlib.sha1()
+    digest.update(repr((LANG_CACHE_VERSION, filename, default_key)).encode("utf-8"))
+    digest.update(repr(sorted((name, sorted((k, v) for k, v in command.items() if k != 'parse')) for name, command in commands.items())).encode("utf-8"))
+    with open(generic.find_file(filename), "rb") as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+def string_to_data(grf_string):
+    """
+    Convert a parsed string of a language file to plain data, for the language cache.
+
+    @param grf_string: The parsed string.
+    @type  grf_string: L{NewGRFString}
+
+    @return: The string text, line number, gender, cases and components of the string.
+             String commands are stored as dictionaries, text literals as strings.
+    @rtype:  C{dict}
+    """
+    components = []
+    for comp in grf_string.components:
+        if isinstance(comp, StringCommand):
+            comp = {'name': comp.name, 'case': comp.case, 'arguments': comp.arguments, 'offset': comp.offset, 'str_pos': comp.str_pos}
+        components.append(comp)
+    return {
+        'string': grf_string.string,
+        'line': grf_string.pos.line_start,
+        'gender': grf_string.gender,
+        'cases': dict((case, string_to_data(case_string)) for case, case_string in grf_string.cases.items()),
+        'components': components,
+    }
+
+def string_from_data(data, filename):
+    """
+    Rebuild a parsed string of a language file from the data of L{string_to_data}.
+
+    @param data: Plain data of the string.
+    @type  data: C{dict}
+
+    @param filename: The filename of the language file.
+    @type  filename: C{str}
+
+    @return: The parsed string.
+    @rtype:  L{NewGRFString}
+    """
+    pos = generic.LinePosition(filename, int(data['line']))
+    grf_string = NewGRFString.__new__(NewGRFString)
+    grf_string.string = str(data['string'])
+    grf_string.pos = pos
+    grf_string.gender = data['gender']
+    grf_string.cases = dict((case, string_from_data(case_data, filename)) for case, case_data in data['cases'].items())
+    grf_string.components = []
+    for comp in data['components']:
+        if not isinstance(comp, str):
+            command = StringCommand(comp['name'], comp['str_pos'], pos)
+            command.case = comp['case']
+            command.arguments = [str(arg) for arg in comp['arguments']]
+            command.offset = comp['offset']
+            comp = command
+        grf_string.components.append(comp)
+    return grf_string
+
+def language_to_data(lang):
+    """
+    Convert a parsed language file to plain data, for the language cache.
+
+    @param lang: The parsed language, or C{None}.
+    @type  lang: L{Language} or C{None}
 
-def read_lang_files(lang_dir, default_lang_file):
+    @return: The language id, plural form, genders, cases and strings of the language, or C{None}.
+    @rtype:  C{dict} or C{None}
+    """
+    if lang is None:
+        return None
+    return {
+        'default': lang.default,
+        'langid': lang.langid,
+        'plural': lang.plural,
+        'genders': lang.genders,
+        'gender_map': lang.gender_map,
+        'cases': lang.cases,
+        'case_map': lang.case_map,
+        'strings': dict((name, string_to_data(grf_string)) for name, grf_string in lang.strings.items()),
+    }
+
+def language_from_data(data, filename):
+    """
+    Rebuild a parsed language file from the data of L{language_to_data}.
+
+    @param data: Plain data of the language, or C{None}.
+    @type  data: C{dict} or C{None}
+
+    @param filename: The filename of the language file.
+    @type  filename: C{str}
+
+    @return: The parsed language, or C{None}.
+    @rtype:  L{Language} or C{None}
+    """
+    if data is None:
+        return None
+    lang = Language(bool(data['default']))
+    lang.langid = data['langid']
+    lang.plural = data['plural']
+    lang.genders = data['genders']
+    lang.gender_map = data['gender_map']
+    lang.cases = data['cases']
+    lang.case_map = data['case_map']
+    lang.strings = dict((name, string_from_data(string_data, filename)) for name, string_data in data['strings'].items())
+    return lang
+
+def read_lang_cache(filename, key):
+    """
+    Read the parsed contents of a language file from the cache.
+
+    @param filename: The filename of the language file.
+    @type  filename: C{str}
+
+    @param key: Cache key of the language file, see L{get_lang_cache_key}.
+    @type  key: C{str}
+
+    @return: The cached result of L{parse_file}, or C{None} if there is no valid cache.
+    @rtype:  C{tuple} or C{None}
+    """
+    cache_filename = generic.get_cache_file([filename], ".lngcache")
+    if not os.access(cache_filename, os.R_OK):
+        return None
+    try:
+        with open(cache_filename, "r", encoding = "utf-8") as f:
+            cache = json.load(f)
+        assert isinstance(cache, dict) and cache.get('version') == LANG_CACHE_VERSION
+        if cache.get('key') != key:
+            return None
+        return language_from_data(cache['fallback'], filename), language_from_data(cache['lang'], filename), 0
+    except Exception:
+        generic.print_warning(cache_filename + " contains invalid data, ignoring.")
+        return None
+
+def write_lang_cache(filename, key, result):
+    """
+    Store the parsed contents of a language file in the cache.
+    Results that issued warnings are not cached, so the warnings are repeated on the next run.
+
+    @param filename: The filename of the language file.
+    @type  filename: C{str}
+
+    @param key: Cache key of the language file, see L{get_lang_cache_key}.
+    @type  key: C{str}
+
+    @param result: Result of L{parse_file}.
+    @type  result: C{tuple}
+    """
+    if result[2] > 0:
+        return
+    cache_filename = generic.get_cache_file([filename], ".lngcache")
+    cache = {'version': LANG_CACHE_VERSION, 'key': key, 'fallback': language_to_data(result[0]), 'lang': language_to_data(result[1])}
+    # Write to a temporary file first, other nmlc processes may be reading the cache concurrently
+    tmp_filename = "{}.{:d}.tmp".format(cache_filename, os.getpid())
+    with open(tmp_filename, "w", encoding = "utf-8") as f:
+        json.dump(cache, f)
+    os.replace(tmp_filename, cache_filename)
+
+def parse_file_in_worker(filename):
+    """
+    Parse a non-default language file in a worker process, see L{read_lang_files}.
+    The worker is forked, so it shares the default language and all settings.
+
+    @param filename: The filename of the file to parse.
+    @type  filename: C{str}
+
+    @return: The result of L{parse_file}, and the warnings issued while parsing.
+    @rtype:  C{tuple} of (C{tuple}, C{list} of C{tuple} (C{str}, L{Position} or C{None}, C{bool}))
+    """
+    generic.capture_warnings()
+    try:
+        result = parse_file(filename, False)
+    finally:
+        warnings = generic.release_warnings()
+    return result, warnings
+
+def read_lang_files(lang_dir, default_lang_file, enable_cache = False):
     """
     Read the language files containing the translations for string constants
     used in the NML specification.
@@ -1237,15 +1486,59 @@ def read_lang_files(lang_dir, default_lang_file):
                               default translation which will be used as
                               fallback for other languages.
     @type  default_lang_file: C{str}
+
+    @param enable_cache: Read and store parsed language files in the cache directory.
+    @type  enable_cache: C{bool}
     """
-    global DEFAULT_LANGNAME
+    global DEFAULT_LANGNAME, default_lang
 
     DEFAULT_LANGNAME = default_lang_file
     if not os.path.exists(lang_dir + os.sep + default_lang_file):
         generic.print_warning("Default language file \"{}\" doesn't exist".format(os.path.join(lang_dir, default_lang_file)))
         return
-    parse_file(lang_dir + os.sep + default_lang_file, True)
+
+    filename = lang_dir + os.sep + default_lang_file
+    default_key = get_lang_cache_key(filename, None) if enable_cache else None
+    result = read_lang_cache(filename, default_key) if enable_cache else None
+    if result is None:
+        result = parse_file(filename, True)
+        if enable_cache: write_lang_cache(filename, default_key, result)
+    default_lang = result[0]
+    lang_files = [(filename, result)]
+
+    # Language files only depend on the default language, parse all others independently
+    to_parse = []
     for filename in glob.glob(lang_dir + os.sep + "*.lng"):
         if filename.endswith(default_lang_file): continue
-        parse_file(filename, False)
+        key = get_lang_cache_key(filename, default_key) if enable_cache else None
+        result = read_lang_cache(filename, key) if enable_cache else None
+        if result is None:
+            to_parse.append((filename, key))
+        lang_files.append((filename, result))
+
+    # Workers must be forked to share the default language, the settings and the compiler state
+    if len(to_parse) >= MIN_PARALLEL_LANG_FILES and (os.cpu_count() or 1) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        parsed = []
+        with concurrent.futures.ProcessPoolExecutor(mp_context=multiprocessing.get_context('fork')) as executor:
+            # Print the warnings in the same order as when parsing the files one by one
+            for result, warnings in executor.map(parse_file_in_worker, [filename for filename, key in to_parse]):
+                generic.replay_warnings(warnings)
+                parsed.append(result)
+    else:
+        parsed = [parse_file(filename, False) for filename, key in to_parse]
+    parsed = dict((filename, result) for (filename, key), result in zip(to_parse, parsed))
+    if enable_cache:
+        for filename, key in to_parse:
+            write_lang_cache(filename, key, parsed[filename])
+
+    for filename, result in lang_files:
+        if result is None:
+            result = parsed[filename]
+        lang = result[1]
+        if lang is None: continue
+        if lang.langid in langs_by_id:
+            msg = "Language file has the same ##grflangid (with number {:d}) as another language file".format(lang.langid)
+            raise generic.ScriptError(msg, generic.LanguageFilePosition(filename))
+        langs.append((lang.langid, lang))
+        langs_by_id[lang.langid] = lang
     langs.sort()
@@ -0,0 +1,576 @@
+__license__ = """
+NML is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+NML is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with NML; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
+
+import collections, hashlib, json, os, struct, zlib
+from nml import generic, palette, spritecache, version_info
+
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        import Image
+    except ImportError:
+        pass
+
+# Default upper bound of the decoded pixel data kept in memory, in bytes.
+DEFAULT_MAX_DECODED_SIZE = 256 * 1024 * 1024
+
+# Images with a larger decoded size are decoded in strips of rows, if their format allows it.
+DEFAULT_STRIP_THRESHOLD = 64 * 1024 * 1024
+
+# Decoded size of a single strip of rows, in bytes.
+STRIP_SIZE = 16 * 1024 * 1024
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Version of the format of the image information cache file.
+INFO_CACHE_VERSION = 1
+
+# Image modes that can be decoded in strips, mapped to the PNG colour type and the number of bytes per pixel.
+png_strip_modes = {
+    'P':    (3, 1),
+    'RGB':  (2, 3),
+    'RGBA': (6, 4),
+}
+
+class PngStripDecoder(object):
+    """
+    Decoder of non-interlaced 8 bit PNG files, that decodes the rows in consecutive strips.
+    Only one strip is in memory at a time.
+
+    The compressed image data is inflated while reading, the PNG row filters are undone by
+    the PNG decoder of PIL. The last decoded row is prepended unfiltered to the next strip,
+    as the filters of a row refer to the previous row.
+
+    @ivar path: Path of the file at the file system.
+    @type path: C{str}
+
+    @ivar mode: Image mode, one of L{png_strip_modes}.
+    @type mode: C{str}
+
+    @ivar size: Width and height of the image.
+    @type size: C{tuple} of C{int}
+
+    @ivar y: Row to decode next.
+    @type y: C{int}
+    """
+    def __init__(self, path, mode, size):
+        self.path = path
+        self.mode = mode
+        self.size = size
+        self.row_size = size[0] * png_strip_modes[mode][1]
+        self.file = None
+        self.y = 0
+
+    @staticmethod
+    def supports(path, mode):
+        """
+        Check whether an image file can be decoded in strips.
+
+        @param path: Path of the file at the file system.
+        @type  path: C{str}
+
+        @param mode: Image mode, as reported by PIL.
+        @type  mode: C{str}
+
+        @return: Whether the file is a PNG file of a supported type.
+        @rtype:  C{bool}
+        """
+        if mode not in png_strip_modes:
+            return False
+        with open(path, 'rb') as f:
+            header = f.read(len(PNG_SIGNATURE) + 8 + 13)
+        if len(header) < len(PNG_SIGNATURE) + 8 + 13 or not header.startswith(PNG_SIGNATURE) or header[12:16] != b'IHDR':
+            return False
+        bit_depth, colour_type, compression, filter_method, interlace = struct.unpack('>5B', header[24:29])
+        return bit_depth == 8 and colour_type == png_strip_modes[mode][0] and compression == 0 and filter_method == 0 and interlace == 0
+
+    def rewind(self):
+        """
+        Restart decoding at the first row.
+        """
+        self.close()
+        self.file = open(self.path, 'rb')
+        self.file.seek(len(PNG_SIGNATURE))
+        self.idat_remaining = 0
+        self.inflater = zlib.decompressobj()
+        self.prev_row = None
+        self.y = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def read_idat(self):
+        """
+        Read the next piece of compressed image data.
+
+        @return: Compressed data.
+        @rtype:  C{bytes}
+        """
+        while self.idat_remaining == 0:
+            length, chunk_type = struct.unpack('>I4s', self.file.read(8))
+            if chunk_type == b'IEND':
+                raise IOError("PNG image data ends prematurely")
+            if chunk_type == b'IDAT' and length > 0:
+                self.idat_remaining = length
+            else:
+                # Skip other chunks, and their CRC
+                self.file.seek(length + 4, 1)
+        data = self.file.read(min(self.idat_remaining, 1 << 20))
+        if len(data) == 0:
+            raise IOError("PNG image data is truncated")
+        self.idat_remaining -= len(data)
+        if self.idat_remaining == 0:
+            # Skip CRC
+            self.file.seek(4, 1)
+        return data
+
+    def read_filtered_rows(self, num_rows):
+        """
+        Inflate the next rows, including their filter type bytes.
+
+        @param num_rows: Number of rows to read.
+        @type  num_rows: C{int}
+
+        @return: Filtered row data.
+        @rtype:  C{bytearray}
+        """
+        needed = num_rows * (self.row_size + 1)
+        data = bytearray()
+        while len(data) < needed:
+            if self.inflater.unconsumed_tail:
+                compressed = self.inflater.unconsumed_tail
+            else:
+                compressed = self.read_idat()
+            data += self.inflater.decompress(compressed, needed - len(data))
+        return data
+
+    def decode_strip(self, num_rows):
+        """
+        Decode the next strip of rows.
+
+        @param num_rows: Number of rows to decode.
+        @type  num_rows: C{int}
+
+        @return: Decoded rows.
+        @rtype:  L{Image}
+        """
+        data = self.read_filtered_rows(num_rows)
+        height = num_rows
+        if self.prev_row is not None:
+            # Prepend the previous row, with filter type 0 (none)
+            data[0:0] = b'\x00' + self.prev_row
+            height += 1
+        im = Image.frombytes(self.mode, (self.size[0], height), zlib.compress(bytes(data), 0), 'zip', self.mode)
+        if self.prev_row is not None:
+            im = im.crop((0, 1, self.size[0], height))
+        self.prev_row = im.crop((0, num_rows - 1, self.size[0], num_rows)).tobytes()
+        self.y += num_rows
+        return im
+
+    def decode_rows(self, y0, y1):
+        """
+        Decode a range of rows. Decoding is fastest when ranges are requested in increasing order.
+
+        @param y0: First row to decode.
+        @type  y0: C{int}
+
+        @param y1: Row after the last row to decode.
+        @type  y1: C{int}
+
+        @return: Decoded rows.
+        @rtype:  L{Image}
+        """
+        assert 0 <= y0 < y1 <= self.size[1]
+        if self.file is None or y0 < self.y:
+            self.rewind()
+        # Skip rows before the range, they are needed to undo the filters of the later rows.
+        strip_rows = max(1, STRIP_SIZE // max(1, self.row_size))
+        while self.y < y0:
+            self.decode_strip(min(strip_rows, y0 - self.y))
+        return self.decode_strip(y1 - y0)
+
+class ImageInfo(object):
+    """
+    Header information of a source image file.
+
+    @ivar path: Path of the file at the file system.
+    @type path: C{str}
+
+    @ivar mode: Image mode, as reported by PIL (for example C{"P"} or C{"RGBA"}).
+    @type mode: C{str}
+
+    @ivar size: Width and height of the image.
+    @type size: C{tuple} of C{int}
+
+    @ivar palette: Name of the palette (see L{palette.palette_name}),
+                   C{None} if the image has no palette or it has not been validated yet.
+    @type palette: C{str} or C{None}
+
+    @ivar decoded_size: Number of bytes taken by the decoded pixel data.
+    @type decoded_size: C{int}
+
+    @ivar strips: Decoder for reading the image in strips, the top row of the strip decoded last, and that strip.
+                  C{False} if the image is decoded as a whole, C{None} if not decided yet.
+    @type strips: C{list} of (L{PngStripDecoder}, C{int}, L{Image}), C{bool} or C{None}
+    """
+    def __init__(self, path, mode, size, palette = None):
+        self.path = path
+        self.mode = mode
+        self.size = size
+        self.palette = palette
+        self.decoded_size = size[0] * size[1] * Image.getmodebands(mode)
+        self.strips = None
+
+def get_info_cache_key():
+    """
+    Compute the key of the image information cache. It covers the NML version and the
+    palettes, as the validated palette of an image is stored in the cache.
+
+    @return: The cache key.
+    @rtype:  C{str}
+    """
+    digest = hashlib.sha1()
+    digest.update(repr((INFO_CACHE_VERSION, version_info.get_nml_version(), palette.palette_name)).encode("utf-8"))
+    for palette_data in palette.palette_data:
+        digest.update(palette_data)
+    return digest.hexdigest()
+
+class ImageRegistry(object):
+    """
+    Registry of the source image files used by a GRF.
+
+    The palette check and the sprite encoder both go through the registry,
+    so every file is located, opened and validated only once. Decoded images
+    are kept around as long as they fit within L{max_decoded_size}; the least
+    recently used images are dropped first.
+
+    Images larger than L{strip_threshold} are not decoded as a whole, if possible.
+    Instead, the rows covering the requested regions are decoded in strips.
+
+    The header information can be stored in a cache file, together with the fingerprint of
+    the image file (see L{spritecache.get_source_fingerprint}). Unchanged files are then not
+    opened at all, unless sprites have to be encoded from them.
+
+    @ivar max_decoded_size: Upper bound of the decoded pixel data kept in memory, in bytes.
+    @type max_decoded_size: C{int}
+
+    @ivar strip_threshold: Decoded size of an image, from which on it is decoded in strips.
+    @type strip_threshold: C{int}
+
+    @ivar infos: Header information of the files opened so far.
+    @type infos: C{dict} mapping C{str} to L{ImageInfo}
+
+    @ivar images: Pixel data of decoded images, in order of last use (most recent last).
+                  The key is the filename and the translation table applied to the pixels.
+    @type images: C{collections.OrderedDict} mapping C{tuple} of (C{str}, C{bytes} or C{None}) to C{bytes}
+
+    @ivar decoded_size: Total size of the pixel data in L{images}.
+    @type decoded_size: C{int}
+
+    @ivar num_decoded: Number of times an image was decoded.
+    @type num_decoded: C{int}
+
+    @ivar info_cache_filename: Filename of the image information cache, C{None} if caching is disabled.
+    @type info_cache_filename: C{str} or C{None}
+
+    @ivar info_cache_key: Key of the image information cache, see L{get_info_cache_key}.
+    @type info_cache_key: C{str} or C{None}
+
+    @ivar cached_infos: Contents of the image information cache, mapping filenames to
+                        dictionaries with keys 'fingerprint', 'mode', 'size' and 'palette'.
+    @type cached_infos: C{dict} mapping C{str} to C{dict}
+
+    @ivar new_infos: Entries of the image information cache added during this run.
+    @type new_infos: C{dict} mapping C{str} to C{dict}
+    """
+    def __init__(self, max_decoded_size = DEFAULT_MAX_DECODED_SIZE, strip_threshold = DEFAULT_STRIP_THRESHOLD, info_cache_filename = None):
+        self.max_decoded_size = max_decoded_size
+        self.strip_threshold = strip_threshold
+        self.infos = {}
+        self.images = collections.OrderedDict()
+        self.decoded_size = 0
+        self.num_decoded = 0
+        self.info_cache_filename = info_cache_filename
+        self.info_cache_key = get_info_cache_key() if info_cache_filename is not None else None
+        self.cached_infos = {}
+        self.new_infos = {}
+
+    def read_info_cache(self):
+        """
+        Read the image information cache file, if caching is enabled.
+        """
+        if self.info_cache_filename is None or not os.access(self.info_cache_filename, os.R_OK):
+            return
+        try:
+            with open(self.info_cache_filename, 'r', encoding = 'utf-8') as f:
+                cache = json.load(f)
+            # Just assert and print a generic message on errors, like the sprite cache
+            assert isinstance(cache, dict) and cache.get('version') == INFO_CACHE_VERSION
+            if cache.get('key') != self.info_cache_key:
+                # Written by another version of NML, or for other palettes. Start over
+                self.cached_infos = {}
+                return
+            assert isinstance(cache['images'], dict)
+            for filename, entry in cache['images'].items():
+                assert isinstance(entry['fingerprint'], dict)
+                assert isinstance(entry['fingerprint']['size'], int) and isinstance(entry['fingerprint']['mtime_ns'], int)
+                assert isinstance(entry['mode'], str)
+                assert isinstance(entry['size'], list) and len(entry['size']) == 2 and all(isinstance(num, int) for num in entry['size'])
+                assert entry['palette'] is None or entry['palette'] in palette.palette_name
+            self.cached_infos = cache['images']
+        except:
+            generic.print_warning(self.info_cache_filename + " contains invalid data, ignoring. Please remove the file and file a bug report if this warning keeps appearing")
+            self.cached_infos = {}
+
+    def write_info_cache(self):
+        """
+        Write the image information cache file, if caching is enabled and it changed.
+        """
+        if self.info_cache_filename is None or len(self.new_infos) == 0:
+            return
+        # Other processes may have added entries meanwhile, keep those
+        self.read_info_cache()
+        self.cached_infos.update(self.new_infos)
+        index_output = json.JSONEncoder(sort_keys = True).encode({'version': INFO_CACHE_VERSION, 'key': self.info_cache_key, 'images': self.cached_infos})
+        # Write to a temporary file first, other processes may read the cache at the same time
+        os.makedirs(os.path.dirname(self.info_cache_filename) or os.curdir, exist_ok = True)
+        tmp_filename = "{}.{:d}.tmp".format(self.info_cache_filename, os.getpid())
+        with open(tmp_filename, 'w', encoding = 'utf-8') as f:
+            f.write(index_output)
+        os.replace(tmp_filename, self.info_cache_filename)
+        self.new_infos = {}
+
+    def open_file(self, filename):
+        """
+        Open an image file, without decoding the pixel data.
+
+        @param filename: Name of the file, as given in the source.
+        @type  filename: C{str}
+
+        @return: Path of the file, and the opened image.
+        @rtype:  C{tuple} of (C{str}, L{Image})
+        """
+        path = spritecache.get_source_path(filename)
+        try:
+            return path, Image.open(path)
+        except IOError as ex:
+            raise generic.ImageError(str(ex), filename)
+
+    def get_info(self, filename):
+        """
+        Get the header information of an image file.
+
+        Palette images also get their palette validated.
+
+        @param filename: Name of the file, as given in the source.
+        @type  filename: C{str}
+
+        @return: Header information of the file.
+        @rtype:  L{ImageInfo}
+        """
+        info = self.infos.get(filename)
+        if info is not None:
+            return info
+
+        entry = self.cached_infos.get(filename)
+        if entry is not None and spritecache.check_source_fingerprint(filename, entry['fingerprint']):
+            # Trust the cached information, the file did not change
+            info = ImageInfo(spritecache.get_source_path(filename), entry['mode'], tuple(entry['size']), entry['palette'])
+            self.infos[filename] = info
+            fingerprint = spritecache.get_source_fingerprint(filename)
+            if fingerprint['mtime_ns'] != entry['fingerprint']['mtime_ns']:
+                # Only the modification time changed, store it to avoid hashing the file again
+                self.new_infos[filename] = dict(entry, fingerprint = fingerprint)
+            return info
+
+        path, im = self.open_file(filename)
+        try:
+            info = self.add_info(filename, path, im)
+        finally:
+            im.close()
+        return info
+
+    def add_info(self, filename, path, im):
+        """
+        Add the header information of an opened image file, and validate its palette.
+
+        @param filename: Name of the file, as given in the source.
+        @type  filename: C{str}
+
+        @param path: Path of the file at the file system.
+        @type  path: C{str}
+
+        @param im: Opened image file.
+        @type  im: L{Image}
+
+        @return: Header information of the file.
+        @rtype:  L{ImageInfo}
+        """
+        info = ImageInfo(path, im.mode, im.size)
+        if im.mode == "P":
+            info.palette = palette.validate_palette(im, filename)
+        self.infos[filename] = info
+
+        if self.info_cache_filename is not None:
+            self.new_infos[filename] = {
+                'fingerprint': spritecache.get_source_fingerprint(filename),
+                'mode': info.mode,
+                'size': list(info.size),
+                'palette': info.palette,
+            }
+        return info
+
+    def get_image(self, filename):
+        """
+        Decode an image file. The result is not kept, see L{get_pixels}.
+
+        @param filename: Name of the file, as given in the source.
+        @type  filename: C{str}
+
+        @return: Decoded image.
+        @rtype:  L{Image}
+        """
+        path, im = self.open_file(filename)
+        try:
+            im.load()
+        except IOError as ex:
+            raise generic.ImageError(str(ex), filename)
+        self.num_decoded += 1
+
+        if filename not in self.infos:
+            self.add_info(filename, path, im)
+        return im
+
+    def get_pixels(self, filename, table = None):
+        """
+        Get the pixel data of a whole image file, as one contiguous buffer of rows.
+
+        @param filename: Name of the file, as given in the source.
+        @type  filename: C{str}
+
+        @param table: Translation table for the pixel values, applied to the whole image at once.
+        @type  table: C{bytes} of length 256, or C{None}
+
+        @return: Pixel data, with one byte per band.
+        @rtype:  C{bytes}
+        """
+        key = (filename, None if table is None else bytes(table))
+        data = self.images.get(key)
+        if data is not None:
+            self.images.move_to_end(key)
+            return data
+
+        data = self.get_image(filename).tobytes()
+        if table is not None:
+            data = data.translate(table)
+
+        self.images[key] = data
+        self.decoded_size += len(data)
+        # Evict least recently used images, but always keep the requested one.
+        while self.decoded_size > self.max_decoded_size and len(self.images) > 1:
+            old_key, old_data = self.images.popitem(last = False)
+            self.decoded_size -= len(old_data)
+        return data
+
+    def get_region(self, filename, box, table = None):
+        """
+        Get the pixel data of a rectangular region of an image file.
+        Large images are decoded in strips, request regions ordered by their top row to decode every row only once.
+
+        @param filename: Name of the file, as given in the source.
+        @type  filename: C{str}
+
+        @param box: Region as (left, top, right, bottom) tuple, within the bounds of the image.
+        @type  box: C{tuple} of C{int}
+
+        @param table: Translation table for the pixel values.
+        @type  table: C{bytes} of length 256, or C{None}
+
+        @return: Pixel data of the region, with one byte per band.
+        @rtype:  C{bytes}
+        """
+        info = self.get_info(filename)
+        if info.strips is None and info.decoded_size > self.strip_threshold:
+            if PngStripDecoder.supports(info.path, info.mode):
+                info.strips = [PngStripDecoder(info.path, info.mode, info.size), 0, None]
+            else:
+                info.strips = False
+
+        if not info.strips:
+            data = memoryview(self.get_pixels(filename, table))
+            left, top, right, bottom = box
+            bpp = info.decoded_size // (info.size[0] * info.size[1])
+            stride = info.size[0] * bpp
+            if left == 0 and right == info.size[0]:
+                return data[top * stride:bottom * stride].tobytes()
+            start, end = left * bpp, right * bpp
+            return b''.join(data[row + start:row + end] for row in range(top * stride, bottom * stride, stride))
+
+        data = self.get_strip(filename, info, box).tobytes()
+        if table is not None:
+            data = data.translate(table)
+        return data
+
+    def get_strip(self, filename, info, box):
+        """
+        Get a rectangular region of an image file, that is decoded in strips.
+        See L{ImageInfo.strips}.
+
+        @param filename: Name of the file, as given in the source.
+        @type  filename: C{str}
+
+        @param info: Header information of the file.
+        @type  info: L{ImageInfo}
+
+        @param box: Region as (left, top, right, bottom) tuple, within the bounds of the image.
+        @type  box: C{tuple} of C{int}
+
+        @return: Image of the region.
+        @rtype:  L{Image}
+        """
+        left, top, right, bottom = box
+        decoder, strip_top, strip = info.strips
+        strip_bottom = strip_top if strip is None else strip_top + strip.size[1]
+        if top < strip_top or bottom > strip_bottom:
+            # Decode a new strip, starting at the top of the region
+            width = info.size[0]
+            new_bottom = min(info.size[1], max(bottom, top + STRIP_SIZE // (width * png_strip_modes[info.mode][1])))
+            try:
+                if strip_top <= top < strip_bottom and decoder.y == strip_bottom:
+                    # Continue decoding after the previous strip, and reuse the rows it has in common with the new one
+                    new_strip = Image.new(info.mode, (width, new_bottom - top))
+                    new_strip.paste(strip.crop((0, top - strip_top, width, strip_bottom - strip_top)), (0, 0))
+                    new_strip.paste(decoder.decode_rows(strip_bottom, new_bottom), (0, strip_bottom - top))
+                else:
+                    new_strip = decoder.decode_rows(top, new_bottom)
+            except (IOError, zlib.error, struct.error) as ex:
+                raise generic.ImageError(str(ex), filename)
+            strip_top, strip = top, new_strip
+            info.strips = [decoder, strip_top, strip]
+        return strip.crop((left, top - strip_top, right, bottom - strip_top))
+
+    def clear(self):
+        """
+        Drop all decoded images and strips.
+        """
+        self.images.clear()
+        self.decoded_size = 0
+        for info in self.infos.values():
+            if info.strips:
+                info.strips[0].close()
+                info.strips = None
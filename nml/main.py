@@ -13,10 +13,10 @@ You should have received a copy of the GNU General Public License along
 with NML; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
 
-import sys, os, codecs, optparse
-from nml import generic, grfstrings, parser, version_info, output_nml, output_nfo, output_grf, output_dep, palette, spriteencoder, spritecache, global_constants
-from nml.actions import action2layout, action2var, action8, sprite_count, real_sprite, action4, action0, action1, action2, action6, action7, action11, actionF
-from nml.ast import grf, alt_sprites
+import sys, os, codecs, io, optparse, shlex, time, concurrent.futures
+from nml import generic, grfstrings, parser, version_info, output_nml, output_nfo, output_grf, output_dep, imageregistry, spriteencoder, spritecache, global_constants, compilercontext, dependencies
+from nml.actions import action2layout, action2var, action8, sprite_count, real_sprite, action4, action0, action1, action2, action6, action7, action11, actionD, actionF
+from nml.ast import grf, alt_sprites, loop
 
 try:
     from PIL import Image
@@ -28,6 +28,11 @@ except ImportError:
 
 developmode = False # Give 'nice' error message instead of a stack dump.
 
+"""
+Parser shared by all compilations in this process, see L{get_parser}.
+"""
+shared_parser = None
+
 version = version_info.get_nml_version()
 
 def parse_cli(argv):
@@ -43,7 +48,8 @@ def parse_cli(argv):
     opt_parser = optparse.OptionParser(usage=usage, version=version_info.get_cli_version())
     opt_parser.set_defaults(debug=False, crop=False, compress=True, outputs=[], start_sprite_num=0,
                             custom_tags="custom_tags.txt", lang_dir="lang", default_lang="english.lng", cache_dir=".nmlcache",
-                            forced_palette="ANY", quiet=False, md5_filename=None, keep_orphaned=True, verbosity=generic.verbosity_level)
+                            forced_palette="ANY", quiet=False, md5_filename=None, keep_orphaned=True, verbosity=generic.verbosity_level,
+                            reorder_action2=False, optimize_actiond=False, optimize_skips=False, unroll_loops=0, fast_deps=False, output_jobs=1, output_chunk_size=500)
     opt_parser.add_option("-d", "--debug", action="store_true", dest="debug", help="write the AST to stdout")
     opt_parser.add_option("-s", "--stack", action="store_true", dest="stack", help="Dump stack when an error occurs")
     opt_parser.add_option("--grf", dest="grf_filename", metavar="<file>", help="write the resulting grf to <file>")
@@ -52,6 +58,8 @@ def parse_cli(argv):
     opt_parser.add_option("-M", action="store_true", dest="dep_check", help="output a rule suitable for make describing the graphics dependencies of the main grf file (requires input file or --grf)")
     opt_parser.add_option("--MF", dest="dep_filename", metavar="<file>", help="When used with -M, specifies a file to write the dependencies to")
     opt_parser.add_option("--MT", dest="depgrf_filename", metavar="<file>", help="target of the rule emitted by dependency generation (requires -M)")
+    opt_parser.add_option("--fast-deps", action="store_true", dest="fast_deps",
+                        help="When used with -M, find the image, sound and language files in the syntax tree without compiling (requires no other outputs)")
     opt_parser.add_option("-c", action="store_true", dest="crop", help="crop extraneous transparent blue from real sprites")
     opt_parser.add_option("-u", action="store_false", dest="compress", help="save uncompressed data in the grf file")
     opt_parser.add_option("--nml", dest="nml_filename", metavar="<file>", help="write optimized nml to <file>")
@@ -69,13 +77,30 @@ def parse_cli(argv):
     opt_parser.add_option("--quiet", action="store_true", dest="quiet",
                         help="Disable all warnings. Errors will be printed normally.")
     opt_parser.add_option("-n", "--no-cache", action="store_true", dest="no_cache",
-                        help="Disable caching of sprites in .cache[index] files, which may reduce compilation time.")
+                        help="Disable caching of sprites in .cache[index] files and of parsed language files, which may reduce compilation time.")
     opt_parser.add_option("--cache-dir", dest="cache_dir", metavar="<dir>", help="Cache files are stored in directory <dir> [default: %default]")
     opt_parser.add_option("--clear-orphaned", action="store_false", dest="keep_orphaned", help="Remove unused/orphaned items from cache files.")
+    opt_parser.add_option("--reorder-action2", action="store_true", dest="reorder_action2",
+                        help="Reorder adjacent switches and sprite groups to reduce the number of concurrently used Action2 IDs.")
+    opt_parser.add_option("--optimize-actiond", action="store_true", dest="optimize_actiond",
+                        help="Reuse temporary parameters holding identical values, fold constant computations and remove unused ActionDs.")
+    opt_parser.add_option("--optimize-skips", action="store_true", dest="optimize_skips",
+                        help="Thread and merge Action7/9 skips with the same condition and replace Action10 labels by sprite counts where possible. The computations of the conditions are not shared between skips.")
+    opt_parser.add_option("--unroll-loops", type="int", dest="unroll_loops", metavar="<limit>",
+                        help="Unroll while-loops of which the number of iterations is known at compile time and at most <limit> [default: %default]")
+    opt_parser.add_option("--output-jobs", type="int", dest="output_jobs", metavar="<num>",
+                        help="Serialise the GRF output with <num> worker processes, for GRFs with many sprites [default: %default]")
+    opt_parser.add_option("--output-chunk-size", type="int", dest="output_chunk_size", metavar="<num>",
+                        help="Serialise at least <num> actions at once in a worker process, when there are at least four times as many actions [default: %default]")
+    opt_parser.add_option("--duplicate-report", dest="duplicate_report_filename", metavar="<file>",
+                        help="Write a report of real sprites with identical pixel data to <file>")
     opt_parser.add_option("--verbosity", type="int", dest="verbosity", metavar="<level>", help="Set the verbosity level for informational output. [default: %default, max: {}]".format(generic.VERBOSITY_MAX))
 
     opts, args = opt_parser.parse_args(argv)
 
+    if opts.output_chunk_size < 1:
+        opt_parser.error("Error: the output chunk size must be at least 1")
+
     generic.set_verbosity(0 if opts.quiet else opts.verbosity)
     generic.set_cache_root_dir(opts.cache_dir)
     spritecache.keep_orphaned = opts.keep_orphaned
@@ -103,14 +128,24 @@ def main(argv):
 
     if opts.stack: developmode = True
 
-    grfstrings.read_extra_commands(opts.custom_tags)
+    with compilercontext.CompilerContext():
+        ret = compile_file(opts, input_filename)
 
-    generic.print_progress("Reading lang ...")
+    sys.exit(ret)
 
-    grfstrings.read_lang_files(opts.lang_dir, opts.default_lang)
+def compile_file(opts, input_filename):
+    """
+    Compile a single NML file in the active compiler context, see L{compilercontext}.
 
-    generic.clear_progress()
+    @param opts: Options, as returned by L{parse_cli}.
+    @type  opts: C{Object}
 
+    @param input_filename: Filename of the input file, C{None} if receiving from L{sys.stdin}.
+    @type  input_filename: C{str} or C{None}
+
+    @return: Exit code of the compilation.
+    @rtype:  C{int}
+    """
     # We have to do the dependency check first or we might later have
     #   more targets than we asked for
     outputs = []
@@ -165,17 +200,124 @@ def main(argv):
         elif outext == '.dep': outputs.append(output_dep.OutputDEP(output, opts.grf_filename))
         else:
             generic.print_error("Unknown output format {}".format(outext))
-            sys.exit(2)
+            return 2
+
+    if opts.fast_deps and len(outputs) > 0 and all(isinstance(output, output_dep.OutputDEP) for output in outputs):
+        generic.print_progress("Reading ...")
+        script = read_script(input)
+        input.close()
+        # Names registered while searching the syntax tree must not clash with a compilation of the same file
+        with compilercontext.CompilerContext(nested = True):
+            ret = write_dependencies(script, input_filename, outputs, opts.lang_dir, opts.default_lang, not opts.no_cache)
+        if ret is not None:
+            return ret
+        # Compile the script that was read already to find the dependencies
+        input = io.StringIO(script)
+
+    grfstrings.read_extra_commands(opts.custom_tags)
+
+    generic.print_progress("Reading lang ...")
 
-    ret = nml(input, input_filename, opts.debug, outputs, opts.start_sprite_num, opts.compress, opts.crop, not opts.no_cache, opts.forced_palette, opts.md5_filename)
+    grfstrings.read_lang_files(opts.lang_dir, opts.default_lang, not opts.no_cache)
+
+    generic.clear_progress()
+
+    ret = nml(input, input_filename, opts.debug, outputs, opts.start_sprite_num, opts.compress, opts.crop, not opts.no_cache, opts.forced_palette, opts.md5_filename, opts.reorder_action2, opts.duplicate_report_filename, opts.optimize_actiond, opts.optimize_skips, opts.unroll_loops, opts.output_jobs, opts.output_chunk_size)
 
     input.close()
-    sys.exit(ret)
+    return ret
 
 def filename_output_from_input(name, ext):
     return os.path.splitext(name)[0] + ext
 
-def nml(inputfile, input_filename, output_debug, outputfiles, start_sprite_num, compress_grf, crop_sprites, enable_cache, forced_palette, md5_filename):
+def get_parser():
+    """
+    Get the parser, generating the parser tables only once per process.
+
+    @return: The parser.
+    @rtype:  L{parser.NMLParser}
+    """
+    global shared_parser
+    if shared_parser is None:
+        shared_parser = parser.NMLParser()
+    return shared_parser
+
+def read_script(inputfile):
+    """
+    Read the contents of an NML file.
+
+    @param inputfile: File handle associated with the input file.
+    @type  inputfile: C{File}
+
+    @return: Contents of the file, without byte order mark.
+    @rtype:  C{str}
+    """
+    try:
+        script = inputfile.read()
+    except UnicodeDecodeError as ex:
+        raise generic.ScriptError('Input file is not utf-8 encoded: {}'.format(ex))
+    # Strip a possible BOM
+    return script.lstrip(str(codecs.BOM_UTF8, "utf-8"))
+
+def write_dependencies(script, input_filename, outputfiles, lang_dir, default_lang, enable_cache):
+    """
+    Write the dependencies of an NML file, found in its syntax tree without generating any actions.
+    See L{dependencies.get_ast_dependencies}.
+
+    @param script: Contents of the input file, see L{read_script}.
+    @type  script: C{str}
+
+    @param input_filename: Filename of the input file, C{None} if receiving from L{sys.stdin}
+    @type  input_filename: C{str} or C{None}
+
+    @param outputfiles: Dependency outputs to write to.
+    @type  outputfiles: C{List} of L{output_dep.OutputDEP}
+
+    @param lang_dir: Name of the directory containing the language files.
+    @type  lang_dir: C{str}
+
+    @param default_lang: Filename of the language file with the default translation.
+    @type  default_lang: C{str}
+
+    @param enable_cache: Read and store the dependencies of the input file in the cache directory.
+    @type  enable_cache: C{bool}
+
+    @return: Exit code, or C{None} if the dependencies can only be found by compiling the file.
+    @rtype:  C{int} or C{None}
+    """
+    generic.OnlyOnce.clear()
+
+    if script.strip() == "":
+        generic.print_error("Empty input file")
+        return 4
+
+    # The dependencies only change with the source, which is cheap to hash compared to parsing it
+    enable_cache = enable_cache and input_filename is not None
+    key = dependencies.get_cache_key(script, version)
+    files = dependencies.read_cache(input_filename, key) if enable_cache else None
+    if files is None:
+        generic.print_progress("Parsing ...")
+
+        result = get_parser().parse(script, input_filename if input_filename is not None else 'input')
+        result.validate([])
+        result.register_names()
+        files = dependencies.get_ast_dependencies(result)
+        if files is None:
+            generic.clear_progress()
+            return None
+        if enable_cache: dependencies.write_cache(input_filename, key, files)
+
+    files = files + dependencies.get_lang_files(lang_dir, default_lang)
+    for outputfile in outputfiles:
+        outputfile.open()
+        for f in files:
+            outputfile.write(f)
+        outputfile.close()
+
+    generic.clear_progress()
+    return 0
+
+def nml(inputfile, input_filename, output_debug, outputfiles, start_sprite_num, compress_grf, crop_sprites, enable_cache, forced_palette, md5_filename, reorder_action2 = False, duplicate_report_filename = None, optimize_actiond = False, optimize_skips = False, unroll_loops = 0, output_jobs = 1, output_chunk_size = 500):
     """
     Compile an NML file.
 
@@ -205,17 +347,33 @@ def nml(inputfile, input_filename, output_debug, outputfiles, start_sprite_num,
 
     @param md5_filename: Filename to use for writing the md5 sum of the grf file. C{None} if the file should not be written.
     @type  md5_filename: C{str} or C{None}
+
+    @param reorder_action2: Reorder Action2s to reduce the number of concurrently used Action2 IDs.
+    @type  reorder_action2: C{bool}
+
+    @param duplicate_report_filename: Filename to write a report of sprites with identical pixel data to. C{None} if the report should not be written.
+    @type  duplicate_report_filename: C{str} or C{None}
+
+    @param optimize_actiond: Optimize the computations done by ActionDs, see L{actionD.optimize_parameters}.
+    @type  optimize_actiond: C{bool}
+
+    @param optimize_skips: Optimize the Action7/9 skips and Action10 labels, see L{action7.optimize_skips}.
+    @type  optimize_skips: C{bool}
+
+    @param unroll_loops: Maximum number of iterations of while-loops to unroll at compile time, 0 to disable, see L{loop.Loop.get_iteration_count}.
+    @type  unroll_loops: C{int}
+
+    @param output_jobs: Maximum number of worker processes to serialise the GRF output with, see L{output_grf.write_parallel}.
+    @type  output_jobs: C{int}
+
+    @param output_chunk_size: Minimal number of actions serialised at once by a worker process, see L{output_grf.can_write_parallel}.
+    @type  output_chunk_size: C{int}
     """
     generic.OnlyOnce.clear()
 
     generic.print_progress("Reading ...")
 
-    try:
-        script = inputfile.read()
-    except UnicodeDecodeError as ex:
-        raise generic.ScriptError('Input file is not utf-8 encoded: {}'.format(ex))
-    # Strip a possible BOM
-    script = script.lstrip(str(codecs.BOM_UTF8, "utf-8"))
+    script = read_script(inputfile)
 
     if script.strip() == "":
         generic.print_error("Empty input file")
@@ -223,7 +381,7 @@ def nml(inputfile, input_filename, output_debug, outputfiles, start_sprite_num,
 
     generic.print_progress("Init parser ...")
 
-    nml_parser = parser.NMLParser()
+    nml_parser = get_parser()
     if input_filename is None:
         input_filename = 'input'
 
@@ -245,7 +403,12 @@ def nml(inputfile, input_filename, output_debug, outputfiles, start_sprite_num,
 
     result.register_names()
     result.pre_process()
+    loop.unroll_limit = unroll_loops
     tmp_actions = result.get_action_list()
+    if unroll_loops > 0:
+        generic.print_info("Loop unrolling: unrolled {}/{} while-loops".format(*loop.loop_stats))
+    # The actions keep what they need of the syntax tree, release the rest
+    del result
 
     generic.print_progress("Generating actions ...")
 
@@ -255,38 +418,53 @@ def nml(inputfile, input_filename, output_debug, outputfiles, start_sprite_num,
             actions.extend(action.get_action_list())
         else:
             actions.append(action)
+    del tmp_actions
     actions.extend(action11.get_sound_actions())
 
+    if optimize_actiond:
+        generic.print_progress("Optimizing ActionDs ...")
+        actions = actionD.optimize_parameters(actions)
+
+    if optimize_skips:
+        generic.print_progress("Optimizing skips ...")
+        actions = action7.optimize_skips(actions)
+
     generic.print_progress("Assigning Action2 registers ...")
 
+    action2.allocate_tmp_storage(actions)
+
     action8_index = -1
-    for i in range(len(actions) - 1, -1, -1):
-        if isinstance(actions[i], (action2var.Action2Var, action2layout.Action2Layout)):
-            actions[i].resolve_tmp_storage()
-        elif isinstance(actions[i], action8.Action8):
+    for i, action in enumerate(actions):
+        if isinstance(action, action8.Action8):
             action8_index = i
+            break
 
     generic.print_progress("Generating strings ...")
 
+    # The language actions are written directly after the Action8, see iter_output_actions
+    lang_actions = []
     if action8_index != -1:
-        lang_actions = []
         # Add plural/gender/case tables
         for lang_pair in grfstrings.langs:
             lang_id, lang = lang_pair
             lang_actions.extend(action0.get_language_translation_tables(lang))
         # Add global strings
         lang_actions.extend(action4.get_global_string_actions())
-        actions = actions[:action8_index + 1] + lang_actions + actions[action8_index + 1:]
 
     generic.print_progress("Collecting real sprites ...")
 
+    # Header information of the source images; when caching, unchanged images are not opened at all
+    info_cache_filename = os.path.join(generic.cache_root_dir, "imageinfo.json") if enable_cache else None
+    images = imageregistry.ImageRegistry(info_cache_filename = info_cache_filename)
+    images.read_info_cache()
+
     # Collect all sprite files, and put them into buckets of same image and mask files
     sprite_files = dict()
     for action in actions:
         if isinstance(action, real_sprite.RealSpriteAction):
             for sprite in action.sprite_list:
                 if sprite.is_empty: continue
-                sprite.validate_size()
+                sprite.validate_size(images)
 
                 file = sprite.file
                 if file is not None:
@@ -314,6 +492,7 @@ def nml(inputfile, input_filename, output_debug, outputfiles, start_sprite_num,
         skip_sprite_processing &= outputfile.skip_sprite_checks()
 
     if skip_sprite_processing:
+        images.write_info_cache()
         generic.clear_progress()
         return 0
 
@@ -331,13 +510,9 @@ def nml(inputfile, input_filename, output_debug, outputfiles, start_sprite_num,
         if f is None:
             f = f_pair[0]
 
-        try:
-            im = Image.open(generic.find_file(f))
-        except IOError as ex:
-            raise generic.ImageError(str(ex), f)
-        if im.mode != "P":
+        pal = images.get_info(f).palette
+        if pal is None:
             continue
-        pal = palette.validate_palette(im, f)
 
         if forced_palette != "ANY" and pal != forced_palette and not (forced_palette == "DEFAULT" and pal == "LEGACY"):
             raise generic.ImageError("Image has '{}' palette, but you forced the '{}' palette".format(pal, used_palette), f)
@@ -359,7 +534,7 @@ def nml(inputfile, input_filename, output_debug, outputfiles, start_sprite_num,
         outputfile.palette = used_palette # used by RecolourSpriteAction
         if isinstance(outputfile, output_grf.OutputGRF):
             if encoder is None:
-                encoder = spriteencoder.SpriteEncoder(compress_grf, crop_sprites, enable_cache, used_palette)
+                encoder = spriteencoder.SpriteEncoder(compress_grf, crop_sprites, enable_cache, used_palette, images)
             outputfile.encoder = encoder
 
     generic.clear_progress()
@@ -367,6 +542,10 @@ def nml(inputfile, input_filename, output_debug, outputfiles, start_sprite_num,
     # Read all image data, compress, and store in sprite cache
     if encoder is not None:
         encoder.open(sprite_files)
+        if duplicate_report_filename is not None:
+            encoder.write_duplicate_report(duplicate_report_filename)
+    images.write_info_cache()
+    del sprite_files
 
     #If there are any 32bpp sprites hint to openttd that we'd like a 32bpp blitter
     if alt_sprites.any_32bpp_sprites:
@@ -374,12 +553,21 @@ def nml(inputfile, input_filename, output_debug, outputfiles, start_sprite_num,
 
     generic.print_progress("Linking actions ...")
 
+    # Only Action2s are reordered, within runs of Action2s, so the Action8 keeps its index
+    actions = action2.allocate_ids(actions, reorder_action2)
+
+    num_actions = len(actions) + len(lang_actions)
+    sprite_count_action = None
     if action8_index != -1:
-        actions = [sprite_count.SpriteCountAction(len(actions))] + actions
+        sprite_count_action = sprite_count.SpriteCountAction(num_actions)
+        num_actions += 1
 
-    for idx, action in enumerate(actions):
-        num = start_sprite_num + idx
+    # Prepare all actions before writing any output, so errors are reported before the outputs are touched
+    prepared_actions = []
+    for num, action in enumerate(iter_output_actions(actions, action8_index, lang_actions, sprite_count_action), start_sprite_num):
         action.prepare_output(num)
+        prepared_actions.append(action)
+    del actions, lang_actions
 
     # Processing finished, print some statistics
     action0.print_stats()
@@ -395,21 +583,29 @@ def nml(inputfile, input_filename, output_debug, outputfiles, start_sprite_num,
 
     generic.print_progress("Writing output ...")
 
+    sprite_outputs = [outputfile for outputfile in outputfiles if isinstance(outputfile, (output_grf.OutputGRF, output_nfo.OutputNFO))]
+    for outputfile in sprite_outputs:
+        outputfile.open()
+    grf_outputs = [outputfile for outputfile in sprite_outputs if isinstance(outputfile, output_grf.OutputGRF)]
+    if len(grf_outputs) > 0 and output_grf.can_write_parallel(num_actions, output_jobs, output_chunk_size):
+        # The worker processes serialise the prepared actions, the other outputs are written afterwards
+        output_grf.write_parallel(prepared_actions, grf_outputs, output_jobs, output_chunk_size)
+        sprite_outputs_left = [outputfile for outputfile in sprite_outputs if outputfile not in grf_outputs]
+    else:
+        sprite_outputs_left = sprite_outputs
+    # Write the actions one by one, each action is released once it has been written
+    prepared_actions.reverse()
+    while len(prepared_actions) > 0:
+        action = prepared_actions.pop()
+        for outputfile in sprite_outputs_left:
+            action.write(outputfile)
+
     md5 = None
-    for outputfile in outputfiles:
+    for outputfile in sprite_outputs:
+        outputfile.close()
         if isinstance(outputfile, output_grf.OutputGRF):
-            outputfile.open()
-            for action in actions:
-                action.write(outputfile)
-            outputfile.close()
             md5 = outputfile.get_md5()
 
-        if isinstance(outputfile, output_nfo.OutputNFO):
-            outputfile.open()
-            for action in actions:
-                action.write(outputfile)
-            outputfile.close()
-
     if md5 is not None and md5_filename is not None:
         with open(md5_filename, 'w', encoding="utf-8") as f:
             f.write(md5 + '\n')
@@ -420,6 +616,38 @@ def nml(inputfile, input_filename, output_debug, outputfiles, start_sprite_num,
     generic.clear_progress()
     return 0
 
+def iter_output_actions(actions, action8_index, lang_actions, sprite_count_action):
+    """
+    Iterate over the actions in the order they are written to the output.
+    Each action is released by the iteration, as soon as the next one is requested.
+
+    @param actions: All actions, except the language actions and the sprite count.
+    @type  actions: C{list} of L{BaseAction}
+
+    @param action8_index: Index of the Action8 in L{actions}, -1 if there is none.
+    @type  action8_index: C{int}
+
+    @param lang_actions: Language actions, written directly after the Action8.
+    @type  lang_actions: C{list} of L{BaseAction}
+
+    @param sprite_count_action: Action with the number of sprites, written first. C{None} to omit it.
+    @type  sprite_count_action: L{SpriteCountAction} or C{None}
+
+    @return: Iterator over the actions.
+    @rtype:  C{generator} of L{BaseAction}
+    """
+    if sprite_count_action is not None:
+        yield sprite_count_action
+    for i in range(len(actions)):
+        action = actions[i]
+        actions[i] = None
+        yield action
+        if i == action8_index:
+            for j in range(len(lang_actions)):
+                action = lang_actions[j]
+                lang_actions[j] = None
+                yield action
+
 def run():
     try:
         main(sys.argv[1:])
@@ -478,5 +706,115 @@ def run():
     sys.exit(0)
 
 
+def read_manifest(manifest_filename):
+    """
+    Read a manifest of projects to compile in a batch.
+    Each line contains the directory of a project, followed by the command line
+    arguments of L{main} for that project. Empty lines and lines starting with '#' are ignored.
+
+    @param manifest_filename: Filename of the manifest.
+    @type  manifest_filename: C{str}
+
+    @return: Directories (relative to the current directory), directories as written in
+             the manifest, and arguments of the projects.
+    @rtype:  C{list} of C{tuple} (C{str}, C{str}, C{list} of C{str})
+    """
+    projects = []
+    base_dir = os.path.dirname(manifest_filename)
+    with open(manifest_filename, 'r', encoding='utf-8') as f:
+        for line_num, line in enumerate(f, 1):
+            if line.strip() == "" or line.lstrip().startswith('#'): continue
+            try:
+                args = shlex.split(line)
+            except ValueError as ex:
+                raise generic.ScriptError("Invalid project: {}".format(ex), generic.LinePosition(manifest_filename, line_num))
+            projects.append((os.path.join(base_dir, args[0]), args[0], args[1:]))
+    return projects
+
+def compile_project(directory, cache_namespace, argv):
+    """
+    Compile a single project of a batch in a fresh compiler context.
+    Run by the worker processes of L{run_batch}.
+
+    @param directory: Directory of the project, the compilation runs inside it.
+    @type  directory: C{str}
+
+    @param cache_namespace: Subdirectory of the cache directory for the project, when the
+                            cache directory is outside of the project and may be shared.
+    @type  cache_namespace: C{str}
+
+    @param argv: Command line arguments of the project, see L{main}.
+    @type  argv: C{list} of C{str}
+
+    @return: Exit code of the compilation, and the time it took in seconds.
+    @rtype:  C{tuple} (C{int}, C{float})
+    """
+    start_time = time.perf_counter()
+    cwd = os.getcwd()
+    try:
+        os.chdir(directory)
+    except OSError as ex:
+        generic.print_error("{}: {}".format(directory, ex))
+        return 1, time.perf_counter() - start_time
+    try:
+        opts, input_filename = parse_cli(argv)
+        if not os.path.normcase(generic.cache_root_dir + os.sep).startswith(os.path.normcase(os.getcwd() + os.sep)):
+            # Projects sharing a cache directory must not overwrite each other's cache files.
+            # The directory in the manifest does not depend on where the projects are checked out.
+            generic.set_cache_root_dir(opts.cache_dir, cache_namespace)
+        # Progress output of concurrently compiled projects would be garbled
+        generic.set_verbosity(min(generic.verbosity_level, generic.VERBOSITY_INFO))
+        with compilercontext.CompilerContext():
+            ret = compile_file(opts, input_filename)
+    except generic.ScriptError as ex:
+        generic.print_error("{}: {}".format(directory, ex))
+        ret = 1
+    except SystemExit as ex:
+        ret = ex.code if isinstance(ex.code, int) else 1
+    finally:
+        os.chdir(cwd)
+    return ret, time.perf_counter() - start_time
+
+def run_batch():
+    """
+    Compile all projects of a manifest (see L{read_manifest}) concurrently, with a pool
+    of worker processes, and report the result and time of each project.
+    Every worker process imports NML and generates the parser tables only once.
+    """
+    usage = "Usage: %prog [options] <manifest>\n" \
+            "Where <manifest> lists the directory and nmlc arguments of a project per line"
+
+    opt_parser = optparse.OptionParser(usage=usage, version=version_info.get_cli_version())
+    opt_parser.set_defaults(jobs=os.cpu_count() or 1)
+    opt_parser.add_option("-j", "--jobs", type="int", dest="jobs", metavar="<num>", help="Compile <num> projects at the same time [default: %default]")
+    opts, args = opt_parser.parse_args(sys.argv[1:])
+    if len(args) != 1:
+        opt_parser.error("Error: a single manifest file is required")
+
+    try:
+        projects = read_manifest(args[0])
+    except (generic.ScriptError, OSError) as ex:
+        generic.print_error(str(ex))
+        sys.exit(1)
+
+    # Worker processes forked from here inherit the parser, others generate it at start
+    get_parser()
+    start_time = time.perf_counter()
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, opts.jobs), initializer=get_parser) as executor:
+        futures = [executor.submit(compile_project, directory, namespace, argv) for directory, namespace, argv in projects]
+        for (directory, namespace, argv), future in zip(projects, futures):
+            try:
+                ret, duration = future.result()
+            except Exception as ex:
+                generic.print_error("{}: An internal error has occurred: ({}) {}".format(directory, ex.__class__.__name__, ex))
+                ret, duration = 1, 0.0
+            if ret != 0: failed += 1
+            name = os.path.join(directory, argv[-1]) if len(argv) > 0 else directory
+            print("{:<50} {:<6} {:8.2f} s".format(name, "ok" if ret == 0 else "FAILED", duration))
+
+    print("{:d} projects, {:d} failed, {:.2f} s".format(len(projects), failed, time.perf_counter() - start_time))
+    sys.exit(1 if failed > 0 else 0)
+
 if __name__ == "__main__":
     run()
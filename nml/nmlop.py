@@ -67,6 +67,10 @@ class Operator(object):
         self.compiletime_func = compiletime_func
         self.validate_func = validate_func
 
+    def __deepcopy__(self, memo):
+        # Operators are compared by identity, copies of an expression must share them
+        return self
+
     def to_string(self, expr1, expr2):
         """
         Convert expression to readable string form.
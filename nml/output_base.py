@@ -198,6 +198,15 @@ class SpriteOutputBase(OutputBase):
         """
         raise NotImplementedError("Implement print_bytex() in {}".format(type(self)))
 
+    def print_data(self, data):
+        """
+        Output a sequence of unsigned bytes in one go.
+
+        @param data: Values to output.
+        @type  data: C{bytes} or C{array}
+        """
+        raise NotImplementedError("Implement print_data() in {}".format(type(self)))
+
     def print_wordx(self, byte):
         """
         Output an unsigned word (2 bytes).
@@ -13,14 +13,54 @@ You should have received a copy of the GNU General Public License along
 with NML; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
 
-import hashlib, os
+import array, concurrent.futures, hashlib, multiprocessing, os
 from nml import generic, output_base, grfstrings, spriteencoder
 
+class SpriteSectionOutput(output_base.BinaryOutputBase):
+    """
+    Binary output of the sprite section of a GRF file.
+    Sprite payloads are referenced instead of copied, so they are copied only once, to the output file.
+
+    @ivar chunks: Data of the sprite section before L{file}, as headers and referenced payloads.
+    @type chunks: C{list} of C{bytes}-like objects
+    """
+    def open(self):
+        output_base.BinaryOutputBase.open(self)
+        self.chunks = []
+
+    def print_data(self, data):
+        self.byte_count += len(data)
+        self.append_data(data)
+
+    def append_data(self, data):
+        """
+        Append data to the sprite section, without copying it.
+
+        @param data: Data to append, must not be modified afterwards.
+        @type  data: C{bytes}-like object
+        """
+        self.chunks.append(self.file)
+        self.chunks.append(data)
+        self.file = array.array('B')
+
+    def get_chunks(self):
+        """
+        Get the data of the sprite section.
+
+        @return: Data of the sprite section, in order.
+        @rtype:  C{list} of C{bytes}-like objects
+        """
+        return self.chunks + [self.file]
+
+    def discard(self):
+        output_base.BinaryOutputBase.discard(self)
+        self.chunks = []
+
 class OutputGRF(output_base.BinaryOutputBase):
     def __init__(self, filename):
         output_base.BinaryOutputBase.__init__(self, filename)
         self.encoder = None
-        self.sprite_output = output_base.BinaryOutputBase(filename + ".sprite.tmp")
+        self.sprite_output = SpriteSectionOutput(filename + ".sprite.tmp")
         self.md5 = hashlib.md5()
         # sprite_num is deliberately off-by-one because it is used as an
         # id between data and sprite section. For the sprite section an id
@@ -67,7 +107,7 @@ class OutputGRF(output_base.BinaryOutputBase):
         real_file.write(self.file)
         self.md5.update(self.file)
 
-        real_file.write(self.sprite_output.file)
+        real_file.writelines(self.sprite_output.get_chunks())
 
     def open(self):
         output_base.BinaryOutputBase.open(self)
@@ -184,13 +224,8 @@ class OutputGRF(output_base.BinaryOutputBase):
         self.sprite_output.print_byte(0xff)
         self.sprite_output.print_byte(len(name))
         self.print_string(name, force_ascii = True, final_zero = True, stream = self.sprite_output)  # ASCII filenames seems sufficient.
-        fp = open(generic.find_file(filename), 'rb')
-        while True:
-            data = fp.read(1024)
-            if len(data) == 0: break
-            for d in data:
-                self.sprite_output.print_byte(d)
-        fp.close()
+        with open(generic.find_file(filename), 'rb') as fp:
+            self.sprite_output.print_data(fp.read())
 
         self.sprite_output.end_sprite();
         self.end_sprite()
@@ -199,3 +234,113 @@ class OutputGRF(output_base.BinaryOutputBase):
         output_base.BinaryOutputBase.end_sprite(self)
         self.sprite_num += 1
 
+
+    def append_chunk(self, data, sprite_data, num_sprites):
+        """
+        Append the output of a number of sprites, serialised separately by L{write_chunk}.
+
+        @param data: Data section of the sprites.
+        @type  data: C{bytes}
+
+        @param sprite_data: Sprite section of the sprites.
+        @type  sprite_data: C{bytes}
+
+        @param num_sprites: Number of sprites.
+        @type  num_sprites: C{int}
+        """
+        assert not self.in_sprite
+        self.file.frombytes(data)
+        self.sprite_output.append_data(sprite_data)
+        self.sprite_num += num_sprites
+
+"""
+Actions and GRF output of L{write_parallel}, inherited by the forked worker processes.
+"""
+parallel_actions = None
+parallel_output = None
+
+def write_chunk(start, end):
+    """
+    Serialise a contiguous part of the actions of L{write_parallel}, in a worker process.
+
+    @param start: Index of the first action.
+    @type  start: C{int}
+
+    @param end: Index after the last action.
+    @type  end: C{int}
+
+    @return: Data section and sprite section of the actions, and the warnings issued while writing them.
+    @rtype:  C{tuple} of (C{bytes}, C{bytes}, C{list} of C{tuple} (C{str}, L{Position} or C{None}, C{bool}))
+    """
+    output = OutputGRF(parallel_output.filename)
+    output.encoder = parallel_output.encoder
+    output.palette = parallel_output.palette
+    # Every action is a single sprite, like for action.prepare_output
+    output.sprite_num = parallel_output.sprite_num + start
+    output.open()
+    generic.capture_warnings()
+    try:
+        for action in parallel_actions[start:end]:
+            action.write(output)
+    finally:
+        warnings = generic.release_warnings()
+    assert output.sprite_num == parallel_output.sprite_num + end
+    return output.file.tobytes(), b''.join(output.sprite_output.get_chunks()), warnings
+
+def can_write_parallel(num_actions, jobs, chunk_size):
+    """
+    Check whether L{write_parallel} is worth it, and possible at all.
+    Smaller GRFs, with less than four chunks of actions, are written directly.
+
+    @param num_actions: Number of actions to write.
+    @type  num_actions: C{int}
+
+    @param jobs: Maximal number of worker processes.
+    @type  jobs: C{int}
+
+    @param chunk_size: Minimal number of actions serialised by a worker process at once.
+    @type  chunk_size: C{int}
+
+    @return: Whether the actions should be written with L{write_parallel}.
+    @rtype:  C{bool}
+    """
+    # Workers must be forked to share the actions and sprite data, instead of pickling them
+    return jobs >= 2 and num_actions >= 4 * chunk_size and 'fork' in multiprocessing.get_all_start_methods()
+
+def write_parallel(actions, outputfiles, jobs, chunk_size):
+    """
+    Write actions to GRF outputs, serialising contiguous chunks of the actions in worker processes.
+    The chunks are appended in order, so the result is the same as writing the actions one by one.
+    Only to be used if L{can_write_parallel} allows it.
+
+    @param actions: Actions to write, with their output prepared.
+    @type  actions: C{list} of L{BaseAction}
+
+    @param outputfiles: Opened GRF outputs, using the same encoder and palette.
+    @type  outputfiles: C{list} of L{OutputGRF}
+
+    @param jobs: Maximal number of worker processes.
+    @type  jobs: C{int}
+
+    @param chunk_size: Minimal number of actions serialised by a worker process at once.
+    @type  chunk_size: C{int}
+    """
+    global parallel_actions, parallel_output
+
+    # Use a few chunks per worker, to balance the load of chunks with many or few real sprites
+    chunk_size = max(chunk_size, -(-len(actions) // (4 * jobs)))
+    starts = list(range(0, len(actions), chunk_size))
+    ends = starts[1:] + [len(actions)]
+
+    parallel_actions = actions
+    parallel_output = outputfiles[0]
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(starts)), mp_context=multiprocessing.get_context('fork')) as executor:
+            # Print the warnings in the same order as when writing the actions one by one
+            for start, end, (data, sprite_data, warnings) in zip(starts, ends, executor.map(write_chunk, starts, ends)):
+                generic.replay_warnings(warnings)
+                for outputfile in outputfiles:
+                    outputfile.append_chunk(data, sprite_data, end - start)
+    finally:
+        parallel_actions = None
+        parallel_output = None
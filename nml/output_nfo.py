@@ -61,6 +61,11 @@ class OutputNFO(output_base.SpriteOutputBase):
             return
         self.file.write("{:02X} ".format(value))
 
+    def print_data(self, data):
+        assert self.in_sprite
+        self.byte_count += len(data)
+        self.file.write("".join("{:02X} ".format(value) for value in data))
+
     def print_word(self, value):
         value = self.prepare_word(value)
         self.file.write("\\w{:d} ".format(value))
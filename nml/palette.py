@@ -294,11 +294,16 @@ palette_data = [bytes(pal) for pal in raw_palette_data]
 
 palette_name = ["DEFAULT", "LEGACY", "DEFAULT_TOYLAND", "LEGACY_TOYLAND"]
 
+# Look up palettes by their contents, the first palette wins if two are equal.
+palette_lookup = {}
+for pal, name in zip(palette_data, palette_name):
+    palette_lookup.setdefault(pal, name)
+
 def validate_palette(image, filename):
     palette = image.palette.palette
     if len(palette) != 768:
         raise generic.ImageError("Invalid palette; does not contain 256 entries.", filename)
-    for i, pal in enumerate(palette_data):
-        if pal != palette: continue
-        return palette_name[i]
-    raise generic.ImageError("Palette is not recognized as a valid palette.", filename)
+    name = palette_lookup.get(bytes(palette))
+    if name is None:
+        raise generic.ImageError("Palette is not recognized as a valid palette.", filename)
+    return name
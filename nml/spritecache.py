@@ -13,11 +13,125 @@ You should have received a copy of the GNU General Public License along
 with NML; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
 
-import array, json, os
+import array, hashlib, json, os
 from nml import generic
 
 keep_orphaned = True
 
+"""
+Version of the cache index format.
+Index files of older versions are a plain list of sprites, validated by comparing modification times.
+"""
+CACHE_INDEX_VERSION = 2
+
+"""
+Paths of the source image files at the file system, each path is resolved only once.
+The key is the filename as given in the sources.
+"""
+source_paths = {}
+
+def get_source_path(filename):
+    """
+    Get the path of a source image file at the file system, see L{generic.find_file}.
+
+    @param filename: Name of the file, as given in the sources.
+    @type  filename: C{str}
+
+    @return: Path of the file.
+    @rtype:  C{str}
+    """
+    if filename not in source_paths:
+        source_paths[filename] = generic.find_file(filename)
+    return source_paths[filename]
+
+"""
+Size and modification time of the source image files, each file is inspected only once.
+The key is the filename as given in the sources. The value is a (size, mtime_ns)-tuple.
+"""
+source_stats = {}
+
+"""
+Content hashes of the source image files, each file is hashed only once.
+The key is the filename as given in the sources. The value is the hash as hexadecimal C{str},
+or C{None} if the file changed while hashing it.
+"""
+source_hashes = {}
+
+def get_source_stat(filename):
+    """
+    Get the size and modification time of a source image file.
+
+    @param filename: Name of the file, as given in the sources.
+    @type  filename: C{str}
+
+    @return: Size and modification time in nanoseconds.
+    @rtype:  C{tuple} of (C{int}, C{int})
+    """
+    if filename not in source_stats:
+        st = os.stat(get_source_path(filename))
+        source_stats[filename] = (st.st_size, st.st_mtime_ns)
+    return source_stats[filename]
+
+def get_source_hash(filename):
+    """
+    Get a hash of the contents of a source image file.
+
+    @param filename: Name of the file, as given in the sources.
+    @type  filename: C{str}
+
+    @return: Hash of the file contents, or C{None} if the file does not match L{get_source_stat} anymore.
+    @rtype:  C{str} or C{None}
+    """
+    if filename not in source_hashes:
+        digest = hashlib.blake2b(digest_size = 16)
+        with open(get_source_path(filename), 'rb') as f:
+            st = os.fstat(f.fileno())
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        if (st.st_size, st.st_mtime_ns) == get_source_stat(filename):
+            source_hashes[filename] = digest.hexdigest()
+        else:
+            source_hashes[filename] = None
+    return source_hashes[filename]
+
+def get_source_fingerprint(filename):
+    """
+    Compose the fingerprint of a source image file, as stored in the cache index.
+
+    @param filename: Name of the file, as given in the sources.
+    @type  filename: C{str}
+
+    @return: Fingerprint with keys 'size', 'mtime_ns', and 'hash' if available.
+    @rtype:  C{dict}
+    """
+    size, mtime_ns = get_source_stat(filename)
+    fingerprint = {'size': size, 'mtime_ns': mtime_ns}
+    content_hash = get_source_hash(filename)
+    if content_hash is not None:
+        fingerprint['hash'] = content_hash
+    return fingerprint
+
+def check_source_fingerprint(filename, fingerprint):
+    """
+    Check whether a source image file still matches a fingerprint from the cache index.
+    Files with a different modification time are still valid, if their contents did not change.
+
+    @param filename: Name of the file, as given in the sources.
+    @type  filename: C{str}
+
+    @param fingerprint: Fingerprint, as returned by L{get_source_fingerprint}.
+    @type  fingerprint: C{dict}
+
+    @return: Whether the file is unchanged.
+    @rtype:  C{bool}
+    """
+    size, mtime_ns = get_source_stat(filename)
+    if size != fingerprint['size']:
+        return False
+    if mtime_ns == fingerprint['mtime_ns']:
+        return True
+    return 'hash' in fingerprint and get_source_hash(filename) == fingerprint['hash']
+
 class SpriteCache(object):
     """
     Cache for compressed sprites.
@@ -28,17 +142,26 @@ class SpriteCache(object):
     @ivar cache_index_filename: Filename of cache index file.
     @type cache_index_filename: C{str}
 
-    @ivar cache_time: Date of cache files. The cache is invalid, if the source image files are newer.
-    @type cache_time: C{int}
-
     @ivar cached_sprites: Cache contents
     @type cached_sprites: C{dict} mapping cache keys to cache items.
 
+    @ivar sources: Fingerprints of the source image files, as read from the cache index.
+    @type sources: C{dict} mapping C{str} to C{dict}
+
     Cache file format description:
         Format of cache index is JSON (JavaScript Object Notation), which is
         easily readable by both humans (for debugging) and machines. Format is as follows:
 
-        A list of dictionaries, each corresponding to a sprite, with the following keys
+        A dictionary with the following keys
+         - version: Version of the format, see L{CACHE_INDEX_VERSION}
+         - sources: Dictionary mapping the source image files to their fingerprint, a dictionary with keys
+              'size':     Size of the file in bytes.
+              'mtime_ns': Modification time of the file in nanoseconds.
+              'hash':     Hash of the file contents, optional.
+           Sprites of a source file are valid, if size and either the modification time or the hash still match.
+         - sprites: List of sprites
+
+        Each sprite is a dictionary with the following keys
          - rgb_file: filename of the 32bpp sprite (string)
          - rgb_rect: (uncropped) rectangle of the 32bpp sprite (list with 4 elements (x,y,w,h))
          - mask_file, mask_rect: same as above, but for 8bpp sprite
@@ -51,6 +174,7 @@ class SpriteCache(object):
               'alpha': Amount of semi-transparent pixels in 32bpp.
               'white': Amount of pure-white pixels in 8bpp.
               'anim':  Amount of animated pixels in 8bpp.
+         - content: Key of the (cropped) pixel data, see L{spriteencoder.get_content_key}. Optional.
          - offset: Offset into the cache file for this sprite
          - size: Length of this sprite in the cache file
 
@@ -65,11 +189,12 @@ class SpriteCache(object):
         do_crop is a boolean indicating if this sprite has been cropped
         palette is a string identifier
 
-        The value that this key maps to is a 6-tuple, containing:
-         - the sprite data (as a byte array)
+        The value that this key maps to is a 7-tuple, containing:
+         - the sprite data (as a byte array, or a memoryview of the data read from the cache file)
          - The 'info' byte of the sprite
          - The cropping information (see above) (None if 'do_crop' in the key is false)
          - The pixel_stats dictionary with statistics.
+         - The key of the pixel data (None if not known)
          - Whether the sprite exists in the old (loaded)cache
          - whether the sprite is used by the current GRF
 
@@ -80,8 +205,8 @@ class SpriteCache(object):
     def __init__(self, filename):
         self.cache_filename = filename + ".cache"
         self.cache_index_filename = filename + ".cacheindex"
-        self.cache_time = 0
         self.cached_sprites = {}
+        self.sources = {}
 
     def get_item(self, cache_key, palette):
         """
@@ -131,7 +256,7 @@ class SpriteCache(object):
         @type:   C{int}
         """
 
-        return sum(not item[5] for item in self.cached_sprites.values())
+        return sum(not item[6] for item in self.cached_sprites.values())
 
     def read_cache(self):
         """
@@ -143,20 +268,36 @@ class SpriteCache(object):
 
         index_file = open(self.cache_index_filename, 'r')
         cache_file = open(self.cache_filename, 'rb')
-        cache_data = array.array('B')
         cache_size = os.fstat(cache_file.fileno()).st_size
-        cache_data.fromfile(cache_file, cache_size)
+        # Sprites refer to the cache data instead of copying it, it is only copied to the output file
+        cache_data = memoryview(cache_file.read())
         assert cache_size == len(cache_data)
-        self.cache_time = os.path.getmtime(self.cache_filename)
-
-        source_mtime = dict()
 
         try:
             # Just assert and print a generic message on errors, as the cache data should be correct
             # Not asserting could lead to errors later on
             # Also, it doesn't make sense to inform the user about things he shouldn't know about and can't fix
-            sprite_index = json.load(index_file)
+            cache_index = json.load(index_file)
+            if isinstance(cache_index, list):
+                # Old format without fingerprints, valid if the source files are older than the cache.
+                sprite_index = cache_index
+                cache_mtime_ns = os.stat(self.cache_filename).st_mtime_ns
+                valid_source = lambda filename: get_source_stat(filename)[1] <= cache_mtime_ns
+            else:
+                assert isinstance(cache_index, dict) and cache_index.get('version') == CACHE_INDEX_VERSION
+                assert isinstance(cache_index['sources'], dict)
+                for filename, fingerprint in cache_index['sources'].items():
+                    assert isinstance(fingerprint, dict)
+                    assert isinstance(fingerprint['size'], int) and isinstance(fingerprint['mtime_ns'], int)
+                    assert isinstance(fingerprint.get('hash', ''), str)
+                self.sources = cache_index['sources']
+                sprite_index = cache_index['sprites']
+                valid_source = lambda filename: filename in self.sources and check_source_fingerprint(filename, self.sources[filename])
             assert isinstance(sprite_index, list)
+
+            # Check every source file only once
+            source_valid = dict()
+
             for sprite in sprite_index:
                 assert isinstance(sprite, dict)
                 # load RGB (32bpp) data
@@ -208,27 +349,23 @@ class SpriteCache(object):
                 else:
                     pixel_stats = {}
 
+                if 'content' in sprite:
+                    assert isinstance(sprite['content'], str)
+                    content_key = sprite['content']
+                else:
+                    content_key = None
+
                 # Compose value
-                value = (data, info, crop, pixel_stats, True, False)
+                value = (data, info, crop, pixel_stats, content_key, True, False)
 
                 # Check if cache item is still valid
                 is_valid = True
-                if rgb_key[0] is not None:
-                    mtime = source_mtime.get(rgb_key[0])
-                    if mtime is None:
-                        mtime = os.path.getmtime(generic.find_file(rgb_key[0]))
-                        source_mtime[rgb_key[0]] = mtime
-                    
-                    if mtime > self.cache_time:
-                        is_valid = False
-
-                if mask_key[0] is not None:
-                    mtime = source_mtime.get(mask_key[0])
-                    if mtime is None:
-                        mtime = os.path.getmtime(generic.find_file(mask_key[0]))
-                        source_mtime[mask_key[0]] = mtime
-                    
-                    if mtime > self.cache_time:
+                for filename in (rgb_key[0], mask_key[0]):
+                    if filename is None:
+                        continue
+                    if filename not in source_valid:
+                        source_valid[filename] = valid_source(filename)
+                    if not source_valid[filename]:
                         is_valid = False
 
                 # Drop items from older spritecache format without palette entry
@@ -240,6 +377,7 @@ class SpriteCache(object):
         except:
             generic.print_warning(self.cache_index_filename + " contains invalid data, ignoring. Please remove the file and file a bug report if this warning keeps appearing")
             self.cached_sprites = {} # Clear cache
+            self.sources = {}
 
         index_file.close()
         cache_file.close()
@@ -249,6 +387,7 @@ class SpriteCache(object):
         Write the cache data to the .cache[index] files.
         """
         index_data = []
+        sources = {}
         sprite_data = array.array('B')
         offset = 0
 
@@ -256,7 +395,7 @@ class SpriteCache(object):
         for key, value in list(self.cached_sprites.items()):
             # Unpack key/value
             rgb_file, rgb_rect, mask_file, mask_rect, do_crop, mask_pal = key
-            data, info, crop_rect, pixel_stats, in_old_cache, in_use = value
+            data, info, crop_rect, pixel_stats, content_key, in_old_cache, in_use = value
             assert do_crop == (crop_rect is not None)
             assert (mask_file is None) == (mask_pal is None)
 
@@ -272,10 +411,12 @@ class SpriteCache(object):
             if rgb_file is not None:
                 sprite['rgb_file'] = rgb_file
                 sprite['rgb_rect'] = tuple(rgb_rect)
+                sources[rgb_file] = None
             if mask_file is not None:
                 sprite['mask_file'] = mask_file
                 sprite['mask_rect'] = tuple(mask_rect)
                 sprite['mask_pal'] = mask_pal
+                sources[mask_file] = None
 
             size = len(data)
             sprite['offset'] = offset
@@ -283,14 +424,25 @@ class SpriteCache(object):
             sprite['info'] = info
             if do_crop: sprite['crop'] = tuple(crop_rect)
             sprite['pixel_stats'] = pixel_stats
+            if content_key is not None: sprite['content'] = content_key
 
             index_data.append(sprite)
-            sprite_data.extend(data)
+            sprite_data.frombytes(data)
             offset += size
 
+        for filename in sources:
+            fingerprint = self.sources.get(filename)
+            if fingerprint is not None and get_source_stat(filename) == (fingerprint['size'], fingerprint['mtime_ns']):
+                # Unchanged since reading the cache, no need to hash the file again
+                sources[filename] = fingerprint
+            else:
+                # New source file, or the file was touched. Rewrite the index to store the new fingerprint
+                sources[filename] = get_source_fingerprint(filename)
+                old_cache_valid = False
+
         if old_cache_valid: return
 
-        index_output = json.JSONEncoder(sort_keys = True).encode(index_data)
+        index_output = json.JSONEncoder(sort_keys = True).encode({'version': CACHE_INDEX_VERSION, 'sources': sources, 'sprites': index_data})
 
         index_file = open(self.cache_index_filename, 'w')
         index_file.write(index_output)
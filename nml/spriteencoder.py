@@ -13,18 +13,10 @@ You should have received a copy of the GNU General Public License along
 with NML; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
 
-import array
-from nml import generic, palette, lz77, spritecache
+import array, hashlib
+from nml import generic, imageregistry, lz77, spritecache
 from nml.actions import real_sprite
 
-try:
-    from PIL import Image
-except ImportError:
-    try:
-        import Image
-    except ImportError:
-        pass
-
 # Some constants for the 'info' byte
 INFO_RGB    = 1
 INFO_ALPHA  = 2
@@ -39,6 +31,27 @@ def get_bpp(info):
     if (info & INFO_PAL) != 0: bpp += 1
     return bpp
 
+def get_content_key(sprite_data, size_x, size_y, info):
+    """
+    Compose the key of the (cropped) pixel data of a sprite. Sprites with equal keys have equal compressed data.
+
+    @param sprite_data: Pixel data.
+    @type  sprite_data: C{array} of C{int}
+
+    @param size_x: Width of the sprite.
+    @type  size_x: C{int}
+
+    @param size_y: Height of the sprite.
+    @type  size_y: C{int}
+
+    @param info: Info byte of the sprite, without compression flags.
+    @type  info: C{int}
+
+    @return: Key of the pixel data, as stored in the sprite cache index.
+    @rtype:  C{str}
+    """
+    return "{:02X}:{:d}x{:d}:{}".format(info, size_x, size_y, hashlib.blake2b(sprite_data, digest_size = 20).hexdigest())
+
 def has_transparency(info):
     return (info & (INFO_ALPHA | INFO_PAL)) != 0
 
@@ -74,85 +87,184 @@ class SpriteEncoder(object):
     @ivar palette: Palette for encoding, see L{palette.palette_name}.
     @type palette: C{str}
 
-    @ivar cached_image_files: Currently opened source image files.
-    @type cached_image_files: C{dict} mapping C{str} to C{Image}
+    @ivar images: Registry of the source image files.
+    @type images: L{imageregistry.ImageRegistry}
+
+    @ivar compressed_content: Compressed data of the cached and encoded sprites, by content of the (cropped) pixel data.
+    @type compressed_content: C{dict} mapping C{str} (see L{get_content_key}) to C{tuple} of (C{array}, C{int})
+
+    @ivar num_content_dup: Number of encoded sprites, that reused the compressed data of another sprite.
+    @type num_content_dup: C{int}
+
+    @ivar content_groups: Sprites grouped by their compressed data, to find sprites with identical pixel data.
+    @type content_groups: C{dict} mapping C{tuple} to C{list} of C{tuple} (cache key, size of compressed data)
     """
-    def __init__(self, compress_grf, crop_sprites, enable_cache, palette):
+    def __init__(self, compress_grf, crop_sprites, enable_cache, palette, images = None):
         self.compress_grf = compress_grf
         self.crop_sprites = crop_sprites
         self.enable_cache = enable_cache
         self.palette = palette
         self.sprite_cache = spritecache.SpriteCache("")
-        self.cached_image_files = {}
+        self.images = images if images is not None else imageregistry.ImageRegistry()
+        self.compressed_content = {}
+        self.num_content_dup = 0
+        self.content_groups = {}
 
     def open(self, sprite_files):
         """
         Start the encoder, read caches, and stuff.
 
+        Encoding is planned ahead: first all cache keys are resolved, splitting the sprites into
+        cached sprites, duplicates and sprites to encode. Only source images with sprites to encode
+        are opened, most expensive ones first.
+
         @param sprite_files: List of sprites per source image file.
         @type  sprite_files: C{dict} that maps (C{tuple} of C{str}) to (C{RealSprite})
         """
         num_sprites = sum(len(sprite_list) for sprite_list in sprite_files.values())
 
-        generic.print_progress("Encoding ...")
+        generic.print_progress("Reading sprite caches ...")
 
         num_cached = 0
         num_dup = 0
-        num_enc = 0
         num_orphaned = 0
-        count_sprites = 0
+        # Buckets with sprites to encode, as (estimated cost, source name, local cache, sprites and keys to encode)
+        encode_plan = []
         for sources, sprite_list in sprite_files.items():
-            # Iterate over sprites grouped by source image file.
-            #  - Open source files only once. (speed)
-            #  - Do not keep files around for long. (memory)
-
-            source_name = "_".join(src for src in sources if src is not None)
-
             local_cache = spritecache.SpriteCache(generic.get_cache_file(sources, ""))
             if self.enable_cache:
                 local_cache.read_cache()
 
+            to_encode = {}
             for sprite_info in sprite_list:
-                count_sprites += 1
-                generic.print_progress("Encoding {}/{}: {}".format(count_sprites, num_sprites, source_name), incremental = True)
-
                 cache_key = sprite_info.get_cache_key(self.crop_sprites)
                 cache_item = local_cache.get_item(cache_key, self.palette)
 
-                in_use = False
-                in_old_cache = False
-                if cache_item is not None:
-                    # Write a sprite from the cached data
-                    compressed_data, info_byte, crop_rect, pixel_stats, in_old_cache, in_use = cache_item
-                    if in_use:
-                        num_dup += 1
-                    else:
-                        num_cached += 1
+                if cache_key in to_encode:
+                    num_dup += 1
+                elif cache_item is None:
+                    to_encode[cache_key] = sprite_info
+                elif cache_item[6]:
+                    num_dup += 1
                 else:
-                    size_x, size_y, xoffset, yoffset, compressed_data, info_byte, crop_rect, pixel_stats = self.encode_sprite(sprite_info)
-                    num_enc += 1
+                    # Use the cached data, and mark it as in use
+                    compressed_data, info_byte, crop_rect, pixel_stats, content_key, in_old_cache, in_use = cache_item
+                    local_cache.add_item(cache_key, self.palette, (compressed_data, info_byte, crop_rect, pixel_stats, content_key, in_old_cache, True))
+                    if content_key is not None:
+                        # Sprites to encode with the same pixel data can reuse the cached data
+                        self.compressed_content.setdefault(content_key, (compressed_data, info_byte))
+                    self.add_content(sprite_info, cache_key, compressed_data, info_byte, crop_rect)
+                    num_cached += 1
+
+            if len(to_encode) == 0:
+                num_orphaned += self.finish_cache(local_cache)
+            else:
+                cost = sum(sprite_info.xsize.value * sprite_info.ysize.value for sprite_info in to_encode.values())
+                source_name = "_".join(src for src in sources if src is not None)
+                encode_plan.append((cost, source_name, local_cache, to_encode))
 
-                # Store sprite in cache, unless already up-to-date
-                if not in_use:
-                    cache_item = (compressed_data, info_byte, crop_rect, pixel_stats, in_old_cache, True)
-                    local_cache.add_item(cache_key, self.palette, cache_item)
+        # Encode the most expensive source images first
+        encode_plan.sort(key = lambda bucket: bucket[0], reverse = True)
+        num_enc = sum(len(bucket[3]) for bucket in encode_plan)
 
-            # Delete all files from dictionary to free memory
-            self.cached_image_files.clear()
+        generic.print_progress("Encoding ...")
 
-            num_orphaned += local_cache.count_orphaned()
+        count_sprites = 0
+        for cost, source_name, local_cache, to_encode in encode_plan:
+            # Visit the sprites from top to bottom, so large images can be decoded in strips.
+            # The image registry keeps decoded files around for as long as memory permits.
+            for cache_key, sprite_info in sorted(to_encode.items(), key = lambda item: (item[1].ypos.value, item[1].xpos.value)):
+                count_sprites += 1
+                generic.print_progress("Encoding {}/{}: {}".format(count_sprites, num_enc, source_name), incremental = True)
+
+                size_x, size_y, xoffset, yoffset, compressed_data, info_byte, crop_rect, pixel_stats, content_key = self.encode_sprite(sprite_info)
+                local_cache.add_item(cache_key, self.palette, (compressed_data, info_byte, crop_rect, pixel_stats, content_key, False, True))
+                self.add_content(sprite_info, cache_key, compressed_data, info_byte, crop_rect)
 
-            # Only write cache if compression is enabled. Uncompressed data is not worth to be cached.
-            if self.enable_cache and self.compress_grf:
-                local_cache.write_cache()
+            num_orphaned += self.finish_cache(local_cache)
 
-            # Transfer data to global cache for later usage
-            self.sprite_cache.cached_sprites.update(local_cache.cached_sprites)
+        # Encoding is done, free the memory of the decoded images
+        self.images.clear()
 
         generic.print_progress("Encoding ...", incremental = True)
         generic.clear_progress()
         generic.print_info("{} sprites, {} cached, {} orphaned, {} duplicates, {} newly encoded ({})".format(num_sprites, num_cached, num_orphaned, num_dup, num_enc, "native" if lz77.is_native else "python"))
 
+        num_same_content = sum(len(group) - 1 for group in self.content_groups.values())
+        if num_same_content > 0:
+            generic.print_info("{} sprites have the same pixel data as another sprite, {} of them compressed only once".format(num_same_content, self.num_content_dup))
+
+    def finish_cache(self, local_cache):
+        """
+        Write a local sprite cache, and transfer its contents to the global cache.
+
+        @param local_cache: Cache of the sprites of a source image file.
+        @type  local_cache: L{spritecache.SpriteCache}
+
+        @return: Number of orphaned items in the cache.
+        @rtype:  C{int}
+        """
+        # Only write cache if compression is enabled. Uncompressed data is not worth to be cached.
+        if self.enable_cache and self.compress_grf:
+            local_cache.write_cache()
+
+        # Transfer data to global cache for later usage
+        self.sprite_cache.cached_sprites.update(local_cache.cached_sprites)
+        return local_cache.count_orphaned()
+
+    def add_content(self, sprite_info, cache_key, compressed_data, info_byte, crop_rect):
+        """
+        Group a sprite by content. Equal compressed data and sprite size means equal pixel data.
+
+        @param sprite_info: Sprite meta data
+        @type  sprite_info: C{RealSprite}
+
+        @param cache_key: Cache key of the sprite.
+        @type  cache_key: C{tuple}
+
+        @param compressed_data: Compressed data of the sprite.
+        @type  compressed_data: C{array}
+
+        @param info_byte: Info byte of the sprite.
+        @type  info_byte: C{int}
+
+        @param crop_rect: Cropping information of the sprite, if cropped.
+        @type  crop_rect: C{tuple} or C{None}
+        """
+        size_x, size_y = sprite_info.xsize.value, sprite_info.ysize.value
+        if crop_rect is not None:
+            size_x, size_y = self.recompute_offsets(size_x, size_y, 0, 0, crop_rect)[:2]
+        content_key = (info_byte, size_x, size_y, hashlib.blake2b(compressed_data, digest_size = 20).digest())
+        self.content_groups.setdefault(content_key, []).append((cache_key, len(compressed_data)))
+
+    def write_duplicate_report(self, filename):
+        """
+        Write a report of the sprites that have identical pixel data, but different source rectangles or files.
+        Groups are sorted by the amount of data stored more than once.
+
+        @param filename: Name of the report file.
+        @type  filename: C{str}
+        """
+        def describe(cache_key):
+            rgb_file, rgb_rect, mask_file, mask_rect = cache_key[:4]
+            parts = []
+            if rgb_file is not None:
+                parts.append("{} ({:d}, {:d}, {:d}, {:d})".format(rgb_file, *rgb_rect))
+            if mask_file is not None:
+                parts.append("{} ({:d}, {:d}, {:d}, {:d})".format(mask_file, *mask_rect))
+            return " + ".join(parts)
+
+        groups = [group for group in self.content_groups.values() if len(group) > 1]
+        groups.sort(key = lambda group: (len(group) - 1) * group[0][1], reverse = True)
+
+        with open(filename, 'w', encoding = 'utf-8') as f:
+            f.write("# Sprites with identical pixel data\n")
+            f.write("# {:d} groups, {:d} bytes of compressed data stored more than once\n".format(len(groups), sum((len(group) - 1) * group[0][1] for group in groups)))
+            for group in groups:
+                f.write("\n{:d} sprites, {:d} bytes each:\n".format(len(group), group[0][1]))
+                for cache_key, size in sorted(group, key = lambda item: describe(item[0])):
+                    f.write("    {}\n".format(describe(cache_key)))
+
     def close(self):
         """
         Close the encoder, validate data, write caches, and stuff.
@@ -174,7 +286,7 @@ class SpriteEncoder(object):
 
         assert cache_item is not None
 
-        compressed_data, info_byte, crop_rect, pixel_stats, in_old_cache, in_use = cache_item
+        compressed_data, info_byte, crop_rect, pixel_stats, content_key, in_old_cache, in_use = cache_item
 
         size_x = sprite_info.xsize.value
         size_y = sprite_info.ysize.value
@@ -202,24 +314,6 @@ class SpriteEncoder(object):
 
         return (size_x, size_y, xoffset, yoffset, compressed_data, info_byte, crop_rect, warnings)
 
-    def open_image_file(self, filename):
-        """
-        Obtain a handle to an image file
-
-        @param filename: Name of the file
-        @type  filename: C{str}
-
-        @return: Image file
-        @rtype:  L{Image}
-        """
-        if filename in self.cached_image_files:
-            im = self.cached_image_files[filename]
-        else:
-            im = Image.open(generic.find_file(filename))
-            self.cached_image_files[filename] = im
-        return im
-
-
     def encode_sprite(self, sprite_info):
         """
         Crop and compress a real sprite.
@@ -227,7 +321,7 @@ class SpriteEncoder(object):
         @param sprite_info: Sprite meta data
         @type  sprite_info: C{RealSprite}
 
-        @return: size_x, size_y, xoffset, yoffset, compressed_data, info_byte, crop_rect, pixel_stats
+        @return: size_x, size_y, xoffset, yoffset, compressed_data, info_byte, crop_rect, pixel_stats, content_key
         @rtype: C{tuple}
         """
 
@@ -247,7 +341,6 @@ class SpriteEncoder(object):
         xoffset = sprite_info.xrel.value
         yoffset = sprite_info.yrel.value
 
-        im, mask_im = None, None
         im_mask_pal = None
 
         # Select region of image bounded by x/ypos and x/ysize
@@ -263,40 +356,38 @@ class SpriteEncoder(object):
 
         # Read and validate image data
         if filename_32bpp is not None:
-            im = self.open_image_file(filename_32bpp.value)
-            if im.mode not in ("RGB", "RGBA"):
+            rgb_info = self.images.get_info(filename_32bpp.value)
+            if rgb_info.mode not in ("RGB", "RGBA"):
                 pos = generic.build_position(sprite_info.poslist)
                 raise generic.ImageError("32bpp image is not a full colour RGB(A) image.", filename_32bpp.value, pos)
             info_byte |= INFO_RGB
-            if im.mode == "RGBA":
+            if rgb_info.mode == "RGBA":
                 info_byte |= INFO_ALPHA
 
-            (im_width, im_height) = im.size
+            (im_width, im_height) = rgb_info.size
             if x < 0 or y < 0 or x + size_x > im_width or y + size_y > im_height:
                 pos = generic.build_position(sprite_info.poslist)
                 raise generic.ScriptError("Read beyond bounds of image file '{}'".format(filename_32bpp.value), pos)
-            sprite = im.crop((x, y, x + size_x, y + size_y))
-            rgb_sprite_data = sprite.tobytes()
+            rgb_sprite_data = self.images.get_region(filename_32bpp.value, (x, y, x + size_x, y + size_y))
 
             if (info_byte & INFO_ALPHA) != 0:
                 # Check for half-transparent pixels (not valid for ground sprites)
                 pixel_stats['alpha'] = sum(0x00 < p < 0xFF for p in rgb_sprite_data[3::4])
 
         if filename_8bpp is not None:
-            mask_im = self.open_image_file(filename_8bpp.value)
-            if mask_im.mode != "P":
+            mask_info = self.images.get_info(filename_8bpp.value)
+            if mask_info.mode != "P":
                 pos = generic.build_position(sprite_info.poslist)
                 raise generic.ImageError("8bpp image does not have a palette", filename_8bpp.value, pos)
-            im_mask_pal = palette.validate_palette(mask_im, filename_8bpp.value)
+            im_mask_pal = mask_info.palette
             info_byte |= INFO_PAL
 
-            (im_width, im_height) = mask_im.size
+            (im_width, im_height) = mask_info.size
             if mask_x < 0 or mask_y < 0 or mask_x + size_x > im_width or mask_y + size_y > im_height:
                 pos = generic.build_position(sprite_info.poslist)
                 raise generic.ScriptError("Read beyond bounds of image file '{}'".format(filename_8bpp.value), pos)
-            mask_sprite = mask_im.crop((mask_x, mask_y, mask_x + size_x, mask_y + size_y))
-
-            mask_sprite_data = self.palconvert(mask_sprite.tobytes(), im_mask_pal)
+            # Palette conversion is applied to the whole image at once
+            mask_sprite_data = self.images.get_region(filename_8bpp.value, (mask_x, mask_y, mask_x + size_x, mask_y + size_y), self.palette_table(im_mask_pal))
 
             # Check for white pixels; those that cause "artefacts" when shading
             pixel_stats['white'] = sum(p == 255 for p in mask_sprite_data)
@@ -334,6 +425,39 @@ class SpriteEncoder(object):
             crop_rect = None
         assert len(sprite_data) == size_x * size_y * bpp
 
+        # Identical pixel data compresses to identical data, so compress it only once
+        content_key = get_content_key(sprite_data, size_x, size_y, info_byte)
+        if content_key in self.compressed_content:
+            compressed_data, info_byte = self.compressed_content[content_key]
+            self.num_content_dup += 1
+        else:
+            compressed_data, info_byte = self.compress_sprite_data(sprite_data, size_x, size_y, info_byte, bpp)
+            self.compressed_content[content_key] = (compressed_data, info_byte)
+
+        return (size_x, size_y, xoffset, yoffset, compressed_data, info_byte, crop_rect, pixel_stats, content_key)
+
+    def compress_sprite_data(self, sprite_data, size_x, size_y, info_byte, bpp):
+        """
+        Compress the (cropped) pixel data of a sprite.
+
+        @param sprite_data: Pixel data.
+        @type  sprite_data: C{array} of C{int}
+
+        @param size_x: Width of the sprite.
+        @type  size_x: C{int}
+
+        @param size_y: Height of the sprite.
+        @type  size_y: C{int}
+
+        @param info_byte: Info byte of the sprite, without compression flags.
+        @type  info_byte: C{int}
+
+        @param bpp: Number of bytes per pixel.
+        @type  bpp: C{int}
+
+        @return: Compressed data, and the info byte including compression flags.
+        @rtype:  C{tuple} of (C{array} of C{int}, C{int})
+        """
         compressed_data = self.sprite_compress(sprite_data)
         # Try tile compression, and see if it results in a smaller file size
         tile_data = self.sprite_encode_tile(size_x, size_y, sprite_data, info_byte, bpp)
@@ -350,7 +474,7 @@ class SpriteEncoder(object):
                 compressed_data.append((data_len >> 24) & 0xFF)
                 compressed_data.extend(tile_compressed_data)
 
-        return (size_x, size_y, xoffset, yoffset, compressed_data, info_byte, crop_rect, pixel_stats)
+        return compressed_data, info_byte
 
     def fakecompress(self, data):
         i = 0
@@ -497,9 +621,18 @@ class SpriteEncoder(object):
 
         return (data, (left, right, top, bottom))
 
-    def palconvert(self, sprite_str, orig_pal):
+    def palette_table(self, orig_pal):
+        """
+        Get the translation table for converting pixels to the palette of the encoder.
+
+        @param orig_pal: Palette of the source image, see L{palette.palette_name}.
+        @type  orig_pal: C{str}
+
+        @return: Translation table, or C{None} if no conversion is needed.
+        @rtype:  C{bytearray} or C{None}
+        """
         if orig_pal == "LEGACY" and self.palette == "DEFAULT":
-            return sprite_str.translate(real_sprite.translate_w2d)
+            return real_sprite.translate_w2d
         else:
-            return sprite_str
+            return None
 
@@ -0,0 +1,137 @@
+#! /usr/bin/env python3
+"""
+Compile all regression tests after each other in a single process, each in its own
+compiler context, and compare the output to the expected output of separate runs.
+
+Afterwards, all module and class attributes of NML must be unchanged, unless they are
+part of the compilation state (see compilercontext.state_attributes) or a setting of
+the process. Otherwise, state of one compilation would leak into the next one.
+
+Module globals that are not changed by any of the regression tests are not found that
+way, so every module global assigned by a function of NML must be registered as well.
+"""
+
+import ast, filecmp, glob, importlib, inspect, os, pkgutil, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import nml
+from nml import compilercontext, main
+
+"""
+Attributes that are settings of the process, or caches that do not depend on the compiled GRF.
+"""
+process_attributes = {
+    ('nml.generic', 'verbosity_level'),
+    ('nml.generic', 'cache_root_dir'),
+    ('nml.generic', 'progress_message'),
+    ('nml.generic', 'progress_start_time'),
+    ('nml.generic', 'progress_update_time'),
+    ('nml.main', 'developmode'),
+    ('nml.main', 'shared_parser'),
+}
+
+"""
+Attributes that are only set during a single step, and reset afterwards.
+Like any other attribute, they must be unchanged after compiling.
+"""
+transient_attributes = {
+    ('nml.compilercontext', 'active_context'),
+    ('nml.compilercontext', 'active_thread'),
+    ('nml.generic', '_captured_warnings'),
+    ('nml.output_grf', 'parallel_actions'),
+    ('nml.output_grf', 'parallel_output'),
+}
+
+def get_assigned_globals():
+    """
+    Find the module globals that are assigned by functions of NML, i.e. declared
+    with a C{global} statement in a function that assigns to them.
+
+    @return: Pairs of module name and attribute name.
+    @rtype:  C{set} of C{tuple}
+    """
+    assigned = set()
+    for module_info in pkgutil.walk_packages(nml.__path__, 'nml.'):
+        if module_info.name.startswith('nml.ply.'): continue
+        filename = sys.modules[module_info.name].__file__
+        with open(filename, encoding = 'utf-8') as f:
+            tree = ast.parse(f.read(), filename)
+        for function in ast.walk(tree):
+            if not isinstance(function, (ast.FunctionDef, ast.AsyncFunctionDef)): continue
+            declared = set(name for node in ast.walk(function) if isinstance(node, ast.Global) for name in node.names)
+            for node in ast.walk(function):
+                if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store) and node.id in declared:
+                    assigned.add((module_info.name, node.id))
+    return assigned
+
+def get_attributes():
+    """
+    Get the current values of the plain data attributes of all NML modules and their classes.
+
+    @return: Mapping of (module or class name, attribute name) to the value, and its representation.
+    @rtype:  C{dict}
+    """
+    attributes = {}
+    for module_name, module in list(sys.modules.items()):
+        if module is None or not (module_name == 'nml' or module_name.startswith('nml.')): continue
+        owners = [(module_name, module)]
+        owners.extend((module_name + '.' + name, cls) for name, cls in vars(module).items()
+                      if inspect.isclass(cls) and cls.__module__ == module_name)
+        for owner_name, owner in owners:
+            for name, value in list(vars(owner).items()):
+                if name.startswith('__') or inspect.ismodule(value) or inspect.isclass(value) or inspect.isroutine(value): continue
+                if isinstance(value, (property, staticmethod, classmethod)) or inspect.isdatadescriptor(value): continue
+                attributes[(owner_name, name)] = (value, repr(value))
+    return attributes
+
+def is_state(owner_name, name):
+    for owner, names in compilercontext.state_attributes:
+        full_name = owner.__name__ if inspect.ismodule(owner) else owner.__module__ + '.' + owner.__name__
+        if full_name == owner_name and name in names:
+            return True
+    return False
+
+def run():
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    output_dir = os.path.join('output', 'context')
+    os.makedirs(output_dir, exist_ok = True)
+    for module_info in pkgutil.walk_packages(nml.__path__, 'nml.'):
+        importlib.import_module(module_info.name)
+    main.get_parser()
+
+    failed = 0
+    for key in sorted(get_assigned_globals()):
+        if key in process_attributes or key in transient_attributes or is_state(*key): continue
+        print("{}.{}: assigned by a function, but not part of the compilation state".format(*key))
+        failed += 1
+
+    tests = sorted(os.path.splitext(filename)[0] for filename in glob.glob('*.nml'))
+    before = get_attributes()
+    # Compile everything twice, the first round may leave state behind that the second one picks up
+    for round in range(2):
+        for test in tests:
+            outputs = [os.path.join(output_dir, test + ext) for ext in ('.nfo', '.grf')]
+            opts, input_filename = main.parse_cli(['-s', '-c', '--verbosity=1', '--nfo', outputs[0], '--grf', outputs[1], test + '.nml'])
+            with compilercontext.CompilerContext():
+                main.compile_file(opts, input_filename)
+            for output in outputs:
+                expected = os.path.join('expected', os.path.basename(output))
+                if not filecmp.cmp(expected, output, shallow = False):
+                    print("{}: output differs from {}".format(output, expected))
+                    failed += 1
+
+    after = get_attributes()
+    for key, (value, value_repr) in sorted(after.items()):
+        if key in process_attributes or is_state(*key): continue
+        if key not in before:
+            print("{}.{}: created while compiling, but not part of the compilation state".format(*key))
+            failed += 1
+        elif before[key][0] is not value or before[key][1] != value_repr:
+            print("{}.{}: changed while compiling, but not part of the compilation state".format(*key))
+            failed += 1
+
+    sys.exit(1 if failed > 0 else 0)
+
+if __name__ == '__main__':
+    run()
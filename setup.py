@@ -38,7 +38,7 @@ setup(name='nml',
       author='NML Development Team',
       author_email='nml-team@openttdcoop.org',
       entry_points={
-          'console_scripts': ['nmlc = nml.main:run']
+          'console_scripts': ['nmlc = nml.main:run', 'nmlc-batch = nml.main:run_batch']
       },
       ext_modules = [Extension("nml_lz77", ["nml/_lz77.c"], optional=True)],
 )